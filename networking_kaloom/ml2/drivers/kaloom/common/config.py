@@ -26,6 +26,73 @@ kaloom_cfg_opts = [
                help="Kaloom password to authenticate to VFabric controller (as fallback)"),
     cfg.IntOpt('l3_sync_interval', default=180,
                help="Sync interval in seconds between L3 Service plugin and vFabric"),
+    cfg.IntOpt('netconf_recv_size', default=32768, min=1024,
+               help="Bytes read from the vFabric netconf channel on each receive"),
+    cfg.IntOpt('netconf_pool_size', default=2, min=1,
+               help="Netconf sessions to vFabric, shared by Kaloom ML2 and L3 plugins in a neutron-server process"),
+    cfg.StrOpt('netconf_transport', default="ssh", choices=["ssh", "proxy"],
+               help="How neutron-server reaches vFabric netconf: ssh sessions of its own, "
+                    "or through neutron-kaloom-netconf-proxy"),
+    cfg.StrOpt('netconf_ssh_backend', default="paramiko", choices=["paramiko", "openssh"],
+               help="ssh implementation of the vFabric netconf sessions: paramiko in neutron-server, or an "
+                    "OpenSSH client process per session, sharing one ssh connection (ControlMaster), which "
+                    "takes encryption off neutron-server; openssh needs kaloom_private_key_file"),
+    cfg.StrOpt('netconf_proxy_socket', default="/var/lib/neutron/kaloom_netconf_proxy.sock",
+               help="Unix socket of neutron-kaloom-netconf-proxy"),
+    cfg.IntOpt('netconf_cache_ttl', default=30, min=0,
+               help="Seconds a vFabric lookup (termination point of a host, router id, l2 network KNID) "
+                    "is cached by the neutron-server process; 0 disables the cache"),
+    cfg.IntOpt('netconf_cache_size', default=1024, min=1,
+               help="vFabric lookups cached by the neutron-server process, least recently used ones are evicted"),
+    cfg.BoolOpt('netconf_topology_mirror', default=False,
+                help="Keep the OpenStack l2 networks, routers and host termination points of vFabric in "
+                     "neutron-server memory, updated by netconf notifications on a dedicated ssh session, "
+                     "instead of querying vFabric on each lookup; vFabric must support notifications"),
+    cfg.IntOpt('netconf_health_check_interval', default=10, min=0,
+               help="Seconds between health checks of the vFabric netconf sessions, which connects them "
+                    "ahead of use and reconnects dropped ones in the background; 0 disables it"),
+    cfg.IntOpt('netconf_standby_sessions', default=1, min=0,
+               help="Connected netconf sessions kept aside, to take over a dropped session at once; "
+                    "only with netconf_health_check_interval"),
+    cfg.StrOpt('netconf_metrics_sink', default="",
+               help="Where the neutron-server process exports its vFabric netconf metrics (latency of each "
+                    "operation, errors, reply sizes, timeouts, reconnects): statsd://host:port, or "
+                    "file:///path/name.prom for a prometheus text file, %(pid)s is replaced by the process id; "
+                    "empty for none"),
+    cfg.IntOpt('netconf_flight_recorder_size', default=256, min=0,
+               help="Last vFabric netconf rpcs kept in neutron-server memory (operation, msgid, timings, first "
+                    "bytes of request and reply, error), to diagnose slow or failed operations without debug "
+                    "logging; 0 disables it"),
+    cfg.StrOpt('netconf_flight_recorder_signal', default="SIGWINCH",
+               help="Signal on which each neutron-server process (api and rpc workers included) logs its "
+                    "netconf flight recorder, at warning level; not one of neutron-server, e.g. SIGUSR2 of the "
+                    "guru meditation report; empty for none"),
+    cfg.ListOpt('netconf_config_queries', default=['get_l2_network_names'],
+                help="vFabric lookups reading the running configuration only (get-config), instead of "
+                     "configuration and state (get): any of get_l2_network_names, get_l2_network_by_name, "
+                     "get_tp_by_annotation, list_router_name_id, get_router_id_by_name, get_router_interface_info; "
+                     "only for lookups of data configured on vFabric"),
+    cfg.IntOpt('netconf_window', default=16, min=1,
+               help="vFabric rpcs in flight at once on a netconf session; rpcs of neutron API calls are sent "
+                    "first, background ones (L2 cleanup, L3 sync) get at most half of the window"),
+    cfg.IntOpt('netconf_background_rate', default=50, min=0,
+               help="vFabric rpcs per second of background work (L2 cleanup, L3 sync) of the neutron-server "
+                    "process, so that it cannot starve neutron API calls; 0 for no limit"),
+    cfg.IntOpt('netconf_breaker_threshold', default=5, min=0,
+               help="Consecutive failed vFabric rpcs (timeout, dropped or failed session) after which vFabric "
+                    "calls fail at once, instead of pinning a neutron API worker, until vFabric answers a "
+                    "background probe again; 0 disables it"),
+    cfg.IntOpt('netconf_breaker_reset_timeout', default=10, min=1,
+               help="Seconds between background probes of vFabric, once netconf_breaker_threshold is reached"),
+    cfg.IntOpt('netconf_precommit_timeout', default=15, min=0,
+               help="Seconds vFabric calls of a port binding, or of a router operation holding its database "
+                    "lock, may take in total; 0 for the netconf timeout of each rpc only"),
+    cfg.IntOpt('netconf_postcommit_timeout', default=45, min=0,
+               help="Seconds vFabric calls of an ML2 postcommit may take in total; 0 for the netconf timeout "
+                    "of each rpc only"),
+    cfg.IntOpt('netconf_background_timeout', default=300, min=0,
+               help="Seconds vFabric calls of an L2 cleanup or L3 sync pass may take in total; 0 for the "
+                    "netconf timeout of each rpc only"),
 ]
 
 
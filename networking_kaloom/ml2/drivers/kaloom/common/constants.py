@@ -22,6 +22,4 @@ MAX_VLAN_ID = 4094
 MIN_SEGMENT_ID = 2
 MAX_SEGMENT_ID = 2 ** 32 - 1
 
-MSGID_LOCK = 'kaloom_netconf_msgid_lock'
-SESSION_INIT_LOCK = 'kaloom_netconf_session_init_lock' 
 L3_LOCK_NAME = 'L3'
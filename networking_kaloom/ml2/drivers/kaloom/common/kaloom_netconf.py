@@ -11,20 +11,34 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import itertools
+import os
+import re
 import socket
+import time
 
 from oslo_log import log
 from oslo_utils import excutils
-from oslo_concurrency import lockutils
-import xml.dom.minidom
-from lxml import objectify
+from lxml import etree
 
+from eventlet import corolocal
 from eventlet import event
 from eventlet import greenthread
+from eventlet import queue
+from eventlet import semaphore
 from eventlet import Timeout
 import paramiko #neutron/cmd/eventlet/__init__.py already has monkey_patch() that turns blocking chan.recv into non-blocking (green) mode.
 from neutron_lib import worker
-from networking_kaloom.ml2.drivers.kaloom.common import constants as kconst
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_breaker
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_cache
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_metrics
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_openssh
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_recorder
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_framing import TERMINATOR
 
 L2T_NS = "urn:ietf:params:xml:ns:yang:ietf-l2-topology"
 VL2T_NS = "urn:kaloom:faas:vfabric-l2-topology"
@@ -35,6 +49,14 @@ VL3UT_NS = "urn:kaloom:faas:vfabric-l3-unicast-topology"
 VIF_NS = "urn:kaloom:faas:vfabric-interfaces"
 VIP_NS = "urn:kaloom:faas:vfabric-ip"
 VF_NS = "urn:kaloom:faas:virtual-fabric"
+NC_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+VR_NS = "urn:kaloom:faas:vfabric-routing"
+V4UR_NS = "urn:kaloom:faas:vfabric-ipv4-unicast-routing"
+V6UR_NS = "urn:kaloom:faas:vfabric-ipv6-unicast-routing"
+NCN_NS = "urn:ietf:params:xml:ns:netconf:notification:1.0"
+
+NSMAP = {'nc': NC_NS, 'nw': NW_NS, 'nt': NT_NS, 'l2t': L2T_NS, 'vl2t': VL2T_NS,
+         'l3t': L3UT_NS, 'vl3t': VL3UT_NS, 'vif': VIF_NS, 'vip': VIP_NS, 'vf': VF_NS}
 
 TAG_L2_NODE_ATTR = "{" + L2T_NS + "}" + "l2-node-attributes"
 TAG_NW_ATTR_NAME = "{" + L2T_NS + "}" + "name"
@@ -43,6 +65,8 @@ TAG_TP_ATTR = "{" + NT_NS + "}" + "termination-point"
 TAG_TP_ID = "{" + NT_NS + "}" + "tp-id"
 TAG_TP_NAME = "{" + VL2T_NS + "}" + "name"
 
+TAG_NETWORK = "{" + NW_NS + "}" + "network"
+TAG_NETWORK_ID = "{" + NW_NS + "}" + "network-id"
 TAG_NODE = "{" + NW_NS + "}" + "node"
 TAG_NODE_ID = "{" + NW_NS + "}" + "node-id"
 TAG_L3_ATTR = "{" + L3UT_NS + "}" + "l3-node-attributes"
@@ -69,11 +93,68 @@ TAG_VF_ANNOTATIONS = "{" + VF_NS + "}" + "annotations"
 TAG_VF_KEY = "{" + VF_NS + "}" + "the-key"
 TAG_VF_VALUE = "{" + VF_NS + "}" + "value"
 
+TAG_NC_OK = "{" + NC_NS + "}" + "ok"
+TAG_NC_CONFIG = "{" + NC_NS + "}" + "config"
+TAG_NC_OPERATION = "{" + NC_NS + "}" + "operation"
+TAG_NC_RPC_ERROR = "{" + NC_NS + "}" + "rpc-error"
+TAG_NC_ERROR_PATH = "{" + NC_NS + "}" + "error-path"
+TAG_NC_ERROR_TAG = "{" + NC_NS + "}" + "error-tag"
+TAG_NC_ERROR_MESSAGE = "{" + NC_NS + "}" + "error-message"
+TAG_NC_SESSION_ID = "{" + NC_NS + "}" + "session-id"
+TAG_NCN_NOTIFICATION = "{" + NCN_NS + "}" + "notification"
+
+#xpath expressions are compiled once, and run on the reply tree parsed by the receiver.
+XPATH_NODE = etree.XPath('//nw:node', namespaces=NSMAP)
+XPATH_NODE_ID = etree.XPath('//nw:node-id/text()', namespaces=NSMAP, smart_strings=False)
+XPATH_TP = etree.XPath('//nt:termination-point', namespaces=NSMAP)
+XPATH_CAPABILITY = etree.XPath('nc:capabilities/nc:capability/text()', namespaces=NSMAP, smart_strings=False)
+XPATH_ERROR_MESSAGE = etree.XPath('nc:rpc-error/nc:error-message/text()', namespaces=NSMAP, smart_strings=False)
+XPATH_RPC_ERROR = etree.XPath('nc:rpc-error', namespaces=NSMAP)
+
+CAP_ROLLBACK_ON_ERROR = 'urn:ietf:params:netconf:capability:rollback-on-error:1.0'
+CAP_CANDIDATE = 'urn:ietf:params:netconf:capability:candidate:1.0'
+CAP_CONFIRMED_COMMIT_1_1 = 'urn:ietf:params:netconf:capability:confirmed-commit:1.1'
+CAP_NOTIFICATION = 'urn:ietf:params:netconf:capability:notification:1.0'
+CAP_XPATH = 'urn:ietf:params:netconf:capability:xpath:1.0'
+
+#annotation of the vFabric termination point connected to an OpenStack host.
+TP_HOST_ANNOTATION = "OpenStack_OVS_Host"
+
+#datastore locks held by another neutron-server process are retried, for a few seconds.
+LOCK_RETRIES = 10
+LOCK_RETRY_SEC = 0.5
+#seconds before vFabric rolls back an unconfirmed confirmed-commit.
+DEFAULT_CONFIRM_TIMEOUT = 120
+
+#keys of the yang lists edited by KaloomNetconf, to merge batched edits, and to match rpc-error error-paths.
+LIST_KEYS = {
+    TAG_NETWORK: (TAG_NETWORK_ID,),
+    TAG_NODE: (TAG_NODE_ID,),
+    TAG_NT_TP: (TAG_TP_ID,),
+    TAG_VIF_INTERFACE: (TAG_VIF_NAME,),
+    TAG_VIP_ADDRESS: (TAG_VIP_IP,),
+    "{" + VR_NS + "}" + "control-plane-protocol": ("{" + VR_NS + "}" + "type", "{" + VR_NS + "}" + "name"),
+    "{" + V4UR_NS + "}" + "route": ("{" + V4UR_NS + "}" + "destination-prefix",),
+    "{" + V6UR_NS + "}" + "route": ("{" + V6UR_NS + "}" + "destination-prefix",),
+}
+#key predicates of an error-path, e.g. /nw:networks/nw:network[nw:network-id='2']/nw:node[nw:node-id="x"]
+ERROR_PATH_KEY = re.compile(r"""\[[^\]=]+=\s*(['"])(.*?)\1\s*\]""")
+
+#single parser for all netconf msgs: drops ignorable whitespace, never resolves entities.
+PARSER_OPTIONS = {'remove_blank_text': True, 'resolve_entities': False, 'huge_tree': True}
+XML_PARSER = etree.XMLParser(**PARSER_OPTIONS)
+#root start tag of a msg (not the xml declaration, nor a comment), and its message-id.
+ROOT_TAG = re.compile(br'<[A-Za-z_][^>]*>')
+MESSAGE_ID = re.compile(br'''\smessage-id\s*=\s*(['"])(.*?)\1''')
+#bytes of a msg looked at for its root start tag, before it is parsed anyway.
+MAX_HEAD = 4096
+
 MESG_HELLO = b'''
 <?xml version="1.0" encoding="UTF-8"?>
 <hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
   <capabilities>
     <capability>urn:ietf:params:netconf:base:1.0</capability>
+    <capability>urn:ietf:params:netconf:base:1.1</capability>
     <capability>urn:ietf:params:netconf:capability:writable-running:1.0</capability>
     <capability>urn:ietf:params:netconf:capability:candidate:1.0</capability>
     <capability>urn:ietf:params:netconf:capability:confirmed-commit:1.0</capability>
@@ -83,12 +164,9 @@ MESG_HELLO = b'''
 </hello>
 '''
 
-TERMINATOR = b']]>]]>'
-
+#rpc operations and config subtrees, compiled once (netconf_rpc.Template); values are escaped when filled.
 L3_command_dict={
-'LIST_ROUTER' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+'LIST_ROUTER' : netconf_rpc.Template("""
 <get xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:l3t="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology">
 <filter type="subtree">
     <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
@@ -102,11 +180,16 @@ L3_command_dict={
     </networks>
 </filter>
 </get>
-</rpc>
-""",
-'GET_ROUTER_ID' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+"""),
+#LIST_ROUTER of the routers whose name starts with prefix (an xpath literal), with the :xpath capability.
+'LIST_ROUTER_XPATH' : netconf_rpc.Template("""
+<get>
+  <filter xmlns:nw="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:l3t="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology" type="xpath"
+   select="/nw:networks/nw:network[nw:network-id='3']/nw:node[starts-with(l3t:l3-node-attributes/l3t:name, %(prefix)s)]/nw:node-id |
+           /nw:networks/nw:network[nw:network-id='3']/nw:node[starts-with(l3t:l3-node-attributes/l3t:name, %(prefix)s)]/l3t:l3-node-attributes/l3t:name"/>
+</get>
+"""),
+'GET_ROUTER_ID' : netconf_rpc.Template("""
 <get>
         <filter type="subtree">
     <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:l3t="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology">
@@ -121,33 +204,24 @@ L3_command_dict={
     </networks>
         </filter>
 </get>
-</rpc>
-""",
+"""),
 
 
-'CREATE_ROUTER' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+'CREATE_ROUTER' : netconf_rpc.Template("""
   <create-router xmlns="urn:kaloom:faas:vfabric-l3-unicast-topology">
     <network-id>3</network-id>
     <name>%(router_name)s</name>
   </create-router>
-</rpc>
-""",
+"""),
 
-'DELETE_ROUTER' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+'DELETE_ROUTER' : netconf_rpc.Template("""
   <delete-router xmlns="urn:kaloom:faas:vfabric-l3-unicast-topology">
     <network-id>3</network-id>
     <node-id>%(router_node_id)s</node-id>
   </delete-router>
-</rpc>
-""",
+"""),
 
-'ATTACH_ROUTER' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+'ATTACH_ROUTER' : netconf_rpc.Template("""
   <attach-l3node-to-l2node xmlns="urn:kaloom:faas:vfabric-l3-unicast-topology">
     <l3-network-id>3</l3-network-id>
     <l3-node-id>%(router_node_id)s</l3-node-id>
@@ -155,29 +229,18 @@ L3_command_dict={
     <l2-node-id>%(l2_node_id)s</l2-node-id>
     <mtu>1500</mtu>
   </attach-l3node-to-l2node>
-</rpc>
-""",
+"""),
 
-'DETACH_ROUTER' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+'DETACH_ROUTER' : netconf_rpc.Template("""
   <detach-l3node-from-l2node xmlns="urn:kaloom:faas:vfabric-l3-unicast-topology">
     <l3-network-id>3</l3-network-id>
     <l3-node-id>%(router_node_id)s</l3-node-id>
     <l2-network-id>2</l2-network-id>
     <l2-node-id>%(l2_node_id)s</l2-node-id>
   </detach-l3node-from-l2node>
-</rpc>
-""",
-'addIPv4AddressToInterface' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
- <edit-config>
-    <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-   <config>
+"""),
+#edit-config operations are <config> subtrees, sent by KaloomNetconf._edit_config, alone or batched.
+'addIPv4AddressToInterface' : netconf_rpc.Template("""
      <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
        <network>
          <network-id>3</network-id>
@@ -197,20 +260,9 @@ L3_command_dict={
          </node>
        </network>
      </networks>
-   </config>
- </edit-config>
-</rpc>
-""",
-'deleteIPv4AddressFromInterface' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-  <edit-config>
-     <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-    <config xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vi="urn:kaloom:faas:vfabric-interfaces" xmlns:vip="urn:kaloom:faas:vfabric-ip">
-      <nd:networks>
+"""),
+'deleteIPv4AddressFromInterface' : netconf_rpc.Template("""
+      <nd:networks xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vi="urn:kaloom:faas:vfabric-interfaces" xmlns:vip="urn:kaloom:faas:vfabric-ip">
         <nd:network>
           <nd:network-id>3</nd:network-id>
           <nd:node>
@@ -228,19 +280,8 @@ L3_command_dict={
           </nd:node>
         </nd:network>
       </nd:networks>
-    </config>
-  </edit-config>
-</rpc>
-""",
-'addIPv6AddressToInterface' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
- <edit-config>
-    <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-   <config>
+"""),
+'addIPv6AddressToInterface' : netconf_rpc.Template("""
      <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
        <network>
          <network-id>3</network-id>
@@ -260,19 +301,8 @@ L3_command_dict={
          </node>
        </network>
      </networks>
-   </config>
- </edit-config>
-</rpc>
-""",
-'deleteIPv6AddressFromInterface' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
- <edit-config>
-    <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-   <config>
+"""),
+'deleteIPv6AddressFromInterface' : netconf_rpc.Template("""
      <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
        <network>
          <network-id>3</network-id>
@@ -291,20 +321,9 @@ L3_command_dict={
          </node>
        </network>
      </networks>
-   </config>
- </edit-config>
-</rpc>
-""",
-'addIPv4StaticRoute':"""
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-  <edit-config>
-     <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-    <config xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v4ur="urn:kaloom:faas:vfabric-ipv4-unicast-routing">
-      <nd:networks>
+"""),
+'addIPv4StaticRoute':netconf_rpc.Template("""
+      <nd:networks xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v4ur="urn:kaloom:faas:vfabric-ipv4-unicast-routing">
         <nd:network>
           <nd:network-id>3</nd:network-id>
           <nd:node>
@@ -329,21 +348,10 @@ L3_command_dict={
             </vr:routing>
           </nd:node>
         </nd:network>
-      </nd:networks>  
-    </config>
-  </edit-config>
-</rpc>
-""",
-'addIPv6StaticRoute':"""
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-  <edit-config>
-     <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-    <config xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v6ur="urn:kaloom:faas:vfabric-ipv6-unicast-routing">
-      <nd:networks>
+      </nd:networks>
+"""),
+'addIPv6StaticRoute':netconf_rpc.Template("""
+      <nd:networks xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v6ur="urn:kaloom:faas:vfabric-ipv6-unicast-routing">
         <nd:network>
           <nd:network-id>3</nd:network-id>
           <nd:node>
@@ -369,20 +377,9 @@ L3_command_dict={
           </nd:node>
         </nd:network>
       </nd:networks>
-    </config>
-  </edit-config>
-</rpc>
-""",
-'deleteIPv4StaticRoute':"""
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-  <edit-config>
-     <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-    <config xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v4ur="urn:kaloom:faas:vfabric-ipv4-unicast-routing">
-      <nd:networks>
+"""),
+'deleteIPv4StaticRoute':netconf_rpc.Template("""
+      <nd:networks xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v4ur="urn:kaloom:faas:vfabric-ipv4-unicast-routing">
         <nd:network>
           <nd:network-id>3</nd:network-id>
           <nd:node>
@@ -405,20 +402,9 @@ L3_command_dict={
           </nd:node>
         </nd:network>
       </nd:networks>
-    </config>
-  </edit-config>
-</rpc>
-""",
-'deleteIPv6StaticRoute':"""
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-  <edit-config>
-     <target>
-     <running />
-   </target>
-   <default-operation>none</default-operation>
-    <config xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v6ur="urn:kaloom:faas:vfabric-ipv6-unicast-routing">
-      <nd:networks>
+"""),
+'deleteIPv6StaticRoute':netconf_rpc.Template("""
+      <nd:networks xmlns:xc="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:nd="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:vr="urn:kaloom:faas:vfabric-routing" xmlns:v6ur="urn:kaloom:faas:vfabric-ipv6-unicast-routing">
         <nd:network>
           <nd:network-id>3</nd:network-id>
           <nd:node>
@@ -441,19 +427,8 @@ L3_command_dict={
           </nd:node>
         </nd:network>
       </nd:networks>
-    </config>
-  </edit-config>
-</rpc>
-""",
-'RENAME_ROUTER':"""
-<?xml version="1.0" encoding="UTF-8" standalone="no"?>
-<rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
- <edit-config>
-    <target>
-      <running/>
-    </target>
-  <default-operation>none</default-operation>
-  <config>
+"""),
+'RENAME_ROUTER':netconf_rpc.Template("""
     <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
      <network>
        <network-id>3</network-id>
@@ -465,13 +440,8 @@ L3_command_dict={
        </node>
      </network>
     </networks>
-  </config>
- </edit-config>
-</rpc>
-""",
-'GET_ROUTER_INTERFACE_INFO' : """
-<?xml version="1.0" encoding="UTF-8"?>
-<rpc message-id="message_id" >
+"""),
+'GET_ROUTER_INTERFACE_INFO' : netconf_rpc.Template("""
 <get xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" xmlns:l3t="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology" xmlns:vif="urn:kaloom:faas:vfabric-interfaces" xmlns:nt="urn:ietf:params:xml:ns:yang:ietf-network-topology">
 <filter type="subtree">
  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
@@ -489,19 +459,371 @@ L3_command_dict={
  </networks>
 </filter>
 </get>
-</rpc>
-""",
+"""),
+}
+
+L2_command_dict={
+'GET_SCHEMAS' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <netconf-state xmlns="urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring">
+      <schemas/>
+    </netconf-state>
+  </filter>
+</get>
+"""),
+'GET_L2_NETWORK_BY_NAME' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+      <network>
+        <network-id>2</network-id>
+        <node>
+          <node-id>%(nw_name)s</node-id>
+          <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+            <KNID xmlns="urn:kaloom:faas:vfabric-l2-topology"/>
+          </l2-node-attributes>
+        </node>
+      </network>
+    </networks>
+  </filter>
+</get>
+"""),
+'GET_L2_NETWORK_NAMES' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+      <network>
+        <network-id>2</network-id>
+        <node>
+          <node-id/>
+        </node>
+      </network>
+    </networks>
+  </filter>
+</get>
+"""),
+#GET_L2_NETWORK_NAMES of the names starting with prefix (an xpath literal), with the :xpath capability.
+'GET_L2_NETWORK_NAMES_XPATH' : netconf_rpc.Template("""
+<get>
+  <filter xmlns:nw="urn:ietf:params:xml:ns:yang:ietf-network" type="xpath"
+   select="/nw:networks/nw:network[nw:network-id='2']/nw:node[starts-with(nw:node-id, %(prefix)s)]/nw:node-id"/>
+</get>
+"""),
+'GET_TP_BY_ANNOTATION' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <nw:networks xmlns:nw="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:nt="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:vf="urn:kaloom:faas:virtual-fabric">
+      <nw:network>
+        <nw:network-id>1</nw:network-id>
+        <nw:node>
+          <nt:termination-point>
+            <vf:annotations>
+              <vf:the-key>%(key)s</vf:the-key>
+              <vf:value>%(host)s</vf:value>
+            </vf:annotations>
+          </nt:termination-point>
+        </nw:node>
+      </nw:network>
+    </nw:networks>
+  </filter>
+</get>
+"""),
+'CREATE_L2_NETWORK' : netconf_rpc.Template("""
+<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+  <network>
+    <network-id>2</network-id>
+    <node xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="create">
+      <node-id>%(name)s</node-id>
+      <vl2-neighbors xmlns="urn:kaloom:faas:vfabric-l2-topology">
+        <arp-suppression-enable>false</arp-suppression-enable>
+        <nd-suppression-enable>false</nd-suppression-enable>
+      </vl2-neighbors>
+      <vl2-mac xmlns="urn:kaloom:faas:vfabric-l2-topology">
+        <mac-address-table-aging-enable>false</mac-address-table-aging-enable>
+      </vl2-mac>
+      <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+        <name>%(gui_name)s</name>
+        <description>%(gui_name)s</description>
+      </l2-node-attributes>
+    </node>
+  </network>
+</networks>
+"""),
+'RENAME_L2_NETWORK' : netconf_rpc.Template("""
+<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+  <network>
+    <network-id>2</network-id>
+    <node>
+      <node-id>%(nw_name)s</node-id>
+      <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology" xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="merge">
+        <name>%(gui_nw_name)s</name>
+        <description>%(gui_nw_name)s</description>
+      </l2-node-attributes>
+    </node>
+  </network>
+</networks>
+"""),
+'DELETE_L2_NETWORK' : netconf_rpc.Template("""
+<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+  <network>
+    <network-id>2</network-id>
+    <node xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="remove">
+      <node-id>%(nw_name)s</node-id>
+    </node>
+  </network>
+</networks>
+"""),
+'ATTACH_TP' : netconf_rpc.Template("""
+<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+  <network>
+    <network-id>2</network-id>
+    <node>
+      <node-id>%(nw_name)s</node-id>
+      <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="create">
+        <tp-id>%(tpid)s</tp-id>
+        <l2-termination-point-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+          <description>%(name)s</description>
+          <encapsulation-type xmlns="urn:kaloom:faas:vfabric-l2-topology">VLAN</encapsulation-type>
+          <vlan-id xmlns="urn:kaloom:faas:vfabric-l2-topology">%(vlan_id)s</vlan-id>
+        </l2-termination-point-attributes>
+        <name xmlns="urn:kaloom:faas:vfabric-l2-topology">%(name)s</name>
+      </termination-point>
+    </node>
+  </network>
+</networks>
+"""),
+'DETACH_TP' : netconf_rpc.Template("""
+<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+  <network>
+    <network-id>2</network-id>
+    <node>
+      <node-id>%(nw_name)s</node-id>
+      <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="remove">
+        <tp-id>%(tpid)s</tp-id>
+      </termination-point>
+    </node>
+  </network>
+</networks>
+"""),
+}
+
+#KaloomNetconf lookups, and the <get> templates of their rpcs (and xpath variants).
+#A lookup configured to read configuration only sends the get-config (_CONFIG) variant.
+QUERIES = {
+    'get_l2_network_by_name': (L2_command_dict, ('GET_L2_NETWORK_BY_NAME',)),
+    'get_l2_network_names': (L2_command_dict, ('GET_L2_NETWORK_NAMES', 'GET_L2_NETWORK_NAMES_XPATH')),
+    'get_tp_by_annotation': (L2_command_dict, ('GET_TP_BY_ANNOTATION',)),
+    'list_router_name_id': (L3_command_dict, ('LIST_ROUTER', 'LIST_ROUTER_XPATH')),
+    'get_router_id_by_name': (L3_command_dict, ('GET_ROUTER_ID',)),
+    'get_router_interface_info': (L3_command_dict, ('GET_ROUTER_INTERFACE_INFO',)),
 }
+for command_dict, names in QUERIES.values():
+    for name in names:
+        command_dict[name + '_CONFIG'] = command_dict[name].get_config()
+#l2 network names are the keys of the nodes created by the driver edits: configuration.
+DEFAULT_CONFIG_QUERIES = ('get_l2_network_names',)
 
 LOG = log.getLogger(__name__)
 
+METRICS = netconf_metrics.METRICS
+RECORDER = netconf_recorder.RECORDER
+
+def timed(op):
+    """METRICS.timed(op); the rpcs of op are recorded under its name by the flight recorder."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with netconf_scheduler.operation(op):
+                return fn(*args, **kwargs)
+        return METRICS.timed(op)(wrapper)
+    return decorator
+
+#netconf sessions per vFabric, in a neutron-server process.
+DEFAULT_POOL_SIZE = 2
+#frames queued on a session are coalesced into a single send, up to these bytes.
+MAX_COALESCE_BYTES = 262144
+#seconds a health probe waits for its reply.
+HEALTH_PROBE_TIMEOUT_SEC = 5
+#seconds from a new vFabric session-id to the reconnect callbacks: the other sessions of
+#the pool reconnect meanwhile, and the callbacks run once for all of them.
+RECONNECT_DELAY_SEC = 1
+#cheapest rpc answered by any vFabric: the datastores of netconf-state.
+MESG_HEALTH_PROBE = netconf_rpc.Rpc(b'''<get><filter type="subtree"><netconf-state xmlns="urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring"><datastores/></netconf-state></filter></get>''')
+
+#KaloomNetconf transports: direct ssh to vFabric, or unix socket to kaloom netconf proxy.
+TRANSPORT_SSH = 'ssh'
+TRANSPORT_PROXY = 'proxy'
+#ssh implementations of TRANSPORT_SSH: paramiko in process, or an OpenSSH client process (netconf_openssh).
+SSH_BACKEND_PARAMIKO = 'paramiko'
+SSH_BACKEND_OPENSSH = 'openssh'
+SSH_BACKENDS = (SSH_BACKEND_PARAMIKO, SSH_BACKEND_OPENSSH)
+
+#private keys, loaded once per key file (and again when the file changes): path: (mtime, key)
+_private_keys = {}
+
+def load_private_key(path):
+    mtime = os.path.getmtime(path)
+    cached = _private_keys.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    key = paramiko.RSAKey.from_private_key_file(path)
+    _private_keys[path] = (mtime, key)
+    return key
+
+def parse_xml(msg):
+    """Parse a netconf msg into lxml tree, returns the root element.
+
+    The frame may start with whitespace left over from the previous
+    TERMINATOR, which lxml does not accept before the xml declaration.
+    """
+    return etree.fromstring(netconf_framing.frame_bytes(msg).strip(), XML_PARSER)
+
+def rpc_error_message(reply):
+    """error-message of the first rpc-error in the rpc-reply, or the whole reply if absent."""
+    messages = XPATH_ERROR_MESSAGE(reply)
+    if messages:
+        return messages[0]
+    return etree.tostring(reply)
+
+def l2_network_info(node):
+    """{'kaloom_knid': KNID} of an l2 node, None if it has no KNID."""
+    knid = node.findtext(TAG_L2_NODE_ATTR + '/' + TAG_NW_ATTR_KNID)
+    if knid is None:
+        return None
+    return {'kaloom_knid': int(knid)}
+
+def annotated_hosts(tp):
+    """OpenStack hosts a termination point is annotated with."""
+    return [annotation.findtext(TAG_VF_VALUE) for annotation in tp.iterfind(TAG_VF_ANNOTATIONS)
+            if annotation.findtext(TAG_VF_KEY) == TP_HOST_ANNOTATION]
+
+def router_info(node):
+    """name, l2 links and addresses of an l3 node.
+
+    {'name': name, 'links': {l2 node-id: interface-name}, 'cidrs': {interface-name: [cidr]}}
+    """
+    info = {'name': node.findtext(TAG_L3_ATTR + '/' + TAG_L3_NAME), 'links': {}, 'cidrs': {}}
+    for nt_tp in node.iterfind(TAG_NT_TP):
+        supporting_tp = nt_tp.find(TAG_NT_SUPPORTING_TP)
+        if supporting_tp is None or supporting_tp.findtext(TAG_NT_NETWORK_REF) != '2':
+            continue
+        interface = nt_tp.findtext(TAG_L3T_L3_TP_ATTR + '/' + TAG_VL3T_IFNAME)
+        info['links'].setdefault(supporting_tp.findtext(TAG_NT_NODE_REF), interface)
+    for interface in node.iterfind(TAG_VIF_INTERFACES + '/' + TAG_VIF_INTERFACE):
+        addresses = (interface.findall(TAG_VIP_IPV4 + '/' + TAG_VIP_ADDRESS) +
+                     interface.findall(TAG_VIP_IPV6 + '/' + TAG_VIP_ADDRESS))
+        info['cidrs'].setdefault(interface.findtext(TAG_VIF_NAME), []).extend(
+            '%s/%s' % (address.findtext(TAG_VIP_IP), address.findtext(TAG_VIP_PREFIX_LENGTH)) for address in addresses)
+    return info
+
+def router_interface_info(node_id, info, l2_node_id):
+    """get_router_interface_info() result, from router_info() of the router node."""
+    interface = info['links'].get(l2_node_id)
+    cidrs = list(info['cidrs'].get(interface, [])) if interface else []
+    return {'node_id': node_id, 'interface': interface, 'cidrs': cidrs}
+
+class KaloomNetconfReplyParser(object):
+    """Parses the msgs of a netconf chan incrementally, as their bytes are received.
+
+    The root start tag of a reply tells its message-id: a reply waited for by a
+    KaloomNetconfStream hands over its elements as soon as they are complete,
+    other msgs are dispatched by the receiver once parsed.
+    """
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.reset()
+
+    def reset(self):
+        self.head = b''
+        self.parser = None
+        self.stream = None
+        self.size = 0
+        self.error = None
+        #first bytes of the msg, for the flight recorder.
+        self.preview = b''
+
+    def feed(self, piece, end):
+        """piece: next bytes of the msg, end: whether the msg ends with it."""
+        if self.size < netconf_recorder.PREVIEW_SIZE:
+            self.preview += piece[:netconf_recorder.PREVIEW_SIZE - self.size]
+        self.size += len(piece)
+        if self.error is None:
+            try:
+                if self.parser is None:
+                    self.head += piece
+                    piece = self._begin(end)
+                if piece:
+                    self.parser.feed(piece)
+                    if self.stream is not None:
+                        for action, elem in self.parser.read_events():
+                            self.stream.element(elem)
+            except Exception as e:
+                #the rest of the msg is dropped, up to its end.
+                self.error = e
+        if end:
+            self._end()
+
+    def _begin(self, end):
+        """picks the parser of the msg, once its root start tag is received; returns the bytes to feed it."""
+        #the frame may start with whitespace left over from the previous TERMINATOR.
+        head = self.head.lstrip()
+        root = ROOT_TAG.search(head)
+        if root is None and not end and len(head) < MAX_HEAD:
+            self.head = head
+            return None
+        self.head = b''
+        msgid = MESSAGE_ID.search(root.group(0)) if root is not None else None
+        stream = self.receiver.msg_events.get(msgid.group(2).decode('utf-8')) if msgid is not None else None
+        if isinstance(stream, KaloomNetconfStream):
+            self.stream = stream
+            self.parser = etree.XMLPullParser(events=('end',), tag=stream.tag, **PARSER_OPTIONS)
+        else:
+            self.parser = etree.XMLParser(**PARSER_OPTIONS)
+        return head
+
+    def _end(self):
+        parser, stream, error, size, preview = self.parser, self.stream, self.error, self.size, self.preview
+        self.reset()
+        METRICS.observe_reply(size)
+        if error is None:
+            try:
+                if parser is None:
+                    raise ValueError('empty netconf msg')
+                msg_xml = parser.close()
+                if stream is not None:
+                    for action, elem in parser.read_events():
+                        stream.element(elem)
+            except Exception as e:
+                error = e
+        if error is not None:
+            LOG.error('Error occured: %s while parsing received netconf msg', error)
+            if stream is not None:
+                self.receiver.del_callback_event(str(stream.msgid))
+                stream.reply_preview = preview
+                stream.send_exception(ValueError('invalid netconf reply: %s' % error))
+            return
+        self.receiver.dispatch(msg_xml, preview)
+
+
 class KaloomNetconfRecv(worker.BaseWorker):
-    def __init__(self, client, chan):
+    """Long-lived receiver of a netconf session.
+
+    One greenthread per session is started once the session is established,
+    and it lives as long as the chan. While no request is in flight, it is
+    parked in a blocking recv on the chan, and replies are dispatched to their
+    waiters as soon as their frames are complete.
+    """
+    def __init__(self, client, chan, recv_size=netconf_framing.DEFAULT_RECV_SIZE):
         super(KaloomNetconfRecv, self).__init__(worker_process_count=1)
         self.client = client
         self.chan = chan
+        self.recv_size = recv_size
+        self.decoder = netconf_framing.EOMDecoder()
+        self.parser = KaloomNetconfReplyParser(self)
         self.msg_events = {}
-        self.msg_events_stale = {}
+        #called with the notification tree, on a session subscribed to notifications.
+        self.on_notification = None
         self._thread = None
         self._running = False
         self.done = None
@@ -509,10 +831,20 @@ class KaloomNetconfRecv(worker.BaseWorker):
     def is_running(self):
         return self._running
 
+    def stats(self):
+        """receiver state, for monitoring."""
+        in_flight = len(self.msg_events)
+        return {'running': self._running,
+                'parked': self._running and in_flight == 0,
+                'in_flight': in_flight}
+
     def _on_done(self, gt, *args, **kwargs):
         self._running = False
         #force callbacks not to wait anymore
         self.msg_exception_to_callbacks()
+        #no way to check chan status (on caller side), so force to recreate by closing transport
+        self.chan = None
+        self.client.close()
 
         self._thread = None
         #send done event
@@ -528,39 +860,49 @@ class KaloomNetconfRecv(worker.BaseWorker):
         super(KaloomNetconfRecv, self).start()
         self._running = True
         self.done = event.Event()
-        self._thread = greenthread.spawn(self._recv_loop)
+        self._thread = greenthread.spawn(self._recv_loop, self.chan, self.decoder)
         self._thread.link(self._on_done)
-        greenthread.sleep(0) # yield turn to spawned thread immediately.
 
     def stop(self, graceful=True):
         self._running = False
         #release recv block by closing chan
         if self.chan is not None:
            self.chan.close()
-        if not graceful:
+        if not graceful and self._thread is not None:
            #kill thread
            self._thread.kill()
 
     def wait(self):
+        if self.done is None:
+           return True
         return self.done.wait()
 
     def reset(self):
         self.stop()
         self.wait()
-        #don't start here, start will be on first msq queue in add_callback_event 
+        #don't start here, start will be on next session init
 
-    def update_chan(self, chan):
+    def update_chan(self, chan, decoder=None):
+        """Starts receiving on a new chan, after the previous receiver loop is stopped."""
+        if self._running:
+           self.stop()
+           self.wait()
         self.chan = chan
- 
+        #framing and parsing state belong to the chan; bytes left from the previous chan are dropped.
+        self.decoder = decoder if decoder is not None else netconf_framing.EOMDecoder()
+        self.parser = KaloomNetconfReplyParser(self)
+        self.start()
+
     def add_callback_event(self, msgid, evt):
-        if msgid in self.msg_events.keys():
+        if not self._running:
+           error_msg = 'add_callback_event: receiver is not running for msgid %s.' % msgid
+           LOG.error(error_msg)
+           raise ValueError(error_msg)
+        if msgid in self.msg_events:
            error_msg = 'add_callback_event: duplicate msgid %s exists.' % msgid
            LOG.error(error_msg) 
            raise ValueError(error_msg)
-        else:
-           self.msg_events[msgid] = evt
-           # starts receiver thread, if not already running.
-           self.start()
+        self.msg_events[msgid] = evt
 
     def del_callback_event(self, msgid):
         try:
@@ -569,81 +911,360 @@ class KaloomNetconfRecv(worker.BaseWorker):
            LOG.warning('del_callback_event: callback event for msgid %s does not exists.', msgid)
 
     def msg_exception_to_callbacks(self):
-        for msgid in self.msg_events_stale.keys():
-            evt = self.msg_events_stale.pop(msgid)
+        msg_events = self.msg_events
+        self.msg_events = {}
+        for msgid, evt in msg_events.items():
             try:
                evt.send_exception(ValueError('receiver thread terminated'))
-            except:
+            except Exception:
                pass
 
-    def msg_reply(self, msg):
-        try:
-           msg_xml = objectify.fromstring(msg)
-        except Exception as e:
-           LOG.error('Error occured: %s while handling received netconf msg %s', e, msg)
+    def dispatch(self, msg_xml, msg=None):
+        """puts a parsed msg on the callback evt of its msgid, or to the notification subscriber.
+
+        msg: the msg bytes, or their first ones.
+        """
+        #the only parse of the reply: the tree goes as it is to the caller waiting on the msgid.
+        if msg_xml.tag == TAG_NCN_NOTIFICATION:
+           self.msg_notification(msg_xml)
            return
         msgid = msg_xml.get('message-id')
         if msgid is None:
-           LOG.error('message_id could not be parsed on received netconf msg %s', msg)
+           LOG.error('message_id could not be parsed on received netconf msg %s', msg if msg is not None else etree.tostring(msg_xml))
            return
         #put the msg on callback evt, of the msgid.
         try:
            evt = self.msg_events.pop(msgid) 
         except KeyError:
            #the caller already could timeout 
-           LOG.warning('msg_reply: callback evt could not be found for the msgid %s, possibly timeout.', msgid)
+           LOG.warning('dispatch: callback evt could not be found for the msgid %s, possibly timeout.', msgid)
+           return
+        evt.reply_preview = msg
+        evt.send(msg_xml)
+
+    def msg_notification(self, msg_xml):
+        if self.on_notification is None:
+           LOG.debug('no subscriber for netconf notification %s', etree.tostring(msg_xml))
            return
-        evt.send(msg)
+        try:
+           self.on_notification(msg_xml)
+        except Exception as e:
+           LOG.error('Error occured: %s while handling netconf notification %s', e, etree.tostring(msg_xml))
 
-    def _recv_loop(self):
+    def _recv_loop(self, chan, decoder):
+        ##TERMINATOR bytes could fall in different buffer chunks. 
+        ##same buffer chunk could have multiple replies.
         while self._running:
            try:
-              transport = self.client.get_transport()
-              if transport is not None and transport.is_active() and self.chan is not None:
-                 """Read replies."""
-                 ##TERMINATOR bytes could fall in different buffer chunks. 
-                 ##same buffer chunk could have multiple replies.
-                 responses=''
-                 while len(self.msg_events) > 0:
-                   try:
-                     response = self.chan.recv(2048) #blocking until any data (paramiko has been patched, yields to avoid starvation)
-                     if len(response) == 0: #If a string of length zero is returned, the channel stream has closed.
-                         LOG.warning("channel closed, stopping receiver thread.")
-                         self.msg_events_stale = self.msg_events
-                         self.msg_events = {}
-                         self._running = False
-                         self.chan = None
-                         #no way to check chan status (on caller side), so force to recreate by closing transport
-                         self.client.close()
-                         break
-                     responses = responses + response
-                     msgs = responses.split(TERMINATOR)
-                     msg_count = len(msgs)
-                     #except last msg, which is either '' or incomplete, leftover after last TERMINATOR
-                     for i in range(msg_count - 1):
-                         self.msg_reply(msgs[i])
-                     responses = msgs[msg_count-1] #last msg
-                     greenthread.sleep(0) #Yield to avoid starvation
-                   except socket.timeout: #timeout on netconf recv
-                     #timeout happened only for one msgid, there could be more msgids waiting for response.
-                     greenthread.sleep(0) #Yield to avoid starvation
-
-                 if self._running:
-                     LOG.debug("no more msg to serve response for, stopping receiver thread.")
-                     self._running = False
-              else:
-                 LOG.warning("no active session to listen for recv, stopping receiver thread.")
-                 self.msg_events_stale = self.msg_events
-                 self.msg_events = {}
-                 self._running = False
-
+              response = chan.recv(self.recv_size) #blocking until any data (paramiko has been patched, yields to avoid starvation)
+           except socket.timeout:
+              #idle (parked) or slow reply: callers have their own timeout.
+              continue
            except Exception as e:
-               # If any unexpected exception happens we don't want the
-               # receiver_loop to exit.
-               LOG.error(_LE('Unexpected exception in netconf receiver loop %s', e))
+              if self._running:
+                 LOG.error('Unexpected exception in netconf receiver loop %s', e)
+              break
+           if len(response) == 0: #If a string of length zero is returned, the channel stream has closed.
+              if self._running:
+                 LOG.warning("channel closed, stopping receiver thread.")
+              break
+           try:
+              #msgs are parsed as their bytes are received, the decoder keeps a possible partial terminator only.
+              pieces = decoder.feed_stream(response)
+           except ValueError as e:
+              LOG.error('netconf framing error %s, stopping receiver thread.', e)
+              break
+           for piece, end in pieces:
+              self.parser.feed(piece, end)
+           greenthread.sleep(0) #Yield to avoid starvation
+        self._running = False
 
-class KaloomNetconf(object):
-    def __init__(self, host, port, username, private_key_file, password, timeout_sec = 90):
+class KaloomNetconfSender(object):
+    """Writer of a netconf session, the only greenthread sending on its chan.
+
+    rpcs queue their frames, sent in the order they are queued. Frames queued while
+    a send is in progress are joined and sent together by the next chan.sendall(),
+    so a burst of rpcs costs a few ssh packets rather than a send per rpc. A failed
+    send fails the rpcs of its frames, and stops the receiver: the chan is unusable.
+    """
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.frames = None
+        self._thread = None
+        self.sends = 0
+        self.frames_sent = 0
+
+    def is_running(self):
+        return self._thread is not None
+
+    def queued(self):
+        return self.frames.qsize() if self.frames is not None else 0
+
+    def stats(self):
+        return {'queued': self.queued(), 'sends': self.sends, 'frames_sent': self.frames_sent}
+
+    def update_chan(self, chan):
+        """Starts sending on a new chan; frames queued for the previous one are not sent on it."""
+        self.stop()
+        self.frames = queue.LightQueue()
+        self._thread = greenthread.spawn(self._send_loop, chan, self.frames)
+
+    def stop(self):
+        if self._thread is not None:
+            self.frames.put(None)
+            self._thread = None
+
+    def send(self, msgid, parts):
+        """queues the frame of rpc msgid, as bytes parts; does not yield."""
+        if self._thread is None:
+            raise ValueError('netconf sender is not running for msgid %s' % msgid)
+        self.frames.put((msgid, parts, time.time()))
+
+    def _fail(self, frames, e):
+        for msgid, parts, queued in frames:
+            evt = self.receiver.msg_events.pop(str(msgid), None)
+            if evt is not None:
+                evt.send_exception(ValueError('netconf send failed: %s' % e))
+
+    def _send_loop(self, chan, frames):
+        running = True
+        while running:
+            frame = frames.get()
+            if frame is None:
+                break
+            batch = [frame]
+            size = sum(len(part) for part in frame[1])
+            while size < MAX_COALESCE_BYTES and frames.qsize():
+                frame = frames.get_nowait()
+                if frame is None:
+                    running = False
+                    break
+                batch.append(frame)
+                size += sum(len(part) for part in frame[1])
+            try:
+                chan.sendall(b''.join(part for frame in batch for part in frame[1]))
+            except Exception as e:
+                LOG.error('netconf send of %d frames failed: %s', len(batch), e)
+                self._fail(batch, e)
+                if self.frames is frames:
+                    #rpcs in flight fail at once, the session reconnects on next use.
+                    self.receiver.stop()
+                break
+            sent = time.time()
+            self.sends += 1
+            self.frames_sent += len(batch)
+            for frame in batch:
+                METRICS.observe_send(sent - frame[2])
+        #frames left behind are failed, e.g. by the receiver stopped with the chan.
+        left = []
+        while frames.qsize():
+            frame = frames.get_nowait()
+            if frame is not None:
+                left.append(frame)
+        self._fail(left, 'netconf chan closed')
+
+
+class KaloomNetconfFuture(event.Event):
+    """rpc-reply of an rpc sent on a session, i.e. the callback event of its msgid.
+
+    result() waits for the reply, at most until the timeout of the session since the
+    rpc was sent, or the deadline of the sending greenthread if earlier (netconf_scheduler);
+    then() gives the future of a function of the reply.
+    """
+    def __init__(self, session, msgid):
+        super(KaloomNetconfFuture, self).__init__()
+        self.session = session
+        self.msgid = msgid
+        self.submitted = time.time()
+        self.deadline = self.submitted + session.timeout_sec
+        self.callbacks = []
+        self.completed = False
+        #request class of the rpc, once admitted in the in-flight window of the session.
+        self.priority = None
+        #KaloomNetconf operation and netconf_rpc.Rpc of the rpc, and the first bytes of its reply.
+        self.operation = None
+        self.request = None
+        self.reply_preview = None
+
+    def _complete(self, error=None):
+        if self.completed:
+            return
+        self.completed = True
+        RECORDER.record(self.operation, self.session.netconf_session_id, self.msgid, self.priority,
+                        self.submitted, self.request.operation if self.request is not None else None,
+                        self.reply_preview, error)
+        #the session is not busy with this rpc anymore.
+        self.session.active -= 1
+        if self.priority is not None:
+            self.session.scheduler.release(self.priority)
+        self.session.breaker.record(self, error)
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                LOG.error('Error occured: %s in callback of netconf msgid %s', e, self.msgid)
+
+    def done(self):
+        return self.ready()
+
+    def send(self, result=None, exc=None):
+        #called by the receiver, with the reply or an exception (a tuple, from send_exception).
+        super(KaloomNetconfFuture, self).send(result, exc)
+        self._complete(exc[0] if isinstance(exc, tuple) else exc)
+
+    def add_done_callback(self, callback):
+        """callback(future) once the reply is received, failed or cancelled."""
+        if self.completed:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def cancel(self, reason='cancelled'):
+        """stops waiting for the reply."""
+        if not self.completed:
+            self.session.receiver.del_callback_event(str(self.msgid))
+            self._complete(reason)
+
+    def result(self, timeout=None):
+        remaining = self.deadline - time.time()
+        if timeout is not None:
+            remaining = min(remaining, timeout)
+        try:
+            with Timeout(max(remaining, 0)):
+                response_xml = self.wait()
+        except ValueError as e: #receiver thread on_done sends exception, stop waiting
+            msg = "Error on netconf reply recv for session-id %s msgid %s errmsg:%s" % (self.session.netconf_session_id, self.msgid, e)
+            LOG.error(msg)
+            raise ValueError(msg)
+        except Timeout: #Timeout
+            msg = "timeout on netconf reply recv for session-id %s msgid %s" % (self.session.netconf_session_id, self.msgid)
+            LOG.error(msg)
+            METRICS.incr('timeouts')
+            if time.time() >= self.deadline:
+                timed_out = time.time() >= self.submitted + self.session.timeout_sec
+                self.cancel(netconf_breaker.TIMEOUT if timed_out else netconf_breaker.DEADLINE_EXCEEDED)
+            raise ValueError(msg)
+        return response_xml
+
+    def then(self, fn):
+        return KaloomNetconfThen(self, fn)
+
+
+class KaloomNetconfThen(object):
+    """future of fn(result of future); fn runs in the greenthread calling result()."""
+    def __init__(self, future, fn):
+        self.future = future
+        self.fn = fn
+
+    def done(self):
+        return self.future.ready()
+
+    def cancel(self):
+        self.future.cancel()
+
+    def add_done_callback(self, callback):
+        self.future.add_done_callback(lambda future: callback(self))
+
+    def result(self, timeout=None):
+        return self.fn(self.future.result(timeout))
+
+    def then(self, fn):
+        return KaloomNetconfThen(self, fn)
+
+
+class KaloomNetconfStream(KaloomNetconfFuture):
+    """rpc-reply of an rpc, streamed as it is received: extract(elem) of its tag elements.
+
+    extract runs in the receiver, as soon as an element is complete; the element is then
+    cleared, so that the reply tree holds about one element at a time. Iterating yields the
+    extracted values (None ones are skipped), and raises ValueError on rpc-error, timeout or
+    session drop, once the values received before are yielded.
+    """
+    _END = object()
+
+    def __init__(self, session, msgid, tag, extract):
+        super(KaloomNetconfStream, self).__init__(session, msgid)
+        self.tag = tag
+        self.extract = extract
+        self.values = queue.LightQueue()
+        self.closed = False
+
+    def _complete(self, error=None):
+        if not self.completed:
+            self.values.put(self._END)
+        super(KaloomNetconfStream, self)._complete(error)
+
+    def element(self, elem):
+        """called by the receiver, with a complete tag element."""
+        if not self.closed:
+            try:
+                value = self.extract(elem)
+            except Exception as e:
+                value = None
+                LOG.error('Error occured: %s extracting %s of netconf msgid %s', e, elem.tag, self.msgid)
+            if value is not None:
+                self.values.put(value)
+        #processed subtrees are dropped, with their preceding siblings.
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    value = self.values.get(timeout=max(self.deadline - time.time(), 0))
+                except queue.Empty:
+                    break #result() raises the timeout
+                if value is self._END:
+                    break
+                yield value
+            resp = self.result()
+            if resp.find(TAG_NC_RPC_ERROR) is not None:
+                raise ValueError(rpc_error_message(resp))
+        finally:
+            #values of the rest of the reply are not extracted anymore, e.g. when the consumer stops early.
+            self.closed = True
+
+
+def gather(futures, timeout=None, return_exceptions=False):
+    """results of futures, waited for with one overall deadline of timeout seconds.
+
+    Futures still pending at the deadline are cancelled, and ValueError is raised.
+    An rpc that failed raises its error, after all futures completed; with
+    return_exceptions, the error takes the place of its result instead.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    results, error = [], None
+    for i, future in enumerate(futures):
+        remaining = max(deadline - time.time(), 0) if deadline is not None else None
+        try:
+            results.append(future.result(remaining))
+        except Exception as e:
+            if deadline is not None and time.time() >= deadline and not future.done():
+                for pending in futures[i:]:
+                    pending.cancel()
+                raise ValueError("timeout on %d of %d netconf rpcs" % (len(futures) - i, len(futures)))
+            if not return_exceptions and error is None:
+                error = e
+            results.append(e)
+    if error is not None:
+        raise error
+    return results
+
+
+class KaloomNetconfSession(object):
+    """One netconf session (ssh transport, netconf chan and its receiver) to vFabric.
+
+    The transport is the client of _new_client(): get_transport() is None or has is_active(),
+    close() drops it. _connect() returns the chan: recv(), sendall(), settimeout(), close().
+    This one is paramiko; subclasses connect over OpenSSH or kaloom netconf proxy.
+    """
+    def __init__(self, host, port, username, private_key_file, password, timeout_sec = 90,
+                 recv_size = netconf_framing.DEFAULT_RECV_SIZE):
         self.host = host
         self.port = port
         self.username = username
@@ -652,75 +1273,72 @@ class KaloomNetconf(object):
         self.timeout_sec = timeout_sec
         self.keepalive_interval_sec = int(timeout_sec * 0.8)
         self.connect_timeout = 20 ##socket connect timeout
+        self.recv_size = recv_size
 
-
-        self.client = paramiko.SSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client = self._new_client()
         self.chan = None
         self.netconf_session_id = None
-        self.msgid = 0
-        #self.version = self.get_vfabric_version()
-        self.receiver = KaloomNetconfRecv(self.client, self.chan)
+        self.capabilities = frozenset()
+        self.framing = netconf_framing.EOMDecoder()
+        #message-ids are per session: taken without a lock, next() does not yield.
+        self.msgids = itertools.count(1)
+        #sessions are per process: an in-process lock is enough to connect once.
+        self._init_lock = semaphore.Semaphore()
+        self.receiver = KaloomNetconfRecv(self.client, self.chan, recv_size)
+        self.sender = KaloomNetconfSender(self.receiver)
+        #in-flight window of the rpcs, by request class; the pool sets its window and rate limiter.
+        self.scheduler = netconf_scheduler.KaloomNetconfScheduler()
+        #outcomes of the rpcs; the pool sets its circuit breaker, none here.
+        self.breaker = netconf_breaker.KaloomNetconfBreaker()
+        #rpcs assigned to this session and not completed yet, including the ones not sent yet.
+        self.active = 0
+        #on_reconnect(session) once reconnected with a new session-id, e.g. vFabric restarted or
+        #failed over; the pool sets it.
+        self.on_reconnect = None
+
+    def _new_client(self):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        return client
+
+    def is_healthy(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active() and self.receiver.is_running()
 
-    def get_vfabric_version(self):
-        tag_schema = '{urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring}schema'
-        tag_schema_identifier = "{urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring}identifier"
-        tag_schema_version = "{urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring}version"
-        req_schema_list_rpc = """
-        <?xml version="1.0" encoding="UTF-8"?>
-        <rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-          <get>
-            <filter type="subtree">
-              <netconf-state xmlns=
-                "urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring">
-                <schemas/>
-              </netconf-state>
-            </filter>
-          </get>
-        </rpc>
-        """
-        resp = self._exec_netconf_cmd(req_schema_list_rpc)
-        LOG.debug(resp)
-        schema_xml_tree = objectify.fromstring(resp).getroottree()
-        root = schema_xml_tree.getroot()
-        schemas=root.findall(".//"+ tag_schema)
-        for schema in schemas:
-            idr = schema.find(tag_schema_identifier).text
-            version= schema.find(tag_schema_version).text
-            if idr == "virtual-fabric":
-                LOG.info("vfabric version %s detected", version)
-                return version #"2018-06-07" , "2018-09-24"
-        return None
+    def stats(self):
+        stats = self.receiver.stats()
+        stats.update(self.sender.stats())
+        stats.update(self.scheduler.stats())
+        stats.update(self.breaker.stats())
+        stats.update({'session_id': self.netconf_session_id, 'healthy': self.is_healthy(), 'active': self.active})
+        return stats
 
-    def _read(self):
-        responses=''
+    def stop(self, graceful=True):
+        self.sender.stop()
+        self.receiver.stop(graceful)
+
+    def wait(self):
+        return self.receiver.wait()
+
+    def _read(self, decoder):
+        """Reads the first frame on the chan; bytes after it stay in the decoder."""
         try:
             while True:
-              response = self.chan.recv(2048) #blocking until any data (paramiko has been patched, yields to avoid starvation)
-              responses = responses + response
-              index = responses.find(TERMINATOR)
-              if index != -1: #found
-                 return responses[:index]
+              response = self.chan.recv(self.recv_size) #blocking until any data (paramiko has been patched, yields to avoid starvation)
+              if len(response) == 0:
+                 raise ValueError("netconf channel closed before a complete msg is received")
+              frames = decoder.feed(response)
+              if frames:
+                 return frames[0].tobytes()
         except socket.timeout:
             with excutils.save_and_reraise_exception():
-              msg = "timeout on netconf recv, msg received so far: %s" % responses
+              msg = "timeout on netconf recv, %d bytes received so far" % decoder.pending()
               LOG.error(msg)
 
-    @lockutils.synchronized(kconst.SESSION_INIT_LOCK, external=True)
-    def _init_netconf_session(self):
-        transport = self.client.get_transport()
-        if transport is not None and transport.is_active():
-            return
-        #create a session/chan, reset msg_id, reset receiver thread 
-        self.msgid = 0
-        # stop receiver thread
-        if self.receiver.is_running():
-           self.receiver.stop()
-           self.receiver.wait()
-           LOG.info("kaloom netconf receiver loop stopped")
-
+    def _connect(self):
+        """Opens the transport, returns the chan on which netconf subsystem is running."""
         try:
-           private_key = paramiko.RSAKey.from_private_key_file(self.private_key_file)
+           private_key = load_private_key(self.private_key_file)
            self.client.connect(self.host, self.port, self.username,
                               pkey = private_key, look_for_keys=False, allow_agent=False, timeout = self.connect_timeout)
         except Exception as e:
@@ -731,452 +1349,1348 @@ class KaloomNetconf(object):
            except Exception as e:
               raise ValueError("vfabric netconf connect failed msg:%s" %  e)
         self.client.get_transport().set_keepalive(self.keepalive_interval_sec) #session keepalive 
-        self.chan = self.client.get_transport().open_session()
-        self.chan.invoke_subsystem('netconf')
+        chan = self.client.get_transport().open_session()
+        chan.invoke_subsystem('netconf')
+        return chan
+
+    def init(self):
+        #fast path of every rpc, the session is up.
+        if self.is_healthy():
+            return
+        with self._init_lock:
+            #connected by the greenthread holding the lock meanwhile.
+            if self.is_healthy():
+                return
+            self._init()
+
+    def _init(self):
+        #create a session/chan, reset msg_id, reset receiver thread 
+        self.msgids = itertools.count(1)
+        previous_session_id = self.netconf_session_id
+        # stop receiver thread, its exit closes the previous transport.
+        self.sender.stop()
+        self.receiver.stop()
+        self.receiver.wait()
+
+        self.chan = self._connect() #throws exception
         self.chan.settimeout(self.timeout_sec) #timeout on blocking read/write operations
 
-        hello_frm_server = self._read() #throws exception
+        decoder = netconf_framing.EOMDecoder()
+        hello_frm_server = self._read(decoder) #throws exception
 
         try:
-            msg = objectify.fromstring(hello_frm_server)
-            self.netconf_session_id = msg['session-id']
+            msg = parse_xml(hello_frm_server)
+            self.netconf_session_id = msg.findtext(TAG_NC_SESSION_ID)
+            if self.netconf_session_id is None:
+                raise ValueError('no session-id in hello message')
+            self.capabilities = frozenset(cap.strip() for cap in XPATH_CAPABILITY(msg))
         except Exception as e:
             with excutils.save_and_reraise_exception(): #throws exception
                LOG.error('Error reading session-id from hello message: %s', e)
+        changed = previous_session_id is not None and previous_session_id != self.netconf_session_id
+        if previous_session_id is not None:
+            METRICS.incr('reconnects')
+            if changed:
+                METRICS.incr('session_id_changes')
 
-        LOG.info('netconf session-id %s', self.netconf_session_id)
         LOG.debug(hello_frm_server)
         self.chan.sendall(MESG_HELLO + TERMINATOR)
 
-        #update receiver thread of the chan
-        self.receiver.update_chan(self.chan)
-
+        #hellos are always end-of-message framed, chunked framing starts after the hellos,
+        #when both peers advertise base:1.1 (RFC 6242).
+        if netconf_framing.BASE_1_1 in self.capabilities:
+           chunked = netconf_framing.ChunkedDecoder()
+           chunked.feed(decoder.leftover())
+           decoder = chunked
+        LOG.info('netconf session-id %s uses %s framing', self.netconf_session_id,
+                 'chunked' if isinstance(decoder, netconf_framing.ChunkedDecoder) else 'end-of-message')
+        self.framing = decoder
+
+        #receiver and sender threads live as long as the chan
+        self.receiver.update_chan(self.chan, decoder)
+        self.sender.update_chan(self.chan)
+
+        if changed and self.on_reconnect is not None:
+            LOG.info('netconf session-id %s replaces %s, vFabric state may have changed',
+                     self.netconf_session_id, previous_session_id)
+            self.on_reconnect(self)
         return
 
-    @lockutils.synchronized(kconst.MSGID_LOCK, external=True)
     def _get_next_msgid(self):
-        self.msgid = self.msgid + 1
-        return self.msgid
-
-    def _exec_netconf_cmd(self, req_xml):
-        self._init_netconf_session() #throws exception
-        msgid = self._get_next_msgid()
-        req_xml = req_xml.replace("message_id", str(msgid))
-        #before sending netconf request, notify callback event to be used by receiver thread.
-        evt = event.Event() # single event
-        self.receiver.add_callback_event(str(msgid), evt)
-        #send netconf request
-        self.chan.sendall(req_xml + TERMINATOR)
-        #block in event, until timeout 
-        try: 
-           with Timeout(self.timeout_sec):
-              response_xml = evt.wait()
-        except ValueError as e: #receiver thread on_done sends exception, stop waiting
-            msg = "Error on netconf reply recv for session-id %s msgid %s errmsg:%s" % (self.netconf_session_id, msgid, e)
-            LOG.error(msg)
-            raise ValueError(msg)
-        except Timeout: #Timeout
-            msg = "timeout on netconf reply recv for session-id %s msgid %s" % (self.netconf_session_id, msgid)
-            LOG.error(msg)
-            self.receiver.del_callback_event(str(msgid))
-            raise ValueError(msg)
+        return next(self.msgids)
 
-        xml_obj = xml.dom.minidom.parseString(response_xml)
-        pretty_xml = xml_obj.toprettyxml()
-        LOG.debug(pretty_xml)
-        return pretty_xml
-
-    def _edit_config_req(self, subtree):
-        edit_config_req = """
-            <?xml version="1.0" encoding="UTF-8"?>
-            <rpc xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="message_id">
-              <edit-config>
-                <target>
-                  <running />
-                </target>
-                <default-operation>none</default-operation>
-                <config>
-                    %s
-                </config>
-              </edit-config>
-            </rpc> """ % (subtree)
-        return edit_config_req
-
-    def _filter_req(self, subtree):
-        filter_req = """
-            <?xml version="1.0" encoding="UTF-8"?>
-            <rpc message-id="message_id" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-            <get>
-              <filter xmlns:ns0="urn:ietf:params:xml:ns:netconf:base:1.0" ns0:type="subtree">
-              %s
-              </filter>
-            </get>
-            </rpc> """ % (subtree)
-        return filter_req
-
-    def _get_l2_network(self, subtree):
-        get_nw_req = """
-            <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
-              <network>
-              <network-id>2</network-id>
-              %s
-              </network>
-              </networks>
-        """ % (subtree)
-
-        return self._filter_req(get_nw_req)
+    def rpc(self, req):
+        """sends netconf_rpc.Rpc req, returns the parsed rpc-reply."""
+        return self.submit(req).result()
 
-    def get_l2_network_by_name(self, nw_name):
-        nw_name_subtree = """
-        <node>
-        <node-id>%s</node-id>
-        <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
-           <KNID xmlns="urn:kaloom:faas:vfabric-l2-topology"/>
-        </l2-node-attributes>
-        </node>
-        """ % (nw_name)
+    def submit(self, req):
+        """sends netconf_rpc.Rpc req, returns its KaloomNetconfFuture without waiting for the reply.
 
-        req = self._get_l2_network(nw_name_subtree)
-        LOG.debug(req)
+        rpcs submitted on a session are processed by vFabric in order.
+        """
+        #counted before any yield, so that concurrent callers see this session as busy.
+        self.active += 1
+        try:
+            return self._submit(req)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.active -= 1
 
-        resp = self._exec_netconf_cmd(req)
-        LOG.debug(resp)
+    def probe(self, timeout=HEALTH_PROBE_TIMEOUT_SEC):
+        """False if the session does not answer an rpc within timeout; it is then closed.
 
-        nw_xml_root = objectify.fromstring(resp).getroottree()
-        nw = nw_xml_root.find('//' + TAG_L2_NODE_ATTR)
-        if nw is not None:
-           kaloom_knid = nw.find(TAG_NW_ATTR_KNID)
-           return {'kaloom_knid': int(kaloom_knid)}
-        return None
+        Closing fails the rpcs in flight on the session at once, rather than at their timeout.
+        """
+        try:
+            self.submit(MESG_HEALTH_PROBE).result(timeout)
+            return True
+        except Exception as e:
+            LOG.warning("netconf session-id %s failed its health probe: %s, closing it", self.netconf_session_id, e)
+            self.stop()
+            return False
 
-    def get_l2_network_names(self, prefix):
-        nw_name_subtree = """
-        <node>
-        <node-id/>
-        </node>
+    def stream(self, req, tag, extract):
+        """sends netconf_rpc.Rpc req, returns its KaloomNetconfStream of extract(tag elements)."""
+        self.active += 1
+        try:
+            return self._submit(req, functools.partial(KaloomNetconfStream, tag=tag, extract=extract))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.active -= 1
+
+    def _submit(self, req, future_class=KaloomNetconfFuture):
+        #waits for a slot of the in-flight window, released when the future completes; throws
+        #exception past the deadline of the caller.
+        priority, until, operation = netconf_scheduler.current()
+        self.scheduler.acquire(priority, until)
+        try:
+            self.init() #throws exception
+            msgid = self._get_next_msgid()
+            #before sending netconf request, notify callback event to be used by receiver thread.
+            future = future_class(self, msgid) # single event
+            future.priority = priority
+            future.operation = operation
+            future.request = req
+            if until is not None and until < future.deadline:
+                future.deadline = until
+            self.receiver.add_callback_event(str(msgid), future)
+            #queued to the sender, in msgid order: nothing yields since the msgid was taken.
+            try:
+               self.sender.send(msgid, self.framing.encode_parts(req.parts(msgid)))
+            except Exception:
+               with excutils.save_and_reraise_exception():
+                  self.receiver.del_callback_event(str(msgid))
+        except BaseException:
+            with excutils.save_and_reraise_exception():
+                self.scheduler.release(priority)
+        return future
+
+
+class KaloomNetconfOpenSSHSession(KaloomNetconfSession):
+    """netconf session over an OpenSSH client process (netconf_openssh), instead of paramiko.
+
+    ssh packets are encrypted and windowed by the ssh process, not by neutron-server
+    greenthreads; the sessions of the process share its ssh connection (ControlMaster).
+    """
+    def _new_client(self):
+        return netconf_openssh.KaloomNetconfOpenSSHClient()
+
+    def _connect(self):
+        try:
+           return self.client.connect(self.host, self.port, self.username, self.private_key_file,
+                                      self.connect_timeout, self.keepalive_interval_sec)
+        except Exception as e:
+           raise ValueError("vfabric netconf connect (openssh) failed msg:%s" % e)
+
+
+class KaloomNetconfProxyClient(object):
+    """Unix socket connection to kaloom netconf proxy, in place of paramiko.SSHClient."""
+    def __init__(self, path):
+        self.path = path
+        self.sock = None
+
+    def connect(self, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.path)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+        return sock
+
+    def get_transport(self):
+        return self if self.sock is not None else None
+
+    def is_active(self):
+        return self.sock is not None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class KaloomNetconfProxySession(KaloomNetconfSession):
+    """netconf session over the unix socket of kaloom netconf proxy (neutron-kaloom-netconf-proxy).
+
+    The proxy holds the ssh sessions to vFabric, so ssh handshake and keepalive
+    are not repeated by every neutron-server worker.
+    """
+    def __init__(self, proxy_socket, timeout_sec = 90, recv_size = netconf_framing.DEFAULT_RECV_SIZE):
+        self.proxy_socket = proxy_socket
+        super(KaloomNetconfProxySession, self).__init__(proxy_socket, None, None, None, None, timeout_sec, recv_size)
+
+    def _new_client(self):
+        return KaloomNetconfProxyClient(self.proxy_socket)
+
+    def _connect(self):
+        try:
+           return self.client.connect(self.connect_timeout)
+        except Exception as e:
+           raise ValueError("kaloom netconf proxy connect to %s failed msg:%s" % (self.proxy_socket, e))
+
+
+class KaloomNetconfSessionManager(object):
+    """Process-wide pool of netconf sessions to a vFabric.
+
+    There is one manager per vFabric (host, port, username) in the process, shared
+    by every KaloomNetconf built for it (ML2 driver, L2 cleanup, L3 driver and plugin).
+    Sessions are opened on demand, up to pool_size: an rpc goes to an idle healthy
+    session, else to a session not connected yet, else to the least-loaded healthy one.
+    With proxy_socket, the sessions go through kaloom netconf proxy instead of ssh.
+
+    With health_check_interval, a health checker started by the first rpc connects the
+    pool and standby sessions ahead of use, probes idle ones, and reconnects dropped
+    ones; rpcs are then not sent to sessions still connecting. A session that dropped
+    is swapped with a connected standby session, which becomes part of the pool.
+
+    A session has at most window rpcs in flight (netconf_scheduler); background and
+    bulk rpcs of the pool are limited to background_rate rpcs/s together.
+
+    After breaker_threshold consecutive failed rpcs or connects, rpcs fail at once
+    (netconf_breaker) until a probe, every breaker_reset_timeout seconds, succeeds.
+
+    Callbacks of subscribe() run when a session reconnects with a new session-id, once
+    for the sessions reconnecting within RECONNECT_DELAY_SEC, in a greenthread of their own.
+    """
+    _managers = {}
+
+    def __init__(self, host, port, username, private_key_file, password, timeout_sec, recv_size, pool_size,
+                 proxy_socket=None, standby=0, health_check_interval=0,
+                 window=netconf_scheduler.DEFAULT_WINDOW, background_rate=netconf_scheduler.DEFAULT_BACKGROUND_RATE,
+                 breaker_threshold=netconf_breaker.DEFAULT_THRESHOLD,
+                 breaker_reset_timeout=netconf_breaker.DEFAULT_RESET_TIMEOUT, ssh_backend=SSH_BACKEND_PARAMIKO):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.proxy_socket = proxy_socket
+        self.sessions = []
+        self.standby = []
+        self._checker = None
+        self.callbacks = []
+        self._reconnected = None
+        self.limiter = netconf_scheduler.KaloomNetconfRateLimiter(background_rate)
+        self.breaker = netconf_breaker.KaloomNetconfBreaker(breaker_threshold, breaker_reset_timeout, self._probe,
+                                                           proxy_socket or host)
+        METRICS.in_flight_sources.append(lambda: sum(session.active for session in self.sessions))
+        METRICS.send_queue_sources.append(lambda: sum(session.sender.queued() for session in self.sessions))
+        self.configure(private_key_file, password, timeout_sec, recv_size, pool_size, standby, health_check_interval,
+                       window, background_rate, breaker_threshold, breaker_reset_timeout, ssh_backend)
+
+    @classmethod
+    def get(cls, host, port, username, private_key_file, password, timeout_sec = 90,
+            recv_size = netconf_framing.DEFAULT_RECV_SIZE, pool_size = DEFAULT_POOL_SIZE, proxy_socket = None,
+            standby = 0, health_check_interval = 0, window = netconf_scheduler.DEFAULT_WINDOW,
+            background_rate = netconf_scheduler.DEFAULT_BACKGROUND_RATE,
+            breaker_threshold = netconf_breaker.DEFAULT_THRESHOLD,
+            breaker_reset_timeout = netconf_breaker.DEFAULT_RESET_TIMEOUT, ssh_backend = SSH_BACKEND_PARAMIKO):
+        key = (host, port, username, proxy_socket)
+        manager = cls._managers.get(key)
+        if manager is None:
+            manager = cls(host, port, username, private_key_file, password, timeout_sec, recv_size, pool_size,
+                          proxy_socket, standby, health_check_interval, window, background_rate,
+                          breaker_threshold, breaker_reset_timeout, ssh_backend)
+            cls._managers[key] = manager
+        else:
+            manager.configure(private_key_file, password, timeout_sec, recv_size, pool_size, standby,
+                              health_check_interval, window, background_rate, breaker_threshold,
+                              breaker_reset_timeout, ssh_backend)
+        return manager
+
+    def configure(self, private_key_file, password, timeout_sec, recv_size, pool_size, standby=0,
+                  health_check_interval=0, window=netconf_scheduler.DEFAULT_WINDOW,
+                  background_rate=netconf_scheduler.DEFAULT_BACKGROUND_RATE,
+                  breaker_threshold=netconf_breaker.DEFAULT_THRESHOLD,
+                  breaker_reset_timeout=netconf_breaker.DEFAULT_RESET_TIMEOUT, ssh_backend=SSH_BACKEND_PARAMIKO):
+        """(re)configure the pool; new settings apply to sessions on their next connect.
+
+        A new ssh_backend applies to sessions opened from now on.
         """
-        req = self._get_l2_network(nw_name_subtree)
-        LOG.debug(req)
+        if ssh_backend not in SSH_BACKENDS:
+            raise ValueError("unknown netconf ssh backend %s" % ssh_backend)
+        self.ssh_backend = ssh_backend
+        self.private_key_file = private_key_file
+        self.password = password
+        self.timeout_sec = timeout_sec
+        self.recv_size = recv_size
+        self.health_check_interval = health_check_interval
+        self.window = window
+        self.limiter.rate = background_rate
+        self.breaker.threshold = breaker_threshold
+        self.breaker.reset_timeout = breaker_reset_timeout
+        for session in self.sessions + self.standby:
+            session.private_key_file = private_key_file
+            session.password = password
+            session.timeout_sec = timeout_sec
+            session.recv_size = recv_size
+            session.receiver.recv_size = recv_size
+            #the window applies at once.
+            session.scheduler.resize(window)
+        #the pool only grows: sessions in use are not dropped on reconfigure.
+        while len(self.sessions) < pool_size:
+            self.sessions.append(self._new_session())
+        #standby sessions only take over dropped ones, i.e. with the health checker.
+        while len(self.standby) < (standby if health_check_interval else 0):
+            self.standby.append(self._new_session())
+
+    def _new_session(self):
+        if self.proxy_socket:
+            session = KaloomNetconfProxySession(self.proxy_socket, self.timeout_sec, self.recv_size)
+        else:
+            session_class = (KaloomNetconfOpenSSHSession if self.ssh_backend == SSH_BACKEND_OPENSSH
+                             else KaloomNetconfSession)
+            session = session_class(self.host, self.port, self.username, self.private_key_file,
+                                    self.password, self.timeout_sec, self.recv_size)
+        session.scheduler = netconf_scheduler.KaloomNetconfScheduler(self.window, self.limiter)
+        session.breaker = self.breaker
+        session.on_reconnect = self._on_reconnect
+        return session
+
+    def subscribe(self, callback):
+        """callback() once a session reconnected with a new session-id."""
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def _on_reconnect(self, session):
+        #called by the session connecting: callbacks send rpcs, they run in a greenthread of their own.
+        if self.callbacks and self._reconnected is None:
+            self._reconnected = greenthread.spawn_after(RECONNECT_DELAY_SEC, self._run_callbacks)
+
+    def _run_callbacks(self):
+        #a reconnect from now on schedules the callbacks again.
+        self._reconnected = None
+        for callback in list(self.callbacks):
+            try:
+                callback()
+            except Exception as e:
+                LOG.error('Error occured: %s in netconf reconnect callback %s', e, callback)
 
-        resp = self._exec_netconf_cmd(req)
-        LOG.debug(resp)
+    def start(self):
+        """starts the health checker, if configured and not running."""
+        if self.health_check_interval and self._checker is None:
+            self._checker = greenthread.spawn(self._check_loop)
 
-        nw_xml_root = objectify.fromstring(resp).getroottree()
-        networks = nw_xml_root.findall('//' + TAG_NODE_ID)
-        nw_names=[]
-        for nw in networks:
-            name = nw.text
-            if name.startswith(prefix):
-               nw_names.append(name)
-        return nw_names
+    def _check_loop(self):
+        LOG.debug("netconf health checker of %s started", self.proxy_socket or self.host)
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                LOG.error("netconf health check of %s failed: %s", self.proxy_socket or self.host, e)
+            greenthread.sleep(self.health_check_interval)
+
+    def check(self):
+        """connects the sessions not connected yet, probes the idle ones; errors are logged."""
+        for session in self.sessions + self.standby:
+            if session.is_healthy():
+                if session.active == 0:
+                    session.probe()
+                continue
+            try:
+                session.init()
+            except Exception as e:
+                LOG.warning("health checker could not open netconf session to %s: %s",
+                            self.proxy_socket or self.host, e)
+        self.promote()
+
+    def promote(self):
+        """swaps dropped (or not connected yet) sessions with connected standby ones."""
+        for i, session in enumerate(self.sessions):
+            #a session with rpcs assigned is being connected by their caller, or fails them.
+            if session.is_healthy() or session.active:
+                continue
+            standby = [candidate for candidate in self.standby if candidate.is_healthy()]
+            if not standby:
+                return
+            self.standby.remove(standby[0])
+            self.standby.append(session)
+            self.sessions[i] = standby[0]
+            LOG.info("netconf standby session-id %s promoted", standby[0].netconf_session_id)
+
+    def select(self):
+        if self.standby:
+            self.promote()
+        healthy = [session for session in self.sessions if session.is_healthy()]
+        idle = [session for session in healthy if session.active == 0]
+        if idle:
+            return idle[0]
+        #sessions not connected yet are connected by the health checker, when running.
+        if healthy and self._checker is not None:
+            return min(healthy, key=lambda session: session.active)
+        #all healthy sessions are busy, open another one if the pool allows.
+        unconnected = [session for session in self.sessions if session not in healthy]
+        if unconnected:
+            return min(unconnected, key=lambda session: session.active)
+        return min(healthy, key=lambda session: session.active)
+
+    def connected(self):
+        """a connected session, as selected for an rpc; e.g. to send several rpcs on the same session.
+
+        raises netconf_breaker.KaloomNetconfCircuitOpen at once while vFabric is deemed unreachable.
+        """
+        self.breaker.check()
+        try:
+            return self._connected()
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.breaker.failure()
+
+    def _probe(self, timeout=HEALTH_PROBE_TIMEOUT_SEC):
+        """True if a session, connected if needed, answers an rpc within timeout; for the circuit breaker."""
+        return self._connected().probe(timeout)
+
+    def _connected(self):
+        self.start()
+        session = self.select()
+        if not session.is_healthy():
+            connecting = session
+            connecting.active += 1 #reserved while connecting, so that others pick another session
+            try:
+                connecting.init()
+            except Exception as e:
+                healthy = [session for session in self.sessions if session.is_healthy()]
+                if not healthy:
+                    raise
+                LOG.warning("could not open netconf session to %s: %s, using an open one",
+                            self.proxy_socket or self.host, e)
+                session = min(healthy, key=lambda session: session.active)
+            finally:
+                connecting.active -= 1
+        return session
+
+    def rpc(self, req):
+        return self.connected().rpc(req)
+
+    def submit(self, req):
+        return self.connected().submit(req)
+
+    def stream(self, req, tag, extract):
+        return self.connected().stream(req, tag, extract)
+
+    def capabilities(self):
+        """netconf capabilities of vFabric, connects a session if none is connected."""
+        for session in self.sessions:
+            if session.is_healthy():
+                return session.capabilities
+        session = self.select()
+        session.init()
+        return session.capabilities
+
+    def stats(self):
+        return [session.stats() for session in self.sessions]
 
-    def get_tp_by_annotation(self, host):
-        _KEY = "OpenStack_OVS_Host"
-        tp_req = """
-        <top xmlns:nw="%(nw)s"
-           xmlns:nt="%(nt)s"
-           xmlns:vf="%(vf)s">
-           <nw:networks>
-             <nw:network>
-               <nw:network-id>1</nw:network-id>
-                 <nw:node>
-                   <nt:termination-point>
-                     <vf:annotations>
-                       <vf:the-key>%(key)s</vf:the-key>
-                       <vf:value>%(host)s</vf:value>
-                     </vf:annotations>
-                   </nt:termination-point>
-                 </nw:node>
-             </nw:network>
-           </nw:networks>
-        </top>
-        """ % {'nw': NW_NS , 'nt': NT_NS, 'vf':VF_NS , 'key':_KEY, 'host': host}
-
-        req = self._filter_req(tp_req)
-        LOG.debug(req)
+    def stop(self, graceful=True):
+        if self._checker is not None:
+            self._checker.kill()
+            self._checker = None
+        if self._reconnected is not None:
+            self._reconnected.cancel()
+            self._reconnected = None
+        for session in self.sessions + self.standby:
+            session.stop(graceful)
 
-        resp = self._exec_netconf_cmd(req)
-        LOG.debug(resp)
-
-        tp_xml_root = objectify.fromstring(resp).getroottree()
-        tps = tp_xml_root.findall('//' + TAG_TP_ATTR)
-        for tp in tps:
-            tpid = tp.find(TAG_TP_ID)
-            annotations = tp.findall(TAG_VF_ANNOTATIONS)
-            for annotation in annotations: 
-                 key = annotation.find(TAG_VF_KEY)
-                 value = annotation.find(TAG_VF_VALUE)
-                 if key == _KEY and value == host:
-                    return {'name': host, 'id': tpid}
-        return None
+    def wait(self):
+        for session in self.sessions + self.standby:
+            session.wait()
+
+
+def _config_key(elem):
+    """identity of a config element among its siblings: list entry by its keys, container by tag, leaf by value."""
+    keys = LIST_KEYS.get(elem.tag)
+    if keys is not None:
+        return (elem.tag,) + tuple(elem.findtext(key) for key in keys)
+    if len(elem):
+        return (elem.tag,)
+    return (elem.tag, elem.text)
+
+def merge_config(parent, elem):
+    """Adds config subtree elem under parent, merging it with the same list entry or container, if any.
+
+    An element carrying an nc:operation is an edit of its own, it is never merged.
+    """
+    if elem.get(TAG_NC_OPERATION) is None:
+        key = _config_key(elem)
+        for child in parent:
+            if child.get(TAG_NC_OPERATION) is None and _config_key(child) == key:
+                for grandchild in list(elem):
+                    merge_config(child, grandchild)
+                return
+    parent.append(elem)
+
+def config_key_path(config):
+    """key values of the list entries, from the root of config down to the edited (nc:operation) element."""
+    for elem in config.iter():
+        if elem.get(TAG_NC_OPERATION) is not None:
+            break
+    path = []
+    for entry in reversed([elem] + list(elem.iterancestors())):
+        keys = LIST_KEYS.get(entry.tag)
+        if keys is not None:
+            path.extend(entry.findtext(key) for key in keys)
+    return tuple(path)
+
+
+class KaloomNetconfBatchError(ValueError):
+    """rpc-errors of a batched edit-config.
+
+    errors is a list of (operation, error-message); operation is None for an error that
+    could not be attributed to an operation of the batch (no or unknown error-path).
+    """
+    def __init__(self, errors, operations):
+        self.errors = errors
+        self.operations = operations
+        super(KaloomNetconfBatchError, self).__init__(
+            '; '.join('%s: %s' % (operation, message) for operation, message in errors))
+
+    @property
+    def failed(self):
+        """operations that may have failed: all of them, if an error could not be attributed."""
+        failed = set(operation for operation, message in self.errors)
+        if None in failed:
+            return set(self.operations)
+        return failed
+
+
+class KaloomNetconfBatch(object):
+    """Collects KaloomNetconf edits, and sends them as a single edit-config.
+
+    Edit methods have the names and arguments of the KaloomNetconf ones, and return the
+    operation, (method name,) + arguments, that rpc-errors are attributed to.
+    With atomic, the edit-config uses rollback-on-error when vFabric supports it (else
+    stop-on-error); otherwise continue-on-error, each failed operation is reported.
+
+        with vfabric.batch(atomic=False) as batch:
+            batch.delete_l2_network(nw_name)
+    """
+    def __init__(self, vfabric, atomic=True):
+        self.vfabric = vfabric
+        self.atomic = atomic
+        self.reset()
 
-    def create_l2_network(self, nw_name, gui_nw_name, default_vlanid):
-        l2_create_req = """<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
-              <network>
-                <network-id>2</network-id>
-                <node xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="create">
-                  <node-id>%(name)s</node-id>
-                  <vl2-neighbors xmlns="urn:kaloom:faas:vfabric-l2-topology">
-                    <arp-suppression-enable>false</arp-suppression-enable>
-                    <nd-suppression-enable>false</nd-suppression-enable>
-                  </vl2-neighbors>
-                  <vl2-mac xmlns="urn:kaloom:faas:vfabric-l2-topology">
-                    <mac-address-table-aging-enable>false</mac-address-table-aging-enable>
-                  </vl2-mac>
-                  <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
-                    <name>%(gui_name)s</name>
-                    <description>%(gui_name)s</description>
-                  </l2-node-attributes>
-                </node></network></networks>""" % {'name': nw_name,'gui_name': gui_nw_name}
-
-        req = self._edit_config_req(l2_create_req)
-        resp = self._exec_netconf_cmd(req)
+    def reset(self):
+        self.config = etree.Element(TAG_NC_CONFIG, nsmap={None: NC_NS})
+        self.operations = []
+        self.key_paths = []
+        self.invalidations = [] #of the read cache and topology mirror, once sent
 
-        LOG.debug(resp)
-        self._validate_response(resp)
+    def __len__(self):
+        return len(self.operations)
 
-        return self.get_l2_network_by_name(nw_name)
+    def __enter__(self):
+        return self
 
-    def rename_l2_network(self, nw_name, gui_nw_name):
-        l2_rename_req = """<networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
-              <network>
-                <network-id>2</network-id>
-                <node>
-                  <node-id>%(nw_name)s</node-id>
-                  <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology" xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="merge">
-                    <name>%(gui_nw_name)s</name>
-                    <description>%(gui_nw_name)s</description>
-                  </l2-node-attributes>
-                </node></network></networks>""" % {'nw_name':nw_name, 'gui_nw_name': gui_nw_name}
-
-        req = self._edit_config_req(l2_rename_req)
-        resp = self._exec_netconf_cmd(req)
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.send()
+        else:
+            self.reset()
+
+    def _add(self, operation, subtree):
+        if operation in self.operations:
+            return operation
+        config = parse_xml(subtree)
+        self.operations.append(operation)
+        self.key_paths.append(config_key_path(config))
+        merge_config(self.config, config)
+        return operation
+
+    def error_option(self):
+        if not self.atomic:
+            return 'continue-on-error'
+        if CAP_ROLLBACK_ON_ERROR in self.vfabric.capabilities:
+            return 'rollback-on-error'
+        return 'stop-on-error'
+
+    @staticmethod
+    def _attribute(error, operations, key_paths):
+        """operations an rpc-error is about: the ones sharing the longest key path prefix with its error-path."""
+        error_path = error.findtext(TAG_NC_ERROR_PATH)
+        if not error_path:
+            return [None]
+        keys = tuple(match[1] for match in ERROR_PATH_KEY.findall(error_path))
+        best, matched = 0, [None]
+        for operation, key_path in zip(operations, key_paths):
+            common = 0
+            for key, op_key in zip(keys, key_path):
+                if key != op_key:
+                    break
+                common += 1
+            #error-path is inside the edited subtree, or above it.
+            if common < min(len(keys), len(key_path)) or common == 0:
+                continue
+            if common > best:
+                best, matched = common, [operation]
+            elif common == best:
+                matched.append(operation)
+        return matched
+
+    @timed('batch')
+    def send(self):
+        """sends the batched edits, raises KaloomNetconfBatchError on rpc-errors."""
+        if not self.operations:
+            return
+        operations, key_paths, invalidations = self.operations, self.key_paths, self.invalidations
+        subtree = b''.join(etree.tostring(elem) for elem in self.config)
+        try:
+            transaction = self.vfabric.current_transaction()
+            if transaction is not None:
+                resp = transaction.edit_config(subtree, self.error_option())
+            else:
+                req = netconf_rpc.edit_config(subtree, error_option=self.error_option())
+                resp = self.vfabric._exec_netconf_cmd(req)
+        finally:
+            self.reset()
+            for invalidate in invalidations:
+                invalidate()
+        if resp.find(TAG_NC_OK) is not None:
+            return
+        LOG.warning('vfabric: %s, batch of %d edits, msg-reply: %s', self.vfabric.host, len(operations),
+                    etree.tostring(resp))
+        errors = []
+        for error in XPATH_RPC_ERROR(resp):
+            message = error.findtext(TAG_NC_ERROR_MESSAGE) or error.findtext(TAG_NC_ERROR_TAG)
+            for operation in self._attribute(error, operations, key_paths):
+                errors.append((operation, message))
+        if not errors:
+            errors.append((None, rpc_error_message(resp)))
+        raise KaloomNetconfBatchError(errors, operations)
+
+    def create_l2_network(self, nw_name, gui_nw_name, default_vlanid=None):
+        self.invalidations.append(functools.partial(self.vfabric._invalidate_l2_network, nw_name))
+        return self._add(('create_l2_network', nw_name),
+                         self.vfabric._create_l2_network_config(nw_name, gui_nw_name))
 
-        LOG.debug(resp)
-        self._validate_response(resp)
+    def rename_l2_network(self, nw_name, gui_nw_name):
+        self.invalidations.append(functools.partial(self.vfabric._invalidate_l2_network, nw_name))
+        return self._add(('rename_l2_network', nw_name),
+                         self.vfabric._rename_l2_network_config(nw_name, gui_nw_name))
 
     def delete_l2_network(self, nw_name):
-        l2_delete_req = """
-        <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
-        <network>
-        <network-id>2</network-id>
-        <node xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="remove">
-        <node-id>%s</node-id>
-        </node>
-        </network>
-        </networks>""" % (nw_name)
+        self.invalidations.append(functools.partial(self.vfabric._invalidate_l2_network, nw_name))
+        return self._add(('delete_l2_network', nw_name),
+                         self.vfabric._delete_l2_network_config(nw_name))
 
-        req = self._edit_config_req(l2_delete_req)
-        resp = self._exec_netconf_cmd(req)
+    def attach_tp_to_l2_network(self, nw_name, attach_name, tpid, vlan_id):
+        return self._add(('attach_tp_to_l2_network', nw_name, tpid),
+                         self.vfabric._attach_tp_config(nw_name, attach_name, tpid, vlan_id))
 
-        LOG.debug(resp)
-        self._validate_response(resp)
+    def detach_tp_from_l2_network(self, nw_name, tpid):
+        return self._add(('detach_tp_from_l2_network', nw_name, tpid),
+                         self.vfabric._detach_tp_config(nw_name, tpid))
 
-    def attach_tp_to_l2_network(self, nw_name, attach_name, tpid, vlan_id):
-        attach_req = """
-           <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
-           <network>
-           <network-id>2</network-id>
-           <node>
-           <node-id>%(nw_name)s</node-id>
-           <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="create">
-           <tp-id>%(tpid)s</tp-id>
-           <l2-termination-point-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
-           <description>%(name)s</description>
-           <encapsulation-type xmlns="urn:kaloom:faas:vfabric-l2-topology">VLAN</encapsulation-type>
-           <vlan-id xmlns="urn:kaloom:faas:vfabric-l2-topology">%(vlan_id)d</vlan-id>
-           </l2-termination-point-attributes>
-           <name xmlns="urn:kaloom:faas:vfabric-l2-topology">%(name)s</name>
-           </termination-point>
-           </node>
-           </network>
-           </networks>""" % {"name": attach_name, "nw_name": nw_name, "tpid": tpid, "vlan_id": vlan_id}
-
-        req = self._edit_config_req(attach_req)
-        resp = self._exec_netconf_cmd(req)
-        self._validate_response(resp)
+    def rename_router(self, router_info):
+        self.invalidations.append(functools.partial(self.vfabric._invalidate_router, router_info['router_node_id'],
+                                                    router_info['router_name']))
+        return self._add(('rename_router', router_info['router_node_id']),
+                         self.vfabric._rename_router_config(router_info))
 
-        LOG.debug(resp)
+    def add_ipaddress_to_interface(self, router_info):
+        self.invalidations.append(functools.partial(self.vfabric._invalidate_topology, ('router', router_info['router_node_id'])))
+        return self._add(('add_ipaddress_to_interface', router_info['router_node_id'], router_info['ip_address']),
+                         self.vfabric._add_ipaddress_config(router_info))
 
-    def detach_tp_from_l2_network(self, nw_name, tpid):
-        detach_req = """
-        <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
-        <network>
-        <network-id>2</network-id>
-        <node>
-        <node-id>%s</node-id>
-        <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:a="urn:ietf:params:xml:ns:netconf:base:1.0" a:operation="remove">
-        <tp-id>%s</tp-id>
-        </termination-point>
-        </node>
-        </network>
-        </networks>
-        """ % (nw_name, tpid)
+    def delete_ipaddress_from_interface(self, router_info):
+        self.invalidations.append(functools.partial(self.vfabric._invalidate_topology, ('router', router_info['router_node_id'])))
+        return self._add(('delete_ipaddress_from_interface', router_info['router_node_id'], router_info['ip_address']),
+                         self.vfabric._delete_ipaddress_config(router_info))
 
-        req = self._edit_config_req(detach_req)
-        resp = self._exec_netconf_cmd(req)
+    def add_ip_static_route(self, route_info):
+        return self._add(('add_ip_static_route', route_info['router_node_id'], route_info['destination_prefix']),
+                         self.vfabric._add_static_route_config(route_info))
 
-        LOG.debug(resp)
-        self._validate_response(resp)
+    def delete_ip_static_route(self, route_info):
+        return self._add(('delete_ip_static_route', route_info['router_node_id'], route_info['destination_prefix']),
+                         self.vfabric._delete_static_route_config(route_info))
+
+
+class KaloomNetconfTransaction(object):
+    """Edits staged in the candidate datastore of vFabric, and applied by a single commit.
+
+    While the with block runs, KaloomNetconf edits (and batches) of the greenthread go to
+    the candidate, on a session of the pool pinned for the transaction. running and candidate
+    are locked, so that the commit does not overwrite changes made to running in between.
+    Leaving the block commits; on error, staged edits are dropped by discard-changes.
+
+        with vfabric.transaction():
+            vfabric.delete_ipaddress_from_interface(stale_info)
+            vfabric.add_ipaddress_to_interface(interface_info)
+
+    With confirmed, the commit is a confirmed-commit, rolled back by vFabric unless confirmed
+    within confirm_timeout seconds: commit() then confirm() in the block, e.g. with checks in
+    between; a pending confirmed-commit is cancelled on error, if vFabric supports it.
+    Without the candidate capability, or through the kaloom netconf proxy (which can't pin an
+    upstream session), edits go to running one by one, as outside of a transaction.
+    """
+    def __init__(self, vfabric, confirmed=False, confirm_timeout=DEFAULT_CONFIRM_TIMEOUT):
+        self.vfabric = vfabric
+        self.confirmed = confirmed
+        self.confirm_timeout = confirm_timeout
+        self.session = None
+        self.locked = []
+        self.edits = 0
+        self.committed = False
+        self.pending_confirm = False
+        self.invalidations = [] #of the read cache, run again once committed or discarded
+
+    def __enter__(self):
+        if self.vfabric.current_transaction() is not None:
+            raise ValueError("netconf transaction already in progress")
+        manager = self.vfabric.session_manager
+        if not manager.proxy_socket and CAP_CANDIDATE in self.vfabric.capabilities:
+            self.session = manager.connected()
+            try:
+                self._lock('running')
+                self._lock('candidate')
+                #changes left by a previous holder that died before its commit or discard.
+                self._rpc(b'<discard-changes/>')
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    self._unlock()
+        self.vfabric._local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.vfabric._local.transaction = None
+        if self.session is None:
+            return
+        try:
+            self._end(exc_type)
+        finally:
+            self.vfabric.flights.invalidate()
+            for invalidate in self.invalidations:
+                invalidate()
 
-    def _validate_response(self, resp):
-        resp_xml = objectify.fromstring(resp)
+    def _end(self, exc_type):
         try:
-            if resp_xml['ok']:
+            if exc_type is None:
+                try:
+                    self.commit()
+                    self.confirm()
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        self.rollback()
+            else:
+                self.rollback()
+        finally:
+            self._unlock()
+
+    def _send(self, operation):
+        return self.session.rpc(netconf_rpc.Rpc(operation))
+
+    def _rpc(self, operation):
+        self.vfabric._validate_response(self._send(operation))
+
+    def _lock(self, datastore):
+        for retry in range(LOCK_RETRIES):
+            resp = self._send(('<lock><target><%s/></target></lock>' % datastore).encode('ascii'))
+            if resp.find(TAG_NC_OK) is not None:
+                self.locked.append(datastore)
                 return
-        except AttributeError:
-            LOG.warning('session-id: %s, msg-reply: %s', self.netconf_session_id, resp)
-            raise ValueError(resp_xml['rpc-error']['error-message'])
+            #lock-denied: held by another session, until its commit or discard.
+            if resp.findtext('%s/%s' % (TAG_NC_RPC_ERROR, TAG_NC_ERROR_TAG)) != 'lock-denied':
+                break
+            greenthread.sleep(LOCK_RETRY_SEC)
+        self.vfabric._validate_response(resp)
 
-    def list_router_name_id(self):
-        req = L3_command_dict["LIST_ROUTER"]
-        resp = self._exec_netconf_cmd(req)
+    def _unlock(self):
+        while self.locked:
+            datastore = self.locked.pop()
+            try:
+                self._rpc(('<unlock><target><%s/></target></unlock>' % datastore).encode('ascii'))
+            except Exception as e:
+                #vFabric releases the locks of the session, when it closes.
+                LOG.warning("vfabric: %s, unlock %s failed: %s", self.vfabric.host, datastore, e)
+
+    def edit_config(self, subtree, error_option=None):
+        """edit-config of the transaction, returns the rpc-reply."""
+        self.edits += 1
+        if self.session is None:
+            return self.vfabric._exec_netconf_cmd(netconf_rpc.edit_config(subtree, error_option=error_option))
+        return self.session.rpc(netconf_rpc.edit_config(subtree, 'candidate', error_option))
+
+    @timed('commit')
+    def commit(self):
+        if self.session is None or self.committed:
+            return
+        self.committed = True
+        if self.edits == 0:
+            return
+        if self.confirmed:
+            self._rpc(('<commit><confirmed/><confirm-timeout>%d</confirm-timeout></commit>' % self.confirm_timeout).encode('ascii'))
+            self.pending_confirm = True
+        else:
+            self._rpc(b'<commit/>')
+
+    def confirm(self):
+        if self.pending_confirm:
+            self._rpc(b'<commit/>')
+            self.pending_confirm = False
 
-        LOG.debug(resp)
-        xml_root = objectify.fromstring(resp).getroottree()
-        nodes = xml_root.findall('//' + TAG_NODE)
-        routers=[]
-        for node in nodes:
-            node_attr = node.find(TAG_L3_ATTR)
-            name = node_attr.find(TAG_L3_NAME).text
-            node_id = node.find(TAG_NODE_ID).text
-            routers.append((name,node_id))
-        return routers
+    def rollback(self):
+        """drops staged edits, and cancels a pending confirmed-commit; errors are logged only."""
+        try:
+            if self.pending_confirm:
+                if CAP_CONFIRMED_COMMIT_1_1 in self.vfabric.capabilities:
+                    self._rpc(b'<cancel-commit/>')
+                else:
+                    LOG.warning("vfabric: %s, unconfirmed commit is rolled back in %d seconds",
+                                self.vfabric.host, self.confirm_timeout)
+                self.pending_confirm = False
+            self._rpc(b'<discard-changes/>')
+        except Exception as e:
+            LOG.warning("vfabric: %s, discard-changes failed: %s", self.vfabric.host, e)
+
+
+class KaloomNetconf(object):
+    def __init__(self, host, port, username, private_key_file, password, timeout_sec = 90,
+                 recv_size = netconf_framing.DEFAULT_RECV_SIZE, pool_size = DEFAULT_POOL_SIZE,
+                 transport = TRANSPORT_SSH, proxy_socket = None,
+                 cache_ttl = netconf_cache.DEFAULT_TTL, cache_size = netconf_cache.DEFAULT_SIZE,
+                 metrics_sink = None, standby = 0, health_check_interval = 0,
+                 config_queries = DEFAULT_CONFIG_QUERIES, window = netconf_scheduler.DEFAULT_WINDOW,
+                 background_rate = netconf_scheduler.DEFAULT_BACKGROUND_RATE,
+                 breaker_threshold = netconf_breaker.DEFAULT_THRESHOLD,
+                 breaker_reset_timeout = netconf_breaker.DEFAULT_RESET_TIMEOUT,
+                 ssh_backend = SSH_BACKEND_PARAMIKO, recorder_size = None,
+                 recorder_signal = netconf_recorder.DEFAULT_SIGNAL):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.timeout_sec = timeout_sec
+        if transport == TRANSPORT_PROXY:
+            if not proxy_socket:
+                raise ValueError("netconf transport %s needs a proxy socket" % transport)
+        elif transport == TRANSPORT_SSH:
+            proxy_socket = None
+        else:
+            raise ValueError("unknown netconf transport %s" % transport)
+        unknown = set(config_queries) - set(QUERIES)
+        if unknown:
+            raise ValueError("unknown netconf config queries %s" % ', '.join(sorted(unknown)))
+        #lookups reading the running configuration (get-config), others read state too (get).
+        self.config_queries = frozenset(config_queries)
+        #sessions are shared with every other KaloomNetconf of the process, for the same vFabric.
+        self.session_manager = KaloomNetconfSessionManager.get(host, port, username, private_key_file, password,
+                                                               timeout_sec, recv_size, pool_size, proxy_socket,
+                                                               standby, health_check_interval, window,
+                                                               background_rate, breaker_threshold,
+                                                               breaker_reset_timeout, ssh_backend)
+        #transaction in progress, per greenthread.
+        self._local = corolocal.local()
+        #lookups of this client, invalidated by its own writes.
+        self.cache = netconf_cache.KaloomNetconfCache(cache_ttl, cache_size)
+        #lookups in flight, shared by concurrent callers of the same lookup.
+        self.flights = netconf_cache.KaloomNetconfFlights()
+        #netconf_topology.KaloomTopologyMirror answering lookups, once attached and synced.
+        self.topology = None
+        if metrics_sink is not None:
+            METRICS.configure(metrics_sink)
+        if recorder_size is not None:
+            RECORDER.configure(recorder_size, recorder_signal)
+
+    @classmethod
+    def from_config(cls, conf, prefix):
+        """KaloomNetconf of the [KALOOM] options conf, e.g. cfg.CONF.KALOOM, mirroring the
+        topology of the prefix networks when netconf_topology_mirror is set."""
+        vfabric = cls(conf.kaloom_host, conf.kaloom_port, conf.kaloom_username,
+                      conf.kaloom_private_key_file, conf.kaloom_password,
+                      recv_size=conf.netconf_recv_size,
+                      pool_size=conf.netconf_pool_size,
+                      transport=conf.netconf_transport,
+                      proxy_socket=conf.netconf_proxy_socket,
+                      cache_ttl=conf.netconf_cache_ttl,
+                      cache_size=conf.netconf_cache_size,
+                      metrics_sink=conf.netconf_metrics_sink,
+                      standby=conf.netconf_standby_sessions,
+                      health_check_interval=conf.netconf_health_check_interval,
+                      config_queries=conf.netconf_config_queries,
+                      window=conf.netconf_window,
+                      background_rate=conf.netconf_background_rate,
+                      breaker_threshold=conf.netconf_breaker_threshold,
+                      breaker_reset_timeout=conf.netconf_breaker_reset_timeout,
+                      ssh_backend=conf.netconf_ssh_backend,
+                      recorder_size=conf.netconf_flight_recorder_size,
+                      recorder_signal=conf.netconf_flight_recorder_signal)
+        if conf.netconf_topology_mirror:
+            #netconf_topology imports this module
+            from networking_kaloom.ml2.drivers.kaloom.common import netconf_topology
+            netconf_topology.KaloomTopologyMirror.attach(vfabric, prefix)
+        return vfabric
+
+    @property
+    def capabilities(self):
+        return self.session_manager.capabilities()
+
+    def stats(self):
+        return self.session_manager.stats()
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def flight_stats(self):
+        return self.flights.stats()
+
+    def metrics(self):
+        """netconf_metrics snapshot of the process."""
+        return METRICS.snapshot()
+
+    def flight_records(self):
+        """last rpcs of the process, oldest first (netconf_recorder)."""
+        return RECORDER.dump()
+
+    def on_reconnect(self, callback):
+        """callback() once vFabric is reconnected with a new session-id: its state may have
+        drifted (restart, failover). Shared by the KaloomNetconf of the process for this vFabric."""
+        self.session_manager.subscribe(callback)
+
+    def off_reconnect(self, callback):
+        self.session_manager.unsubscribe(callback)
+
+    def priority(self, name):
+        """context manager: rpcs of this greenthread in the block are of request class name.
+
+        e.g. with vfabric.priority(netconf_scheduler.BACKGROUND): for periodic work.
+        """
+        return netconf_scheduler.priority(name)
+
+    def deadline(self, seconds):
+        """context manager: rpcs of this greenthread in the block fail once seconds elapsed, 0 for no deadline.
+
+        The timeout of the session still applies to each rpc.
+        """
+        return netconf_scheduler.deadline(seconds)
+
+    def _cached(self, key, lookup):
+        """lookup(), or its cached result; cached values must not be modified.
+
+        Not found (None) is not cached: another neutron-server process may create it.
+        """
+        if not self.cache.enabled:
+            return self.flights.do(key, lookup)
+        hit, value = self.cache.get(key)
+        if hit:
+            return value
+        generation = self.cache.generation
+        value = self.flights.do(key, lookup)
+        if value is not None:
+            self.cache.put(key, value, generation)
+        return value
+
+    def _invalidate(self, invalidation):
+        """runs invalidation now, i.e. after a write; again at the commit of a transaction in progress."""
+        self.flights.invalidate()
+        invalidation()
+        transaction = self.current_transaction()
+        if transaction is not None:
+            transaction.invalidations.append(invalidation)
+
+    def _invalidate_l2_network(self, nw_name):
+        self._invalidate(functools.partial(self.cache.invalidate, ('l2_network_by_name', nw_name)))
+        self._invalidate_topology(('l2', nw_name))
+
+    def _invalidate_router(self, router_node_id=None, router_name=None):
+        if router_node_id is not None:
+            self._invalidate(functools.partial(self.cache.invalidate_value, 'router_id_by_name', router_node_id))
+            self._invalidate_topology(('router', router_node_id))
+        if router_name is not None:
+            self._invalidate(functools.partial(self.cache.invalidate, ('router_id_by_name', router_name)))
+            self._invalidate_topology(('router_name', router_name))
+
+    def _invalidate_topology(self, key):
+        """marks key of the topology mirror stale; the notification of the write may come later."""
+        if self.topology is not None:
+            self._invalidate(functools.partial(self.topology.invalidate, key))
+        else:
+            self.flights.invalidate()
+
+    def _mirror(self, name=None):
+        """the topology mirror if it is synced, and mirrors name; None to query vFabric.
+
+        The mirror is started by its first lookup, i.e. in the process (worker) using it.
+        """
+        topology = self.topology
+        if topology is None:
+            return None
+        topology.start()
+        if not topology.synced or (name is not None and not name.startswith(topology.prefix)):
+            return None
+        return topology
 
+    def stop(self, graceful=True):
+        if self.topology is not None:
+            self.topology.stop(graceful)
+        self.session_manager.stop(graceful)
+
+    def wait(self):
+        if self.topology is not None:
+            self.topology.wait()
+        self.session_manager.wait()
+
+    def _exec_netconf_cmd(self, req):
+        return self.session_manager.rpc(req)
+
+    def _stream_netconf_cmd(self, req, tag, extract):
+        """iterable of extract(elem) of the tag elements of the rpc-reply, as it is received; req is sent now."""
+        return self.session_manager.stream(req, tag, extract)
+
+    def submit(self, req):
+        """sends netconf_rpc.Rpc req now, returns the KaloomNetconfFuture of its rpc-reply.
+
+        Several rpcs are in flight at once: submit them all, then gather() their replies.
+        """
+        return self.session_manager.submit(req)
+
+    @timed('get_vfabric_version')
+    def get_vfabric_version(self):
+        tag_schema = '{urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring}schema'
+        tag_schema_identifier = "{urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring}identifier"
+        tag_schema_version = "{urn:ietf:params:xml:ns:yang:ietf-netconf-monitoring}version"
+        root = self.flights.do(('schemas',), lambda: self._exec_netconf_cmd(L2_command_dict['GET_SCHEMAS'].rpc()))
+        for schema in root.iter(tag_schema):
+            idr = schema.findtext(tag_schema_identifier)
+            version= schema.findtext(tag_schema_version)
+            if idr == "virtual-fabric":
+                LOG.info("vfabric version %s detected", version)
+                return version #"2018-06-07" , "2018-09-24"
+        return None
+
+    def _edit_config(self, subtree):
+        transaction = self.current_transaction()
+        if transaction is not None:
+            resp = transaction.edit_config(subtree)
+        else:
+            resp = self._exec_netconf_cmd(netconf_rpc.edit_config(subtree))
+        self._validate_response(resp)
+
+    def batch(self, atomic=True):
+        """KaloomNetconfBatch: edits sent as a single edit-config."""
+        return KaloomNetconfBatch(self, atomic)
+
+    def transaction(self, confirmed=False, confirm_timeout=DEFAULT_CONFIRM_TIMEOUT):
+        """KaloomNetconfTransaction: edits of the with block applied by a single commit."""
+        return KaloomNetconfTransaction(self, confirmed, confirm_timeout)
+
+    def current_transaction(self):
+        return getattr(self._local, 'transaction', None)
+
+    @timed('get_l2_network_by_name')
+    def get_l2_network_by_name(self, nw_name):
+        topology = self._mirror(nw_name)
+        if topology is not None:
+            return topology.l2_network(nw_name)
+        return self._cached(('l2_network_by_name', nw_name), lambda: self._get_l2_network_by_name(nw_name))
+
+    def _get_l2_network_by_name(self, nw_name):
+        resp = self._exec_netconf_cmd(self._query_rpc('get_l2_network_by_name', 'GET_L2_NETWORK_BY_NAME', nw_name=nw_name))
+
+        nodes = XPATH_NODE(resp)
+        if nodes:
+           return l2_network_info(nodes[0])
+        return None
+
+    def _query_rpc(self, query, template, **values):
+        """rpc of template of lookup query: its get, or its get-config when query reads configuration only."""
+        command_dict = QUERIES[query][0]
+        if query in self.config_queries:
+            template = template + '_CONFIG'
+        return command_dict[template].rpc(**values)
+
+    def _prefix_rpc(self, query, template, prefix):
+        """_query_rpc of template, filtered by prefix on vFabric when it supports xpath filters.
+
+        Otherwise the rpc of template gets all nodes, filtered on reply.
+        """
+        if prefix and CAP_XPATH in self.capabilities:
+            return self._query_rpc(query, template + '_XPATH', prefix=netconf_rpc.xpath_literal(prefix))
+        return self._query_rpc(query, template)
+
+    @timed('get_l2_network_names')
+    def get_l2_network_names(self, prefix):
+        """iterator of the l2 network names starting with prefix, streamed from the reply."""
+        topology = self._mirror(prefix)
+        if topology is not None:
+            return iter([name for name in topology.l2_network_names() if name.startswith(prefix)])
+        def l2_network_name(node):
+            name = node.findtext(TAG_NODE_ID)
+            return name if name is not None and name.startswith(prefix) else None
+        req = self._prefix_rpc('get_l2_network_names', 'GET_L2_NETWORK_NAMES', prefix)
+        return iter(self._stream_netconf_cmd(req, TAG_NODE, l2_network_name))
+
+    @timed('get_tp_by_annotation')
+    def get_tp_by_annotation(self, host):
+        topology = self._mirror()
+        if topology is not None:
+            return topology.tp(host)
+        return self._cached(('tp_by_annotation', host), lambda: self._get_tp_by_annotation(host))
+
+    def _get_tp_by_annotation(self, host):
+        req = self._query_rpc('get_tp_by_annotation', 'GET_TP_BY_ANNOTATION', key=TP_HOST_ANNOTATION, host=host)
+        def tp_id(tp):
+            return tp.findtext(TAG_TP_ID) if host in annotated_hosts(tp) else None
+        #the rest of the reply is not extracted, once the tp is found.
+        for tpid in self._stream_netconf_cmd(req, TAG_NT_TP, tp_id):
+            return {'name': host, 'id': tpid}
+        return None
+
+    def _create_l2_network_config(self, nw_name, gui_nw_name):
+        return L2_command_dict['CREATE_L2_NETWORK'].fill(name=nw_name, gui_name=gui_nw_name)
+
+    @timed('create_l2_network')
+    def create_l2_network(self, nw_name, gui_nw_name, default_vlanid):
+        if self.current_transaction() is not None:
+            try:
+                self._edit_config(self._create_l2_network_config(nw_name, gui_nw_name))
+            finally:
+                self._invalidate_l2_network(nw_name)
+            return self.get_l2_network_by_name(nw_name)
+        #on a session to vFabric, the KNID get is pipelined behind the edit: vFabric replies in order.
+        #a proxy may relay the rpcs of a connection on different vFabric sessions: get once the edit is replied.
+        session = self.session_manager.connected()
+        get_rpc = self._query_rpc('get_l2_network_by_name', 'GET_L2_NETWORK_BY_NAME', nw_name=nw_name)
+        try:
+            edit = session.submit(netconf_rpc.edit_config(self._create_l2_network_config(nw_name, gui_nw_name)))
+            if isinstance(session, KaloomNetconfProxySession):
+                self._validate_response(edit.result())
+                get = session.submit(get_rpc)
+            else:
+                get = session.submit(get_rpc)
+                self._validate_response(edit.result())
+            nodes = XPATH_NODE(get.result())
+        finally:
+            self._invalidate_l2_network(nw_name)
+        if nodes:
+            return l2_network_info(nodes[0])
+        return None
+
+    def _rename_l2_network_config(self, nw_name, gui_nw_name):
+        return L2_command_dict['RENAME_L2_NETWORK'].fill(nw_name=nw_name, gui_nw_name=gui_nw_name)
+
+    @timed('rename_l2_network')
+    def rename_l2_network(self, nw_name, gui_nw_name):
+        try:
+            self._edit_config(self._rename_l2_network_config(nw_name, gui_nw_name))
+        finally:
+            self._invalidate_l2_network(nw_name)
+
+    def _delete_l2_network_config(self, nw_name):
+        return L2_command_dict['DELETE_L2_NETWORK'].fill(nw_name=nw_name)
+
+    @timed('delete_l2_network')
+    def delete_l2_network(self, nw_name):
+        try:
+            self._edit_config(self._delete_l2_network_config(nw_name))
+        finally:
+            self._invalidate_l2_network(nw_name)
+
+    def _attach_tp_config(self, nw_name, attach_name, tpid, vlan_id):
+        return L2_command_dict['ATTACH_TP'].fill(name=attach_name, nw_name=nw_name, tpid=tpid, vlan_id=int(vlan_id))
+
+    @timed('attach_tp_to_l2_network')
+    def attach_tp_to_l2_network(self, nw_name, attach_name, tpid, vlan_id):
+        self._edit_config(self._attach_tp_config(nw_name, attach_name, tpid, vlan_id))
+
+    def _detach_tp_config(self, nw_name, tpid):
+        return L2_command_dict['DETACH_TP'].fill(nw_name=nw_name, tpid=tpid)
+
+    @timed('detach_tp_from_l2_network')
+    def detach_tp_from_l2_network(self, nw_name, tpid):
+        self._edit_config(self._detach_tp_config(nw_name, tpid))
+
+    def _validate_response(self, resp):
+        if resp.find(TAG_NC_OK) is not None:
+            return
+        LOG.warning('vfabric: %s, msg-reply: %s', self.host, etree.tostring(resp))
+        raise ValueError(rpc_error_message(resp))
+
+    @timed('list_router_name_id')
+    def list_router_name_id(self, prefix=''):
+        """iterator of (router name, router node-id) of the routers named prefix..., streamed from the reply."""
+        topology = self._mirror()
+        if topology is not None:
+            return iter([(name, node_id) for name, node_id in topology.router_name_ids() if name.startswith(prefix)])
+        req = self._prefix_rpc('list_router_name_id', 'LIST_ROUTER', prefix)
+        def router_name_id(node):
+            name = node.findtext(TAG_L3_ATTR + '/' + TAG_L3_NAME)
+            return (name, node.findtext(TAG_NODE_ID)) if name is not None and name.startswith(prefix) else None
+        return iter(self._stream_netconf_cmd(req, TAG_NODE, router_name_id))
+
+    @timed('get_router_id_by_name')
     def get_router_id_by_name(self, router_name):
-        req = L3_command_dict["GET_ROUTER_ID"] % {'name':router_name}
+        topology = self._mirror()
+        if topology is not None:
+            return topology.router_id(router_name)
+        return self._cached(('router_id_by_name', router_name), lambda: self._get_router_id_by_name(router_name))
+
+    def _get_router_id_by_name(self, router_name):
+        req = self._query_rpc('get_router_id_by_name', 'GET_ROUTER_ID', name=router_name)
         resp = self._exec_netconf_cmd(req)
 
-        LOG.debug(resp)
-        xml_root = objectify.fromstring(resp).getroottree()
-        id = xml_root.find('//' + TAG_NODE_ID)
-        if id is None:
+        ids = XPATH_NODE_ID(resp)
+        if not ids:
             return None
-        return id.text
+        return ids[0]
 
+    @timed('get_router_interface_info')
     def get_router_interface_info(self, router_name, l2_node_id):
-        req = L3_command_dict["GET_ROUTER_INTERFACE_INFO"] % {'router_name': router_name}
-        resp = self._exec_netconf_cmd(req)
-        LOG.debug(resp)
-        router_inf_info={'node_id': None, 'interface': None, 'cidrs': []}
-
-        xml_root = objectify.fromstring(resp).getroottree()
-        node = xml_root.find('//' + TAG_NODE)
+        topology = self._mirror()
+        if topology is not None:
+            return topology.router_interface_info(router_name, l2_node_id)
+        #the router node is the same for any l2_node: a single flight per router.
+        node = self.flights.do(('router_node', router_name), lambda: self._get_router_node(router_name))
         if node is None:
-           return router_inf_info
-        router_inf_info['node_id'] = node.find(TAG_NODE_ID).text
-        nt_tps = node.findall(TAG_NT_TP)
-        #find router_interface connecting to l2_node, if any
-        for nt_tp in nt_tps:
-           supporting_tp = nt_tp.find(TAG_NT_SUPPORTING_TP)
-           supporting_node_layer = supporting_tp.find(TAG_NT_NETWORK_REF).text
-           supporting_node_id = supporting_tp.find(TAG_NT_NODE_REF).text
-           if supporting_node_layer == '2' and supporting_node_id == l2_node_id:
-              router_inf_info['interface'] = nt_tp.find(TAG_L3T_L3_TP_ATTR).find(TAG_VL3T_IFNAME).text
-              break
-        #now find IPs for the router_interface
-        if router_inf_info['interface']:
-           interfaces = node.find(TAG_VIF_INTERFACES).findall(TAG_VIF_INTERFACE)
-           for interface in interfaces:
-              if router_inf_info['interface'] == interface.find(TAG_VIF_NAME).text:
-                interface_ipv4_addresses = interface.find(TAG_VIP_IPV4).findall(TAG_VIP_ADDRESS)
-                interface_ipv6_addresses = interface.find(TAG_VIP_IPV6).findall(TAG_VIP_ADDRESS)
-                for address in interface_ipv4_addresses + interface_ipv6_addresses:
-                  ip = address.find(TAG_VIP_IP).text
-                  prefix_length = address.find(TAG_VIP_PREFIX_LENGTH).text
-                  cidr = '%s/%s' % (ip, prefix_length)
-                  router_inf_info['cidrs'].append(cidr)
-                break
-        return router_inf_info
+           return {'node_id': None, 'interface': None, 'cidrs': []}
+        #router_interface connecting to l2_node, if any, and its IPs
+        return router_interface_info(node[0], node[1], l2_node_id)
 
-    def create_router(self, router_name):
-        req = L3_command_dict["CREATE_ROUTER"] % {'router_name':router_name}
+    def _get_router_node(self, router_name):
+        """(node-id, router_info()) of the router, None if it does not exist."""
+        req = self._query_rpc('get_router_interface_info', 'GET_ROUTER_INTERFACE_INFO', router_name=router_name)
         resp = self._exec_netconf_cmd(req)
 
-        LOG.debug(resp)
-        resp_xml = objectify.fromstring(resp)
-        xml_root = resp_xml.getroottree()
-        node_id = xml_root.find(TAG_L3_NODE_ID)
+        nodes = XPATH_NODE(resp)
+        if not nodes:
+           return None
+        return (nodes[0].findtext(TAG_NODE_ID), router_info(nodes[0]))
+
+    @timed('create_router')
+    def create_router(self, router_name):
+        req = L3_command_dict["CREATE_ROUTER"].rpc(router_name=router_name)
+        try:
+            resp = self._exec_netconf_cmd(req)
+        finally:
+            self._invalidate_router(router_name=router_name)
+        self._create_router_reply(resp)
+
+    def submit_create_router(self, router_name):
+        """create_router, sent now; the future raises ValueError as create_router does."""
+        start = time.time()
+        future = self.submit(L3_command_dict["CREATE_ROUTER"].rpc(router_name=router_name))
+        future.add_done_callback(lambda future: self._invalidate_router(router_name=router_name))
+        future.add_done_callback(lambda future: METRICS.observe('create_router', time.time() - start))
+        return future.then(self._create_router_reply)
+
+    def _create_router_reply(self, resp):
+        node_id = resp.find(TAG_L3_NODE_ID)
         if node_id is None:
-            raise ValueError(resp_xml['rpc-error']['error-message'])
+            raise ValueError(rpc_error_message(resp))
 
-    def rename_router(self, router_info):
-        req = L3_command_dict["RENAME_ROUTER"] % {'router_node_id':router_info['router_node_id'], 'router_name':router_info['router_name']}
-        resp = self._exec_netconf_cmd(req)
+    def _rename_router_config(self, router_info):
+        return L3_command_dict["RENAME_ROUTER"].fill(router_node_id=router_info['router_node_id'], router_name=router_info['router_name'])
 
-        LOG.debug(resp)
-        self._validate_response(resp)   ##raise ValueError
+    @timed('rename_router')
+    def rename_router(self, router_info):
+        try:
+            self._edit_config(self._rename_router_config(router_info))   ##raise ValueError
+        finally:
+            self._invalidate_router(router_info['router_node_id'], router_info['router_name'])
 
+    @timed('delete_router')
     def delete_router(self, router_node_id):
-        req = L3_command_dict["DELETE_ROUTER"] % {'router_node_id':router_node_id}
-        resp = self._exec_netconf_cmd(req)
-
-        LOG.debug(resp)
+        req = L3_command_dict["DELETE_ROUTER"].rpc(router_node_id=router_node_id)
+        try:
+            resp = self._exec_netconf_cmd(req)
+        finally:
+            self._invalidate_router(router_node_id)
         self._validate_response(resp)   ##raise ValueError
 
+    @timed('attach_router')
     def attach_router(self, router_node_id, l2_node_id):
-        req = L3_command_dict["ATTACH_ROUTER"] % {'router_node_id':router_node_id, 'l2_node_id':l2_node_id}
-        resp = self._exec_netconf_cmd(req)
+        req = L3_command_dict["ATTACH_ROUTER"].rpc(router_node_id=router_node_id, l2_node_id=l2_node_id)
+        try:
+            resp = self._exec_netconf_cmd(req)
+        finally:
+            self._invalidate_topology(('router', router_node_id))
 
-        LOG.debug(resp)
-        resp_xml = objectify.fromstring(resp)
-        xml_root = resp_xml.getroottree()
-        tp_interface = xml_root.find(TAG_L3_INTERFACE_NAME)
+        tp_interface = resp.find(TAG_L3_INTERFACE_NAME)
         if tp_interface is None:
-            raise ValueError(resp_xml['rpc-error']['error-message'])
+            raise ValueError(rpc_error_message(resp))
         else:
             return tp_interface.text
 
+    @timed('detach_router')
     def detach_router(self, router_node_id, l2_node_id):
-        req = L3_command_dict["DETACH_ROUTER"] % {'router_node_id':router_node_id, 'l2_node_id':l2_node_id}
-        resp = self._exec_netconf_cmd(req)
-
-        LOG.debug(resp)
+        req = L3_command_dict["DETACH_ROUTER"].rpc(router_node_id=router_node_id, l2_node_id=l2_node_id)
+        try:
+            resp = self._exec_netconf_cmd(req)
+        finally:
+            self._invalidate_topology(('router', router_node_id))
         self._validate_response(resp)   ##raise ValueError
 
-    def add_ipaddress_to_interface(self, router_info):
+    def _add_ipaddress_config(self, router_info):
         if router_info['ip_version'] == 4:
-            req = L3_command_dict["addIPv4AddressToInterface"]
+            subtree = L3_command_dict["addIPv4AddressToInterface"]
         else:
-            req = L3_command_dict["addIPv6AddressToInterface"]
-        req = req % {'router_node_id':router_info['router_node_id'], 'interface_name':router_info['interface_name'], 'ip_address':router_info['ip_address'], 'prefix_length':router_info['prefix_length']}
-        resp = self._exec_netconf_cmd(req)
+            subtree = L3_command_dict["addIPv6AddressToInterface"]
+        return subtree.fill(router_node_id=router_info['router_node_id'], interface_name=router_info['interface_name'], ip_address=router_info['ip_address'], prefix_length=router_info['prefix_length'])
 
-        LOG.debug(resp)
-        self._validate_response(resp)   ##raise ValueError
+    @timed('add_ipaddress_to_interface')
+    def add_ipaddress_to_interface(self, router_info):
+        try:
+            self._edit_config(self._add_ipaddress_config(router_info))   ##raise ValueError
+        finally:
+            self._invalidate_topology(('router', router_info['router_node_id']))
 
-    def delete_ipaddress_from_interface(self, router_info):
+    def _delete_ipaddress_config(self, router_info):
         if router_info['ip_version'] == 4:
-            req = L3_command_dict["deleteIPv4AddressFromInterface"]
+            subtree = L3_command_dict["deleteIPv4AddressFromInterface"]
         else:
-            req = L3_command_dict["deleteIPv6AddressFromInterface"]
-        req = req % {'router_node_id':router_info['router_node_id'], 'interface_name':router_info['interface_name'], 'ip_address':router_info['ip_address']}
-        resp = self._exec_netconf_cmd(req)
+            subtree = L3_command_dict["deleteIPv6AddressFromInterface"]
+        return subtree.fill(router_node_id=router_info['router_node_id'], interface_name=router_info['interface_name'], ip_address=router_info['ip_address'])
 
-        LOG.debug(resp)
-        self._validate_response(resp)   ##raise ValueError
+    @timed('delete_ipaddress_from_interface')
+    def delete_ipaddress_from_interface(self, router_info):
+        try:
+            self._edit_config(self._delete_ipaddress_config(router_info))   ##raise ValueError
+        finally:
+            self._invalidate_topology(('router', router_info['router_node_id']))
 
-    def add_ip_static_route(self, route_info):
+    def _add_static_route_config(self, route_info):
         if route_info['ip_version'] == 4:
-            req = L3_command_dict["addIPv4StaticRoute"]
+            subtree = L3_command_dict["addIPv4StaticRoute"]
         else:
-            req = L3_command_dict["addIPv6StaticRoute"]
-        req = req % {'router_node_id': route_info['router_node_id'], 'destination_prefix':route_info['destination_prefix'], 'next_hop_address':route_info['next_hop_address']}
-        resp = self._exec_netconf_cmd(req)
+            subtree = L3_command_dict["addIPv6StaticRoute"]
+        return subtree.fill(router_node_id=route_info['router_node_id'], destination_prefix=route_info['destination_prefix'], next_hop_address=route_info['next_hop_address'])
 
-        LOG.debug(resp)
-        self._validate_response(resp)   ##raise ValueError
+    @timed('add_ip_static_route')
+    def add_ip_static_route(self, route_info):
+        self._edit_config(self._add_static_route_config(route_info))   ##raise ValueError
 
-    def delete_ip_static_route(self, route_info):
+    def _delete_static_route_config(self, route_info):
         if route_info['ip_version'] == 4:
-            req = L3_command_dict["deleteIPv4StaticRoute"]
+            subtree = L3_command_dict["deleteIPv4StaticRoute"]
         else:
-            req = L3_command_dict["deleteIPv6StaticRoute"]
-        req = req % {'router_node_id':route_info['router_node_id'], 'destination_prefix':route_info['destination_prefix']}
-        resp = self._exec_netconf_cmd(req)
+            subtree = L3_command_dict["deleteIPv6StaticRoute"]
+        return subtree.fill(router_node_id=route_info['router_node_id'], destination_prefix=route_info['destination_prefix'])
 
-        LOG.debug(resp)
-        self._validate_response(resp)   ##raise ValueError
+    @timed('delete_ip_static_route')
+    def delete_ip_static_route(self, route_info):
+        self._edit_config(self._delete_static_route_config(route_info))   ##raise ValueError
 
 if __name__ == "__main__":
     from eventlet import monkey_patch
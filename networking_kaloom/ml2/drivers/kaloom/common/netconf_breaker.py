@@ -0,0 +1,115 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from eventlet import greenthread
+from oslo_log import log
+
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_metrics import METRICS
+
+LOG = log.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+#consecutive failures opening the circuit, 0 for never
+DEFAULT_THRESHOLD = 5
+#seconds between probes of an open circuit
+DEFAULT_RESET_TIMEOUT = 10
+#reason of an rpc cancelled at the timeout of its session, a failure; not at an earlier deadline of its caller.
+TIMEOUT = 'timeout'
+DEADLINE_EXCEEDED = 'deadline exceeded'
+
+
+class KaloomNetconfCircuitOpen(ValueError):
+    """vFabric is deemed unreachable: rpcs fail at once, until a background probe succeeds."""
+
+
+class KaloomNetconfBreaker(object):
+    """Circuit breaker of a session pool to a vFabric.
+
+    Each rpc reports its outcome: a reply (rpc-error included) is a success; a timeout,
+    a dropped session or a failed connect is a failure; an rpc cancelled by its caller,
+    e.g. past the caller's deadline, is neither. threshold consecutive failures
+    open the circuit: check() then raises KaloomNetconfCircuitOpen, and probe() is
+    called every reset_timeout seconds in the background (half-open) until it succeeds,
+    which closes the circuit. Callers are never used as a trial.
+    """
+    def __init__(self, threshold=0, reset_timeout=DEFAULT_RESET_TIMEOUT, probe=None, name=''):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self._prober = None
+
+    def check(self):
+        if self.state != CLOSED:
+            METRICS.incr('circuit_rejects')
+            raise KaloomNetconfCircuitOpen("vFabric %s unavailable after %d consecutive netconf failures, "
+                                           "probed every %ss" % (self.name, self.failures, self.reset_timeout))
+
+    def record(self, future, error=None):
+        """outcome of a completed (or cancelled) KaloomNetconfFuture.
+
+        error: None, the exception of a failed rpc, or the reason it was cancelled.
+        """
+        if future.ready() and not future.has_exception():
+            self.success()
+        elif isinstance(error, Exception) or error == TIMEOUT:
+            self.failure()
+
+    def success(self):
+        if self.state == HALF_OPEN:
+            LOG.info("vFabric %s answers again, netconf circuit closed", self.name)
+            self.state = CLOSED
+        if self.state == CLOSED:
+            self.failures = 0
+
+    def failure(self):
+        #rpcs in flight when the circuit opened do not count.
+        if self.threshold <= 0 or self.state == OPEN:
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self._open()
+
+    def _open(self):
+        #a failed probe opens it again: not counted as another opening.
+        if self.state == CLOSED:
+            LOG.warning("vFabric %s: %d consecutive netconf failures, circuit opened", self.name, self.failures)
+            METRICS.incr('circuit_opens')
+        self.state = OPEN
+        if self._prober is None and self.probe is not None:
+            self._prober = greenthread.spawn(self._probe_loop)
+
+    def _probe_loop(self):
+        try:
+            while self.state != CLOSED:
+                greenthread.sleep(self.reset_timeout)
+                self.state = HALF_OPEN
+                try:
+                    ok = self.probe()
+                except Exception as e:
+                    LOG.warning("vFabric %s: netconf probe failed: %s", self.name, e)
+                    ok = False
+                if ok:
+                    self.success()
+                else:
+                    self.failure()
+        finally:
+            self._prober = None
+
+    def stats(self):
+        return {'circuit': self.state, 'failures': self.failures}
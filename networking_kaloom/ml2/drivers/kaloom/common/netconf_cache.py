@@ -0,0 +1,139 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import time
+
+from eventlet import event
+from eventlet import Timeout
+
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
+
+DEFAULT_TTL = 30
+DEFAULT_SIZE = 1024
+
+
+class KaloomNetconfCache(object):
+    """LRU cache of vFabric lookups, with a TTL per entry.
+
+    Keys are (lookup, args...) tuples, e.g. ('router_id_by_name', name). Writes of
+    the owning KaloomNetconf invalidate the entries they touch; every invalidation
+    bumps the generation, so that a lookup that started before it does not store
+    its (possibly stale) result. ttl 0 disables the cache.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, size=DEFAULT_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self.entries = collections.OrderedDict() #key: (expiry, value), least recently used first
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.size > 0
+
+    def get(self, key):
+        """(True, value) on hit, (False, None) on miss."""
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[0] > self.clock():
+            self.entries[key] = entry #most recently used
+            self.hits += 1
+            return True, entry[1]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value, generation):
+        """stores value read at generation, unless an invalidation happened since."""
+        if not self.enabled or generation != self.generation:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = (self.clock() + self.ttl, value)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.generation += 1
+        self.entries.pop(key, None)
+
+    def invalidate_value(self, lookup, value):
+        """drops the entries of lookup holding value, e.g. the name of a deleted router id."""
+        self.generation += 1
+        for key in [key for key, entry in self.entries.items() if key[0] == lookup and entry[1] == value]:
+            del self.entries[key]
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+_ABANDONED = object()
+
+
+class KaloomNetconfFlights(object):
+    """Single-flight of vFabric lookups: concurrent callers of the same lookup share one rpc.
+
+    A caller finding the lookup of its key in flight waits for it, and gets its result (or
+    exception) instead of sending the same rpc again. Writes bump the generation: a lookup
+    starting after a write does not join a flight that started before it, so a greenthread
+    always reads its own writes. A caller waits for a flight at most until its own deadline.
+    """
+    def __init__(self):
+        self.flights = {} #(key, generation): event.Event
+        self.generation = 0
+        self.shared = 0
+
+    def do(self, key, lookup):
+        """lookup(), or the result of the same lookup already in flight."""
+        flight_key = (key, self.generation)
+        flight = self.flights.get(flight_key)
+        if flight is not None:
+            self.shared += 1
+            #the flight runs under the deadline of its first caller, not of this one.
+            left = netconf_scheduler.remaining(netconf_scheduler.current_deadline())
+            if left is None:
+                value = flight.wait()
+            else:
+                with Timeout(left, ValueError("netconf deadline exceeded waiting for a lookup in flight")):
+                    value = flight.wait()
+            if value is _ABANDONED:
+                return self.do(key, lookup)
+            return value
+        flight = self.flights[flight_key] = event.Event()
+        try:
+            value = lookup()
+        except Exception as e:
+            flight.send_exception(e)
+            raise
+        except BaseException:
+            #e.g. the greenthread of the flight is killed: waiters do the lookup themselves.
+            flight.send(_ABANDONED)
+            raise
+        else:
+            flight.send(value)
+            return value
+        finally:
+            del self.flights[flight_key]
+
+    def invalidate(self):
+        self.generation += 1
+
+    def stats(self):
+        return {'in_flight': len(self.flights), 'shared': self.shared}
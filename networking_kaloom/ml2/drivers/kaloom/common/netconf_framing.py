@@ -0,0 +1,227 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+TERMINATOR = b']]>]]>'
+
+#RFC 6242 chunked framing: "\n#<chunk-size>\n<chunk-data>" repeated, then "\n##\n".
+CHUNK_END = b'\n##\n'
+MAX_CHUNK_SIZE = 4294967295
+MAX_CHUNK_HEADER = len(b'\n#') + len(str(MAX_CHUNK_SIZE)) + len(b'\n')
+
+BASE_1_0 = 'urn:ietf:params:netconf:base:1.0'
+BASE_1_1 = 'urn:ietf:params:netconf:base:1.1'
+
+#bytes read from the netconf channel on each recv call.
+DEFAULT_RECV_SIZE = 32768
+
+
+def _to_bytes(msg):
+    if isinstance(msg, bytes):
+        return msg
+    return msg.encode('utf-8')
+
+
+def _copy(buf, start, end):
+    #a single copy; the memoryview is released at once, so buf can still be resized.
+    return memoryview(buf)[start:end].tobytes()
+
+
+class EOMDecoder(object):
+    """Incremental decoder for netconf 1.0 end-of-message (]]>]]>) framing.
+
+    Received chunks are appended to a bytearray, and only the newly received
+    bytes (plus len(TERMINATOR)-1 bytes of overlap) are scanned for the terminator.
+    Complete frames are returned as memoryviews on the receive buffer, without copying.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buf = bytearray()
+        self._start = 0 #start of the incomplete frame
+        self._scan = 0 #terminator search resumes from here
+
+    def pending(self):
+        """number of received bytes, not yet part of a complete frame."""
+        return len(self._buf) - self._start
+
+    def feed(self, data):
+        """Appends data, returns the list of frames completed by it."""
+        buf = self._buf
+        buf.extend(data)
+        frames = []
+        while True:
+            index = buf.find(TERMINATOR, self._scan)
+            if index == -1:
+                break
+            frames.append(memoryview(buf)[self._start:index])
+            self._start = self._scan = index + len(TERMINATOR)
+        self._scan = max(self._start, len(buf) - len(TERMINATOR) + 1)
+
+        if frames:
+            #frames keep exporting the old buffer, which then can't be resized.
+            #so continue on a new buffer, carrying the (usually short) incomplete tail.
+            self._buf = bytearray(memoryview(buf)[self._start:])
+            self._scan = self._scan - self._start
+            self._start = 0
+        return frames
+
+    def feed_stream(self, data):
+        """Appends data, returns the (piece, end) of frames it completes or continues.
+
+        piece is the next bytes of a frame, end tells whether the frame ends with it.
+        Only bytes that may start a terminator stay buffered, so a frame is never held whole.
+        """
+        buf = self._buf
+        buf.extend(data)
+        pieces = []
+        while True:
+            index = buf.find(TERMINATOR, self._scan)
+            if index == -1:
+                break
+            pieces.append((_copy(buf, self._start, index), True))
+            self._start = self._scan = index + len(TERMINATOR)
+        end = max(self._start, len(buf) - len(TERMINATOR) + 1)
+        if end > self._start:
+            pieces.append((_copy(buf, self._start, end), False))
+        del buf[:end]
+        self._start = self._scan = 0
+        return pieces
+
+    def leftover(self):
+        """bytes after the last complete frame, e.g. to hand over to a chunked decoder."""
+        return bytes(self._buf[self._start:])
+
+    def encode(self, msg):
+        return _to_bytes(msg) + TERMINATOR
+
+    def encode_parts(self, parts):
+        """frame of the msg made of parts (bytes), as parts; joined once, by the sender."""
+        return parts + [TERMINATOR]
+
+
+class ChunkedDecoder(object):
+    """Incremental decoder for netconf 1.1 chunked framing (RFC 6242).
+
+    Chunk sizes are known from the chunk headers, so the data is never scanned.
+    A frame made of a single chunk is returned as a memoryview on the receive
+    buffer; chunks of a multi-chunk frame are joined once, when the frame ends.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._buf = bytearray()
+        self._pos = 0 #start of the next chunk header
+        self._chunks = [] #chunks of the incomplete frame
+        self._remaining = 0 #bytes of the chunk being streamed, not received yet
+
+    def pending(self):
+        return len(self._buf) - self._pos + sum(len(chunk) for chunk in self._chunks)
+
+    def feed(self, data):
+        """Appends data, returns the list of frames completed by it."""
+        buf = self._buf
+        buf.extend(data)
+        frames = []
+        exported = False
+        pos = self._pos
+        while len(buf) - pos >= len(CHUNK_END):
+            if buf[pos:pos + 2] != b'\n#':
+                raise ValueError("invalid netconf chunk header at %r" % bytes(buf[pos:pos + MAX_CHUNK_HEADER]))
+            if buf[pos:pos + len(CHUNK_END)] == CHUNK_END:
+                if len(self._chunks) == 1:
+                    frames.append(self._chunks[0])
+                else:
+                    frames.append(b''.join(chunk.tobytes() for chunk in self._chunks))
+                self._chunks = []
+                pos = pos + len(CHUNK_END)
+                continue
+            eol = buf.find(b'\n', pos + 2, pos + MAX_CHUNK_HEADER)
+            if eol == -1:
+                if len(buf) - pos >= MAX_CHUNK_HEADER:
+                    raise ValueError("invalid netconf chunk header at %r" % bytes(buf[pos:pos + MAX_CHUNK_HEADER]))
+                break
+            size = buf[pos + 2:eol]
+            if not size.isdigit() or size[0:1] == b'0' or int(size) > MAX_CHUNK_SIZE:
+                raise ValueError("invalid netconf chunk size %r" % bytes(size))
+            start = eol + 1
+            end = start + int(size)
+            if len(buf) < end:
+                break
+            self._chunks.append(memoryview(buf)[start:end])
+            exported = True
+            pos = end
+
+        self._pos = pos
+        if exported:
+            #same as EOMDecoder: exported buffer can't be resized, continue on a new one.
+            self._buf = bytearray(memoryview(buf)[pos:])
+            self._pos = 0
+        return frames
+
+    def feed_stream(self, data):
+        """Appends data, returns the (piece, end) of frames it completes or continues, as EOMDecoder does.
+
+        Chunk data is handed out as it is received, even before its chunk is complete.
+        """
+        buf = self._buf
+        buf.extend(data)
+        #chunks completed by feed(), e.g. after the hello.
+        pieces = [(chunk.tobytes(), False) for chunk in self._chunks]
+        self._chunks = []
+        pos = self._pos
+        while pos < len(buf):
+            if self._remaining:
+                end = min(len(buf), pos + self._remaining)
+                pieces.append((_copy(buf, pos, end), False))
+                self._remaining -= end - pos
+                pos = end
+                continue
+            if len(buf) - pos < len(CHUNK_END):
+                break
+            if buf[pos:pos + 2] != b'\n#':
+                raise ValueError("invalid netconf chunk header at %r" % bytes(buf[pos:pos + MAX_CHUNK_HEADER]))
+            if buf[pos:pos + len(CHUNK_END)] == CHUNK_END:
+                pieces.append((b'', True))
+                pos = pos + len(CHUNK_END)
+                continue
+            eol = buf.find(b'\n', pos + 2, pos + MAX_CHUNK_HEADER)
+            if eol == -1:
+                if len(buf) - pos >= MAX_CHUNK_HEADER:
+                    raise ValueError("invalid netconf chunk header at %r" % bytes(buf[pos:pos + MAX_CHUNK_HEADER]))
+                break
+            size = buf[pos + 2:eol]
+            if not size.isdigit() or size[0:1] == b'0' or int(size) > MAX_CHUNK_SIZE:
+                raise ValueError("invalid netconf chunk size %r" % bytes(size))
+            self._remaining = int(size)
+            pos = eol + 1
+        del buf[:pos]
+        self._pos = 0
+        return pieces
+
+    def encode(self, msg):
+        msg = _to_bytes(msg)
+        return b'\n#' + str(len(msg)).encode('ascii') + b'\n' + msg + CHUNK_END
+
+    def encode_parts(self, parts):
+        """frame of the msg made of parts (bytes) as a single chunk, as parts, as EOMDecoder does."""
+        size = sum(len(part) for part in parts)
+        return [b'\n#' + str(size).encode('ascii') + b'\n'] + parts + [CHUNK_END]
+
+
+def frame_bytes(frame):
+    """bytes of a frame returned by the decoder, for consumers that can't use buffers."""
+    if isinstance(frame, memoryview):
+        return frame.tobytes()
+    return frame
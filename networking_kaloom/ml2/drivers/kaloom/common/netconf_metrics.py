@@ -0,0 +1,321 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Metrics of the vFabric netconf client, in the neutron-server process.
+
+Latency of each KaloomNetconf operation, errors, reply sizes, send latency
+of rpc frames, queue wait of rpcs per request class, timeouts, reconnects,
+session-id changes and circuit breaker opens and rejects are recorded in
+process memory (a bisect and a few integer increments per observation), and
+rpcs in flight and frames queued for sending are read from the sessions
+when exported. A sink, configured by netconf_metrics_sink,
+exports them:
+
+    statsd://host:port         every observation as a statsd datagram (udp)
+    file:///path/name.prom     prometheus text, rewritten periodically, e.g.
+                               for the node_exporter textfile collector;
+                               %(pid)s in the path is the process id
+"""
+
+import bisect
+import functools
+import os
+import socket
+import time
+import types
+
+from eventlet import greenthread
+from oslo_log import log
+from six.moves.urllib import parse
+
+LOG = log.getLogger(__name__)
+
+#seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+#bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+#seconds between exports of periodic sinks
+FLUSH_INTERVAL = 15
+
+#circuit_opens: the circuit breaker opened; circuit_rejects: rpcs failed at once while it was open
+COUNTERS = ('timeouts', 'reconnects', 'session_id_changes', 'circuit_opens', 'circuit_rejects')
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) #last one is +Inf
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def cumulative(self):
+        """(upper bound, observations <= bound), as in prometheus buckets."""
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class KaloomNetconfMetrics(object):
+    def __init__(self):
+        self.reset()
+        #callables returning the rpcs in flight of a session pool, summed when exported.
+        self.in_flight_sources = []
+        #callables returning the frames queued by the senders of a session pool, summed when exported.
+        self.send_queue_sources = []
+        self.sinks = []
+        self.sink_url = None
+        self._flusher = None
+
+    def reset(self):
+        self.latency = {} #op: Histogram
+        self.errors = {} #op: count
+        self.reply_bytes = Histogram(SIZE_BUCKETS)
+        self.send_latency = Histogram(LATENCY_BUCKETS) #from queued to sent, per frame
+        self.queue_wait = {} #request class: Histogram, from submitted to admitted in the in-flight window
+        self.counters = dict((name, 0) for name in COUNTERS)
+
+    def observe(self, op, seconds, error=False):
+        histogram = self.latency.get(op)
+        if histogram is None:
+            histogram = self.latency[op] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+        if error:
+            self.errors[op] = self.errors.get(op, 0) + 1
+        for sink in self.sinks:
+            sink.timing(op, seconds, error)
+
+    def observe_reply(self, size):
+        self.reply_bytes.observe(size)
+        for sink in self.sinks:
+            sink.size(size)
+
+    def observe_send(self, seconds):
+        self.send_latency.observe(seconds)
+        for sink in self.sinks:
+            sink.send(seconds)
+
+    def observe_wait(self, request_class, seconds):
+        histogram = self.queue_wait.get(request_class)
+        if histogram is None:
+            histogram = self.queue_wait[request_class] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+        for sink in self.sinks:
+            sink.wait(request_class, seconds)
+
+    def incr(self, name):
+        self.counters[name] += 1
+        for sink in self.sinks:
+            sink.incr(name)
+
+    def in_flight(self):
+        return sum(source() for source in self.in_flight_sources)
+
+    def send_queue(self):
+        return sum(source() for source in self.send_queue_sources)
+
+    def snapshot(self):
+        return {'ops': dict((op, {'count': histogram.count, 'sum': histogram.sum,
+                                  'errors': self.errors.get(op, 0)})
+                            for op, histogram in self.latency.items()),
+                'reply_bytes': {'count': self.reply_bytes.count, 'sum': self.reply_bytes.sum},
+                'send': {'count': self.send_latency.count, 'sum': self.send_latency.sum},
+                'queue_wait': dict((name, {'count': histogram.count, 'sum': histogram.sum})
+                                   for name, histogram in self.queue_wait.items()),
+                'in_flight': self.in_flight(),
+                'send_queue': self.send_queue(),
+                'counters': dict(self.counters)}
+
+    def prometheus_text(self):
+        lines = ['# TYPE kaloom_netconf_op_latency_seconds histogram']
+        for op in sorted(self.latency):
+            histogram = self.latency[op]
+            for bound, count in histogram.cumulative():
+                lines.append('kaloom_netconf_op_latency_seconds_bucket{op="%s",le="%s"} %d' % (op, _le(bound), count))
+            lines.append('kaloom_netconf_op_latency_seconds_sum{op="%s"} %r' % (op, float(histogram.sum)))
+            lines.append('kaloom_netconf_op_latency_seconds_count{op="%s"} %d' % (op, histogram.count))
+        lines.append('# TYPE kaloom_netconf_op_errors_total counter')
+        for op in sorted(self.errors):
+            lines.append('kaloom_netconf_op_errors_total{op="%s"} %d' % (op, self.errors[op]))
+        lines.append('# TYPE kaloom_netconf_reply_bytes histogram')
+        for bound, count in self.reply_bytes.cumulative():
+            lines.append('kaloom_netconf_reply_bytes_bucket{le="%s"} %d' % (_le(bound), count))
+        lines.append('kaloom_netconf_reply_bytes_sum %d' % self.reply_bytes.sum)
+        lines.append('kaloom_netconf_reply_bytes_count %d' % self.reply_bytes.count)
+        lines.append('# TYPE kaloom_netconf_send_latency_seconds histogram')
+        for bound, count in self.send_latency.cumulative():
+            lines.append('kaloom_netconf_send_latency_seconds_bucket{le="%s"} %d' % (_le(bound), count))
+        lines.append('kaloom_netconf_send_latency_seconds_sum %r' % float(self.send_latency.sum))
+        lines.append('kaloom_netconf_send_latency_seconds_count %d' % self.send_latency.count)
+        lines.append('# TYPE kaloom_netconf_queue_wait_seconds histogram')
+        for name in sorted(self.queue_wait):
+            histogram = self.queue_wait[name]
+            for bound, count in histogram.cumulative():
+                lines.append('kaloom_netconf_queue_wait_seconds_bucket{class="%s",le="%s"} %d'
+                             % (name, _le(bound), count))
+            lines.append('kaloom_netconf_queue_wait_seconds_sum{class="%s"} %r' % (name, float(histogram.sum)))
+            lines.append('kaloom_netconf_queue_wait_seconds_count{class="%s"} %d' % (name, histogram.count))
+        for name in COUNTERS:
+            lines.append('# TYPE kaloom_netconf_%s_total counter' % name)
+            lines.append('kaloom_netconf_%s_total %d' % (name, self.counters[name]))
+        lines.append('# TYPE kaloom_netconf_in_flight gauge')
+        lines.append('kaloom_netconf_in_flight %d' % self.in_flight())
+        lines.append('# TYPE kaloom_netconf_send_queue gauge')
+        lines.append('kaloom_netconf_send_queue %d' % self.send_queue())
+        return '\n'.join(lines) + '\n'
+
+    def configure(self, sink_url):
+        """exports to the sink of sink_url from now on; empty for none."""
+        if sink_url == self.sink_url:
+            return
+        self.sink_url = sink_url
+        self.sinks = [make_sink(sink_url)] if sink_url else []
+        if self.sinks and self._flusher is None:
+            self._flusher = greenthread.spawn(self._flush_loop)
+
+    def _flush_loop(self):
+        while self.sinks:
+            greenthread.sleep(FLUSH_INTERVAL)
+            for sink in self.sinks:
+                try:
+                    sink.flush(self)
+                except Exception as e:
+                    LOG.warning("kaloom netconf metrics: export to %s failed: %s", self.sink_url, e)
+        self._flusher = None
+
+    def timed(self, op):
+        """decorator, observes the latency of op, and its errors.
+
+        An op returning a generator (e.g. a streamed reply) is observed once it is consumed,
+        closed early or failed.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    self.observe(op, time.time() - start, error=True)
+                    raise
+                if isinstance(result, types.GeneratorType):
+                    return self._timed_iter(op, start, result)
+                self.observe(op, time.time() - start)
+                return result
+            return wrapper
+        return decorator
+
+    def _timed_iter(self, op, start, values):
+        #a consumer stopping early (GeneratorExit) is not an error.
+        error = False
+        try:
+            for value in values:
+                yield value
+        except Exception:
+            error = True
+            raise
+        finally:
+            values.close()
+            self.observe(op, time.time() - start, error=error)
+
+
+def _le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class StatsdSink(object):
+    """pushes each observation as a statsd datagram; udp send does not block."""
+    def __init__(self, host, port, prefix='kaloom.netconf'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def _send(self, metric):
+        try:
+            self.sock.sendto(('%s.%s' % (self.prefix, metric)).encode('ascii'), self.address)
+        except socket.error:
+            pass #metrics are best effort
+
+    def timing(self, op, seconds, error):
+        self._send('op.%s:%d|ms' % (op, seconds * 1000))
+        if error:
+            self._send('op.%s.errors:1|c' % op)
+
+    def size(self, size):
+        self._send('reply_bytes:%d|h' % size)
+
+    def send(self, seconds):
+        self._send('send:%d|ms' % (seconds * 1000))
+
+    def wait(self, request_class, seconds):
+        self._send('queue_wait.%s:%d|ms' % (request_class, seconds * 1000))
+
+    def incr(self, name):
+        self._send('%s:1|c' % name)
+
+    def flush(self, metrics):
+        self._send('in_flight:%d|g' % metrics.in_flight())
+        self._send('send_queue:%d|g' % metrics.send_queue())
+
+
+class TextfileSink(object):
+    """rewrites a prometheus text file, on each flush."""
+    def __init__(self, path):
+        self.path = path % {'pid': os.getpid()} if '%(pid)s' in path else path
+
+    def timing(self, op, seconds, error):
+        pass
+
+    def size(self, size):
+        pass
+
+    def send(self, seconds):
+        pass
+
+    def wait(self, request_class, seconds):
+        pass
+
+    def incr(self, name):
+        pass
+
+    def flush(self, metrics):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(metrics.prometheus_text())
+        #readers never see a partial file.
+        os.rename(tmp_path, self.path)
+
+
+def make_sink(sink_url):
+    url = parse.urlparse(sink_url)
+    if url.scheme == 'statsd':
+        return StatsdSink(url.hostname or '127.0.0.1', url.port or 8125)
+    if url.scheme == 'file':
+        return TextfileSink(url.path)
+    raise ValueError("unknown netconf metrics sink %s" % sink_url)
+
+
+#metrics of the process, shared by every KaloomNetconf and session.
+METRICS = KaloomNetconfMetrics()
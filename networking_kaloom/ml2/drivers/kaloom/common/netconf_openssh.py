@@ -0,0 +1,191 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""netconf over an OpenSSH client process, in place of paramiko.
+
+`ssh -s host netconf` runs the ssh protocol (key exchange, ciphers, windows)
+in C, in a process of its own; neutron-server only reads and writes its
+pipes, from greenthreads. With ControlMaster, the sessions of the host share
+one ssh connection: a new session opens a channel, without a handshake.
+Authentication is by private key only (BatchMode). Errors of ssh (e.g. host
+unreachable, key refused) are logged once its channel is closed.
+"""
+
+import errno
+import fcntl
+import os
+import socket
+import tempfile
+
+from eventlet.green import subprocess
+from eventlet import hubs
+from eventlet import patcher
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+
+SSH = 'ssh'
+#%C: hash of the local host, vFabric host, port and user, short enough for a unix socket path
+DEFAULT_CONTROL_PATH = os.path.join(tempfile.gettempdir(), 'kaloom-netconf-%C')
+#seconds the shared connection stays open once its last session closed
+CONTROL_PERSIST = 60
+#bytes written to the pipe at once, a copy of at most this much per write
+WRITE_SIZE = 65536
+#bytes of the error messages of ssh logged
+STDERR_SIZE = 4096
+
+
+#os of the first channel, not monkey patched
+_os = None
+
+
+def _original_os():
+    #non-blocking reads and writes of the pipes: green os.read and os.write wait for
+    #the pipe without the timeout of the chan. resolved on first use, not at import:
+    #patcher.original imports os again, outside the green environment.
+    global _os
+    if _os is None:
+        _os = patcher.original('os')
+    return _os
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class KaloomNetconfOpenSSHChannel(object):
+    """stdin and stdout of an ssh process, as a netconf chan (recv, sendall, settimeout, close)."""
+    def __init__(self, process):
+        self.process = process
+        self.rfd = process.stdout.fileno()
+        self.wfd = process.stdin.fileno()
+        _set_nonblocking(self.rfd)
+        _set_nonblocking(self.wfd)
+        if process.stderr is not None:
+            _set_nonblocking(process.stderr.fileno())
+        self.timeout = None
+        self._os = _original_os()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self, size):
+        """up to size bytes, b'' once ssh exited; raises socket.timeout as a socket does."""
+        while True:
+            try:
+                data = self._os.read(self.rfd, size)
+                if not data:
+                    self._log_stderr()
+                return data
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            hubs.trampoline(self.rfd, read=True, timeout=self.timeout, timeout_exc=socket.timeout('timed out'))
+
+    def sendall(self, data):
+        sent = 0
+        while sent < len(data):
+            try:
+                sent += self._os.write(self.wfd, data[sent:sent + WRITE_SIZE])
+            except OSError as e:
+                if e.errno == errno.EPIPE:
+                    self._log_stderr()
+                    raise socket.error(errno.EPIPE, 'ssh process exited')
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                hubs.trampoline(self.wfd, write=True, timeout=self.timeout, timeout_exc=socket.timeout('timed out'))
+
+    def _log_stderr(self):
+        #what ssh wrote before exiting, or so far; read once.
+        stderr, self.process.stderr = self.process.stderr, None
+        if stderr is None:
+            return
+        try:
+            message = self._os.read(stderr.fileno(), STDERR_SIZE)
+        except OSError:
+            message = b''
+        finally:
+            stderr.close()
+        if message.strip():
+            LOG.warning("vfabric netconf ssh process %s: %s", self.process.pid, message.strip())
+
+    def close(self):
+        #EOF on stdin closes the netconf channel; the shared connection stays.
+        self._log_stderr()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+
+
+class KaloomNetconfOpenSSHClient(object):
+    """OpenSSH client process of a netconf session, in place of paramiko.SSHClient.
+
+    options are more ssh -o options, e.g. ProxyJump=host; for an option given twice, ssh uses the
+    first one.
+    """
+    def __init__(self, ssh=SSH, control_path=DEFAULT_CONTROL_PATH, options=()):
+        self.ssh = ssh
+        self.control_path = control_path
+        self.options = list(options)
+        self.process = None
+
+    def command(self, host, port, username, private_key_file, timeout, keepalive):
+        command = [self.ssh, '-s', '-p', str(port), '-l', username,
+                   '-i', private_key_file,
+                   '-o', 'IdentitiesOnly=yes',
+                   '-o', 'BatchMode=yes',
+                   #errors only (-q would drop them too)
+                   '-o', 'LogLevel=ERROR',
+                   #as paramiko AutoAddPolicy, with no host keys loaded: any host key is accepted, none
+                   #is kept. (accept-new needs OpenSSH 7.6, CentOS 7 has 7.4.)
+                   '-o', 'StrictHostKeyChecking=no',
+                   '-o', 'UserKnownHostsFile=%s' % os.devnull,
+                   '-o', 'ConnectTimeout=%d' % timeout]
+        if keepalive:
+            command.extend(['-o', 'ServerAliveInterval=%d' % keepalive])
+        if self.control_path:
+            command.extend(['-o', 'ControlMaster=auto',
+                            '-o', 'ControlPath=%s' % self.control_path,
+                            '-o', 'ControlPersist=%d' % CONTROL_PERSIST])
+        for option in self.options:
+            command.extend(['-o', option])
+        command.extend([host, 'netconf'])
+        return command
+
+    def connect(self, host, port, username, private_key_file, timeout, keepalive=0):
+        """starts ssh, returns the chan of its netconf subsystem; errors show as the chan closing."""
+        if not private_key_file:
+            raise ValueError("openssh netconf backend needs a private key file")
+        self.close()
+        self.process = subprocess.Popen(self.command(host, port, username, private_key_file, timeout, keepalive),
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        close_fds=True)
+        return KaloomNetconfOpenSSHChannel(self.process)
+
+    def get_transport(self):
+        return self if self.process is not None else None
+
+    def is_active(self):
+        return self.process is not None and self.process.poll() is None
+
+    def close(self):
+        process, self.process = self.process, None
+        if process is not None and process.poll() is None:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+            process.wait()
@@ -0,0 +1,259 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""kaloom netconf proxy (neutron-kaloom-netconf-proxy).
+
+Holds a few netconf sessions to vFabric, and multiplexes the rpcs of local
+neutron-server workers (KaloomNetconf with netconf_transport = proxy) over them.
+Workers talk netconf to the proxy over a unix socket; the proxy gives each rpc
+an upstream message-id, and puts back the worker's message-id on the reply.
+The rpcs of a worker go to one upstream session, in the order they are
+received: as on a session to vFabric, they are processed in order.
+"""
+
+import errno
+import itertools
+import os
+import socket
+import sys
+
+import eventlet
+from eventlet import greenpool
+from eventlet import semaphore
+from lxml import etree
+from lxml.builder import ElementMaker
+from neutron.common import config as common_config
+from oslo_config import cfg
+from oslo_log import log
+
+from networking_kaloom.ml2.drivers.kaloom.common import config as kaloom_config
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_recorder
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+
+LOG = log.getLogger(__name__)
+
+TAG_NC_RPC = "{" + kaloom_netconf.NC_NS + "}" + "rpc"
+TAG_NC_HELLO = "{" + kaloom_netconf.NC_NS + "}" + "hello"
+TAG_NC_CLOSE_SESSION = "{" + kaloom_netconf.NC_NS + "}" + "close-session"
+
+NC = ElementMaker(namespace=kaloom_netconf.NC_NS, nsmap={None: kaloom_netconf.NC_NS})
+
+#rpcs being forwarded at a time, for all workers.
+MAX_RPCS = 1000
+
+
+def hello_msg(capabilities, session_id):
+    hello = NC.hello(NC.capabilities(*[NC.capability(cap) for cap in sorted(capabilities)]),
+                     NC('session-id', str(session_id)))
+    return etree.tostring(hello, xml_declaration=True, encoding='UTF-8')
+
+
+def ok_reply(msgid):
+    return etree.tostring(NC('rpc-reply', NC.ok(), {'message-id': msgid}))
+
+
+def error_reply(msgid, error_message):
+    reply = NC('rpc-reply',
+               NC('rpc-error',
+                  NC('error-type', 'application'),
+                  NC('error-tag', 'operation-failed'),
+                  NC('error-severity', 'error'),
+                  NC('error-message', error_message)),
+               {'message-id': msgid})
+    return etree.tostring(reply)
+
+
+class KaloomNetconfProxyConnection(object):
+    """netconf session of a neutron-server worker, connected to the proxy."""
+    def __init__(self, proxy, sock, session_id):
+        self.proxy = proxy
+        self.sock = sock
+        self.session_id = session_id
+        self.framing = netconf_framing.EOMDecoder()
+        #replies are sent from the greenthreads of their rpcs.
+        self.send_lock = semaphore.Semaphore()
+        self.running = False
+        #upstream session of the rpcs of this connection, replied by vFabric in the order they are received.
+        self.upstream = None
+
+    def send(self, msg):
+        with self.send_lock:
+            self.sock.sendall(self.framing.encode(msg))
+
+    def _hello(self, capabilities):
+        """exchanges hellos, returns the first rpc frames received after the hello."""
+        self.send(hello_msg(capabilities, self.session_id))
+        frames = []
+        while not frames:
+            data = self.sock.recv(self.proxy.recv_size)
+            if len(data) == 0:
+                raise ValueError("connection closed before hello")
+            frames = self.framing.feed(data)
+        hello = kaloom_netconf.parse_xml(frames[0])
+        if hello.tag != TAG_NC_HELLO:
+            raise ValueError("expected hello, received %s" % hello.tag)
+        client_capabilities = kaloom_netconf.XPATH_CAPABILITY(hello)
+        #same rule as the client: chunked framing after the hellos, if both advertise base:1.1.
+        if netconf_framing.BASE_1_1 in client_capabilities:
+            chunked = netconf_framing.ChunkedDecoder()
+            rest = [frame.tobytes() for frame in frames[1:]] + [self.framing.leftover()]
+            self.framing = chunked
+            #frames after the hello (if any) are already chunked.
+            return chunked.feed(b''.join(rest))
+        return [frame.tobytes() for frame in frames[1:]]
+
+    def serve(self):
+        self.running = True
+        try:
+            #workers see the capabilities of vFabric, plus the framings the proxy supports.
+            capabilities = set(self.proxy.session_manager.capabilities())
+            capabilities.update([netconf_framing.BASE_1_0, netconf_framing.BASE_1_1])
+            frames = self._hello(capabilities)
+            while self.running:
+                #submitted in order, replied by greenthreads of the pool.
+                for frame in frames:
+                    self.handle_rpc(netconf_framing.frame_bytes(frame))
+                data = self.sock.recv(self.proxy.recv_size)
+                if len(data) == 0:
+                    break
+                frames = self.framing.feed(data)
+        except Exception as e:
+            LOG.warning("kaloom netconf proxy session %s closed: %s", self.session_id, e)
+        finally:
+            self.running = False
+            self.sock.close()
+
+    def handle_rpc(self, msg):
+        try:
+            rpc = kaloom_netconf.parse_xml(msg)
+        except Exception as e:
+            LOG.error('Error occured: %s while handling received netconf msg %s', e, msg)
+            return
+        msgid = rpc.get('message-id')
+        if rpc.tag != TAG_NC_RPC or msgid is None:
+            LOG.error('not a netconf rpc, or no message-id in received netconf msg %s', msg)
+            return
+        if rpc.find(TAG_NC_CLOSE_SESSION) is not None:
+            #upstream sessions are shared, close-session ends only this worker's session.
+            self._reply(ok_reply(msgid))
+            self.running = False
+            self.sock.shutdown(socket.SHUT_RDWR)
+            return
+
+        #upstream message-id is given by the upstream session.
+        upstream_rpc = netconf_rpc.Rpc(b''.join(etree.tostring(operation) for operation in rpc))
+        try:
+            future = self._upstream().submit(upstream_rpc)
+        except Exception as e:
+            self._reply(error_reply(msgid, str(e)))
+            return
+        self.proxy.pool.spawn_n(self._forward_reply, msgid, future)
+
+    def _upstream(self):
+        #another session only once this one is lost: its rpcs in flight failed.
+        if self.upstream is None or not self.upstream.is_healthy():
+            self.upstream = self.proxy.session_manager.connected()
+        else:
+            self.proxy.session_manager.breaker.check()
+        return self.upstream
+
+    def _forward_reply(self, msgid, future):
+        try:
+            reply = future.result()
+        except Exception as e:
+            reply = error_reply(msgid, str(e))
+        else:
+            reply.set('message-id', msgid)
+            reply = etree.tostring(reply)
+        self._reply(reply)
+
+    def _reply(self, reply):
+        try:
+            self.send(reply)
+        except Exception as e:
+            LOG.warning("kaloom netconf proxy session %s: reply could not be sent: %s", self.session_id, e)
+
+
+class KaloomNetconfProxy(object):
+    def __init__(self, session_manager, path, recv_size=netconf_framing.DEFAULT_RECV_SIZE):
+        self.session_manager = session_manager
+        self.path = path
+        self.recv_size = recv_size
+        self.pool = greenpool.GreenPool(MAX_RPCS)
+        self.session_ids = itertools.count(1)
+        self.sock = None
+
+    def listen(self):
+        try:
+            os.unlink(self.path) #stale socket of a previous run
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.sock = eventlet.listen(self.path, family=socket.AF_UNIX)
+        #neutron-server workers run as the same user, no one else should use vFabric sessions.
+        os.chmod(self.path, 0o600)
+        LOG.info("kaloom netconf proxy listening on %s", self.path)
+
+    def serve(self):
+        if self.sock is None:
+            self.listen()
+        while True:
+            try:
+                sock, addr = self.sock.accept()
+            except socket.error as e:
+                LOG.error("kaloom netconf proxy accept failed: %s", e)
+                continue
+            connection = KaloomNetconfProxyConnection(self, sock, next(self.session_ids))
+            eventlet.spawn_n(connection.serve)
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.session_manager.stop()
+
+
+def main():
+    eventlet.monkey_patch()
+    common_config.init(sys.argv[1:])
+    kaloom_config.register_opts()
+    common_config.setup_logging()
+
+    session_manager = kaloom_netconf.KaloomNetconfSessionManager.get(
+        cfg.CONF.KALOOM.kaloom_host,
+        cfg.CONF.KALOOM.kaloom_port,
+        cfg.CONF.KALOOM.kaloom_username,
+        cfg.CONF.KALOOM.kaloom_private_key_file,
+        cfg.CONF.KALOOM.kaloom_password,
+        recv_size=cfg.CONF.KALOOM.netconf_recv_size,
+        pool_size=cfg.CONF.KALOOM.netconf_pool_size,
+        standby=cfg.CONF.KALOOM.netconf_standby_sessions,
+        health_check_interval=cfg.CONF.KALOOM.netconf_health_check_interval,
+        window=cfg.CONF.KALOOM.netconf_window,
+        breaker_threshold=cfg.CONF.KALOOM.netconf_breaker_threshold,
+        breaker_reset_timeout=cfg.CONF.KALOOM.netconf_breaker_reset_timeout,
+        ssh_backend=cfg.CONF.KALOOM.netconf_ssh_backend)
+    netconf_recorder.RECORDER.configure(cfg.CONF.KALOOM.netconf_flight_recorder_size,
+                                        cfg.CONF.KALOOM.netconf_flight_recorder_signal)
+    #upstream sessions are connected before the first worker does.
+    session_manager.start()
+    proxy = KaloomNetconfProxy(session_manager, cfg.CONF.KALOOM.netconf_proxy_socket,
+                               cfg.CONF.KALOOM.netconf_recv_size)
+    try:
+        proxy.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.stop()
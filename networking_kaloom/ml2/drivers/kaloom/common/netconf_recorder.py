@@ -0,0 +1,132 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Flight recorder of the vFabric netconf client: the last rpcs of the process.
+
+Each rpc, once replied, failed, timed out or cancelled, is kept in a ring of
+the last netconf_flight_recorder_size ones: KaloomNetconf operation, session-id,
+msgid, request class, submit and completion times, the first bytes of the
+request and reply, and the error. Recording is a tuple appended to a bounded
+deque; nothing is formatted until dumped, so debug logging of every xml body
+is not needed to see what a slow or failed operation sent and received.
+
+Dumped on demand:
+
+    kill -WINCH <neutron-server pid>  logged at warning level, by the signal of
+                                      netconf_flight_recorder_signal; each api and
+                                      rpc worker process logs its own rpcs
+    KaloomNetconf.flight_records()    the records, oldest first
+"""
+
+import collections
+import signal
+import time
+
+from eventlet import greenthread
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+from oslo_log import log
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_SIZE = 256
+#bytes of the request and of the reply kept per rpc
+PREVIEW_SIZE = 512
+#ignored by default: a process not recording, or not yet, is not killed by it.
+DEFAULT_SIGNAL = 'SIGWINCH'
+#handled by neutron-server and oslo_service (SIGUSR2: guru meditation report), or not to be caught.
+RESERVED_SIGNALS = ('SIGTERM', 'SIGINT', 'SIGHUP', 'SIGCHLD', 'SIGUSR2', 'SIGKILL', 'SIGSTOP', 'SIGALRM', 'SIGPIPE')
+
+FIELDS = ('operation', 'session_id', 'msgid', 'request_class', 'submitted', 'completed', 'request', 'reply',
+          'error')
+
+
+def signal_number(signame):
+    """number of signal signame, e.g. SIGWINCH; raises ValueError for an unknown or reserved one."""
+    if signame in RESERVED_SIGNALS:
+        raise ValueError("netconf flight recorder signal %s is used by neutron-server" % signame)
+    signum = getattr(signal, signame, None) if signame.startswith('SIG') and '_' not in signame else None
+    if not isinstance(signum, int):
+        raise ValueError("unknown netconf flight recorder signal %s" % signame)
+    return signum
+
+
+class KaloomNetconfFlightRecorder(object):
+    def __init__(self, size=DEFAULT_SIZE):
+        self.records = collections.deque(maxlen=size)
+        self.signum = None
+        self._previous = None
+        self._subscribed = False
+
+    def configure(self, size=DEFAULT_SIZE, signame=DEFAULT_SIGNAL):
+        """keeps the last size rpcs (0 for none), dumped to the log on signame (empty for none).
+
+        The handler of the previous signal, if another one, is restored.
+        """
+        signum = signal_number(signame) if signame else None
+        if size != self.records.maxlen:
+            self.records = collections.deque(self.records, maxlen=size)
+        if signum != self.signum:
+            if self.signum is not None:
+                signal.signal(self.signum, self._previous if self._previous is not None else signal.SIG_DFL)
+                self._previous = None
+            self.signum = signum
+            if signum is not None:
+                self._previous = signal.signal(signum, self._handle_signal)
+        if not self._subscribed:
+            #api and rpc workers forked by oslo_service reset the signals they handle: installed again
+            #once the worker is initialized.
+            registry.subscribe(self._after_init, resources.PROCESS, events.AFTER_INIT)
+            self._subscribed = True
+
+    def _after_init(self, resource, event, trigger, **kwargs):
+        if self.signum is not None:
+            signal.signal(self.signum, self._handle_signal)
+
+    def record(self, operation, session_id, msgid, request_class, submitted, request, reply, error):
+        """request, reply: bytes, cut here to PREVIEW_SIZE; error: None, an exception or a reason."""
+        if self.records.maxlen:
+            self.records.append((operation, session_id, msgid, request_class, submitted, time.time(),
+                                 request[:PREVIEW_SIZE] if request is not None else None,
+                                 reply[:PREVIEW_SIZE] if reply is not None else None, error))
+
+    def dump(self):
+        """records, oldest first, as dicts of FIELDS."""
+        records = []
+        for record in list(self.records):
+            record = dict(zip(FIELDS, record))
+            if record['error'] is not None:
+                record['error'] = str(record['error'])
+            records.append(record)
+        return records
+
+    def format(self):
+        lines = ['kaloom netconf flight recorder: last %d rpcs, oldest first' % len(self.records)]
+        for record in self.dump():
+            lines.append('%s %s %.3fs %s session-id %s msgid %s: %s\n  request: %r\n  reply: %r' % (
+                time.strftime('%H:%M:%S', time.localtime(record['submitted'])), record['operation'] or 'rpc',
+                record['completed'] - record['submitted'], record['request_class'], record['session_id'],
+                record['msgid'], record['error'] or 'ok', record['request'], record['reply']))
+        return '\n'.join(lines)
+
+    def _handle_signal(self, signum, frame):
+        #runs between any two python instructions: logged by a greenthread of its own.
+        greenthread.spawn_n(self.log)
+
+    def log(self):
+        LOG.warning(self.format())
+
+
+#flight recorder of the process, shared by every KaloomNetconf and session.
+RECORDER = KaloomNetconfFlightRecorder()
@@ -0,0 +1,119 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import re
+from xml.sax.saxutils import escape
+
+import six
+from lxml import etree
+
+NC_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+
+RPC_START = b'<rpc xmlns="' + NC_NS.encode('ascii') + b'" message-id="'
+RPC_END = b'</rpc>'
+
+#%(name)s slots of a template.
+SLOT = re.compile(br'%\((\w+)\)s')
+#escapes &, <, > by default and also ', " as dict provided.
+ENTITIES = {"'": "&apos;", "\"": "&quot;"}
+
+_PARSER = etree.XMLParser(remove_blank_text=True, resolve_entities=False)
+
+
+def escape_value(value):
+    """value as escaped utf-8 bytes, for xml text and attribute values."""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    elif not isinstance(value, six.text_type):
+        value = six.text_type(value)
+    return escape(value, ENTITIES).encode('utf-8')
+
+
+class Template(object):
+    """xml fragment compiled once: minified, and split around its %(name)s slots.
+
+    fill() escapes each value and joins the pieces, without re-scanning the xml.
+    """
+    def __init__(self, xml):
+        if isinstance(xml, six.text_type):
+            xml = xml.encode('utf-8')
+        minified = etree.tostring(etree.fromstring(xml.strip(), _PARSER))
+        self.xml = minified
+        parts = SLOT.split(minified)
+        self.parts = parts[0::2]
+        self.names = [name.decode('ascii') for name in parts[1::2]]
+
+    def fill(self, **values):
+        parts = self.parts
+        pieces = [parts[0]]
+        for i, name in enumerate(self.names):
+            pieces.append(escape_value(values[name]))
+            pieces.append(parts[i + 1])
+        return b''.join(pieces)
+
+    def rpc(self, **values):
+        return Rpc(self.fill(**values))
+
+    def get_config(self, source='running'):
+        """Template of the get-config of source, with the filter of this <get> template."""
+        root = etree.fromstring(self.xml, _PARSER)
+        qname = etree.QName(root)
+        if qname.localname != 'get':
+            raise ValueError("not a get template: %s" % qname.localname)
+        tag = (lambda name: '{%s}%s' % (qname.namespace, name)) if qname.namespace else (lambda name: name)
+        root.tag = tag('get-config')
+        datastore = etree.Element(tag('source'))
+        etree.SubElement(datastore, tag(source))
+        root.insert(0, datastore)
+        return Template(etree.tostring(root))
+
+
+class Rpc(object):
+    """netconf rpc, the operation as bytes; the message-id is written when sent."""
+    __slots__ = ('operation',)
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def to_bytes(self, msgid):
+        return b''.join(self.parts(msgid))
+
+    def parts(self, msgid):
+        """the rpc as a list of bytes, not joined: the operation is not copied."""
+        return [RPC_START, str(msgid).encode('ascii'), b'">', self.operation, RPC_END]
+
+    def __str__(self):
+        return self.to_bytes('message_id').decode('utf-8')
+
+
+def xpath_literal(value):
+    """value as an xpath 1.0 string literal, which has no escapes: quoted by ' or ", else concat()."""
+    if "'" not in value:
+        return "'%s'" % value
+    if '"' not in value:
+        return '"%s"' % value
+    return "concat(%s)" % ", \"'\", ".join("'%s'" % part for part in value.split("'"))
+
+
+def get(filter_subtree):
+    return Rpc(b'<get><filter type="subtree">' + filter_subtree + b'</filter></get>')
+
+
+def edit_config(config, target='running', error_option=None):
+    """edit-config of config subtree(s) bytes; default-operation none, edits carry nc:operation."""
+    pieces = [b'<edit-config><target><', target.encode('ascii'), b'/></target>',
+              b'<default-operation>none</default-operation>']
+    if error_option:
+        pieces.extend([b'<error-option>', error_option.encode('ascii'), b'</error-option>'])
+    pieces.extend([b'<config>', config, b'</config></edit-config>'])
+    return Rpc(b''.join(pieces))
@@ -0,0 +1,233 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Request classes of vFabric rpcs, and their scheduling on a netconf session.
+
+An rpc is sent in the class of the greenthread sending it, interactive unless
+set by priority(), e.g. by the L2 cleanup and L3 sync workers:
+
+    interactive   neutron API calls, served first
+    background    periodic work, e.g. L2 cleanup
+    bulk          large passes, e.g. L3 full resync
+
+A session has at most window rpcs in flight; background and bulk ones get
+at most half of it, and are rate limited, so they cannot starve API calls.
+
+deadline() gives the rpcs of a greenthread a budget, e.g. a neutron precommit:
+past it, they fail instead of waiting for the timeout of the session.
+operation() names them, for the flight recorder (netconf_recorder).
+"""
+
+import collections
+import contextlib
+import time
+
+from eventlet import corolocal
+from eventlet import event
+from eventlet import greenthread
+from eventlet import Timeout
+
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_metrics import METRICS
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+BULK = 'bulk'
+#served in this order
+PRIORITIES = (INTERACTIVE, BACKGROUND, BULK)
+
+DEFAULT_WINDOW = 16
+#rpcs/s of background and bulk classes together, per session pool; 0 for no limit
+DEFAULT_BACKGROUND_RATE = 50
+
+class _Request(corolocal.local):
+    #(class, deadline, operation) of the rpcs of each greenthread;
+    #one attribute, as reading a green local costs microseconds.
+    request = (INTERACTIVE, None, None)
+
+
+_local = _Request()
+
+
+def current():
+    """(class, deadline, operation) of the rpcs of this greenthread."""
+    return _local.request
+
+
+def current_priority():
+    return _local.request[0]
+
+
+def current_deadline():
+    """time by which the rpcs of this greenthread must complete, None for no deadline."""
+    return _local.request[1]
+
+
+@contextlib.contextmanager
+def priority(name):
+    """rpcs sent by this greenthread in the block are of class name."""
+    if name not in PRIORITIES:
+        raise ValueError("unknown netconf request class %s" % name)
+    previous = _local.request
+    _local.request = (name,) + previous[1:]
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """rpcs sent by this greenthread in the block must complete within seconds from now.
+
+    A block within another one cannot extend its deadline; seconds 0 or None adds none.
+    """
+    previous = _local.request
+    if seconds:
+        until = time.time() + seconds
+        if previous[1] is not None:
+            until = min(previous[1], until)
+        _local.request = (previous[0], until, previous[2])
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+@contextlib.contextmanager
+def operation(name):
+    """rpcs sent by this greenthread in the block are of the KaloomNetconf operation name."""
+    previous = _local.request
+    _local.request = previous[:2] + (name,)
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+def remaining(until):
+    """seconds left before deadline until, None for no deadline; raises ValueError once it passed."""
+    if until is None:
+        return None
+    left = until - time.time()
+    if left <= 0:
+        raise ValueError("netconf deadline exceeded by %.3fs" % -left)
+    return left
+
+
+class KaloomNetconfRateLimiter(object):
+    """token bucket of rate rpcs/s, with a burst of a second of rpcs; rate 0 for no limit.
+
+    A caller takes its token at once and sleeps off the debt, so callers are served in order.
+    """
+    def __init__(self, rate=DEFAULT_BACKGROUND_RATE, clock=time.time):
+        self.rate = rate
+        self.clock = clock
+        self.tokens = rate
+        self.stamp = clock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        now = self.clock()
+        self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            greenthread.sleep(-self.tokens / float(self.rate))
+
+
+class KaloomNetconfScheduler(object):
+    """in-flight window of a session: acquire() before sending an rpc, release() once it completed.
+
+    A freed slot goes to the waiting rpc of the highest class, first come first served in a class.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, limiter=None):
+        self.window = window
+        self.limiter = limiter
+        self.in_flight = 0
+        self.background_in_flight = 0
+        self.waiters = dict((name, collections.deque()) for name in PRIORITIES)
+
+    @property
+    def background_window(self):
+        return max(1, self.window // 2)
+
+    def resize(self, window):
+        self.window = window
+        self._wake()
+
+    def _can_run(self, name):
+        if self.in_flight >= self.window:
+            return False
+        return name == INTERACTIVE or self.background_in_flight < self.background_window
+
+    def _take(self, name):
+        self.in_flight += 1
+        if name != INTERACTIVE:
+            self.background_in_flight += 1
+
+    def acquire(self, name, until=None):
+        """waits for a slot, at most until deadline until; raises ValueError past it."""
+        remaining(until)
+        #the clock is read only by rpcs that may wait: no cost to the others.
+        start = None
+        if name != INTERACTIVE and self.limiter is not None and self.limiter.rate > 0:
+            start = time.time()
+            self.limiter.wait()
+        #waiters of the same or a higher class go first.
+        ahead = False
+        for other in PRIORITIES:
+            ahead = ahead or bool(self.waiters[other])
+            if other == name:
+                break
+        if not ahead and self._can_run(name):
+            self._take(name)
+        else:
+            start = start or time.time()
+            left = remaining(until)
+            granted = event.Event()
+            self.waiters[name].append(granted)
+            try:
+                if left is None:
+                    granted.wait()
+                else:
+                    with Timeout(left, ValueError("netconf deadline exceeded waiting for a slot of the in-flight "
+                                                  "window (%s)" % name)):
+                        granted.wait()
+            except BaseException:
+                #e.g. a Timeout: gives the slot back if it was granted meanwhile.
+                if granted.ready():
+                    self.release(name)
+                else:
+                    self.waiters[name].remove(granted)
+                raise
+        METRICS.observe_wait(name, time.time() - start if start else 0)
+
+    def release(self, name):
+        self.in_flight -= 1
+        if name != INTERACTIVE:
+            self.background_in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        for name in PRIORITIES:
+            waiters = self.waiters[name]
+            while waiters and self._can_run(name):
+                self._take(name)
+                waiters.popleft().send()
+            if waiters and self.in_flight >= self.window:
+                return
+
+    def stats(self):
+        return {'window': self.window,
+                'waiting': dict((name, len(self.waiters[name])) for name in PRIORITIES)}
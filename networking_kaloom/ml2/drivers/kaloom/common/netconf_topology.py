@@ -0,0 +1,402 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process mirror of the vFabric topology used by OpenStack.
+
+The OpenStack l2 networks (node-ids with the prefix), the routers with their
+links and addresses, and the host termination points are loaded once by a
+single get, then kept fresh by the netconf-config-change notifications
+(RFC 5277, RFC 6470) received on a dedicated ssh session. A notification marks
+the nodes it is about stale; they are fetched again by their next lookup, or
+in background. When the notification stream drops, the mirror is not used
+until it is resubscribed and loaded again in full.
+"""
+
+import re
+
+from eventlet import greenthread
+from eventlet import semaphore
+from lxml import etree
+from oslo_log import log
+
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+
+LOG = log.getLogger(__name__)
+
+NCEV_NS = "urn:ietf:params:xml:ns:yang:ietf-netconf-notifications"
+
+TAG_NCEV_CONFIG_CHANGE = "{" + NCEV_NS + "}" + "netconf-config-change"
+XPATH_CHANGE_TARGET = etree.XPath('ncev:netconf-config-change/ncev:edit/ncev:target/text()',
+                                  namespaces={'ncev': NCEV_NS}, smart_strings=False)
+
+#keys of a netconf-config-change target, e.g. /nw:networks/nw:network[nw:network-id='2']/nw:node[nw:node-id='x']
+NETWORK_KEY = re.compile(r"""[\[:]network-id\s*=\s*(['"])(.*?)\1""")
+NODE_KEY = re.compile(r"""[\[:]node-id\s*=\s*(['"])(.*?)\1""")
+
+#seconds between attempts to subscribe and load, while vFabric can't be reached.
+RESUBSCRIBE_SEC = 5
+
+#stale keys of the mirror: whole topology, host termination points, ('l2', node-id),
+#('router', node-id), ('router_name', name).
+ALL = ('all',)
+TPS = ('tps',)
+
+TOPOLOGY_command_dict = {
+'CREATE_SUBSCRIPTION' : netconf_rpc.Template("""
+<create-subscription xmlns="urn:ietf:params:xml:ns:netconf:notification:1.0"/>
+"""),
+'GET_TOPOLOGY' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:nt="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:vf="urn:kaloom:faas:virtual-fabric" xmlns:l2t="urn:ietf:params:xml:ns:yang:ietf-l2-topology" xmlns:vl2t="urn:kaloom:faas:vfabric-l2-topology" xmlns:l3t="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology" xmlns:vif="urn:kaloom:faas:vfabric-interfaces">
+      <network>
+        <network-id>1</network-id>
+        <node>
+          <nt:termination-point>
+            <nt:tp-id/>
+            <vf:annotations/>
+          </nt:termination-point>
+        </node>
+      </network>
+      <network>
+        <network-id>2</network-id>
+        <node>
+          <node-id/>
+          <l2t:l2-node-attributes>
+            <vl2t:KNID/>
+          </l2t:l2-node-attributes>
+        </node>
+      </network>
+      <network>
+        <network-id>3</network-id>
+        <node>
+          <node-id/>
+          <l3t:l3-node-attributes/>
+          <nt:termination-point/>
+          <vif:interfaces/>
+        </node>
+      </network>
+    </networks>
+  </filter>
+</get>
+"""),
+'GET_TPS' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:nt="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:vf="urn:kaloom:faas:virtual-fabric">
+      <network>
+        <network-id>1</network-id>
+        <node>
+          <nt:termination-point>
+            <nt:tp-id/>
+            <vf:annotations/>
+          </nt:termination-point>
+        </node>
+      </network>
+    </networks>
+  </filter>
+</get>
+"""),
+'GET_ROUTER' : netconf_rpc.Template("""
+<get>
+  <filter type="subtree">
+    <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:nt="urn:ietf:params:xml:ns:yang:ietf-network-topology" xmlns:l3t="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology" xmlns:vif="urn:kaloom:faas:vfabric-interfaces">
+      <network>
+        <network-id>3</network-id>
+        <node>
+          <node-id>%(router_node_id)s</node-id>
+          <l3t:l3-node-attributes/>
+          <nt:termination-point/>
+          <vif:interfaces/>
+        </node>
+      </network>
+    </networks>
+  </filter>
+</get>
+"""),
+}
+
+
+def network_nodes(resp):
+    """(network-id, node) of the nodes in a get reply."""
+    for network in resp.iter(kaloom_netconf.TAG_NETWORK):
+        network_id = network.findtext(kaloom_netconf.TAG_NETWORK_ID)
+        for node in network.iterfind(kaloom_netconf.TAG_NODE):
+            yield network_id, node
+
+
+def host_tps(nodes):
+    """{host: {'name': host, 'id': tp-id}} of the annotated termination points of network 1 nodes."""
+    tps = {}
+    for network_id, node in nodes:
+        if network_id != '1':
+            continue
+        for tp in node.iterfind(kaloom_netconf.TAG_NT_TP):
+            for host in kaloom_netconf.annotated_hosts(tp):
+                tps.setdefault(host, {'name': host, 'id': tp.findtext(kaloom_netconf.TAG_TP_ID)})
+    return tps
+
+
+class KaloomTopologyMirror(object):
+    """Mirror of the vFabric nodes looked up by Kaloom ML2 and L3 plugins.
+
+    There is one mirror per vFabric and prefix in the process, attached to every
+    KaloomNetconf built for them; KaloomNetconf lookups are answered by it while
+    it is synced. Writes of KaloomNetconf mark the nodes they touch stale as well,
+    so a lookup right after a write does not depend on its notification.
+    """
+    _mirrors = {}
+
+    def __init__(self, session_manager, prefix):
+        self.session_manager = session_manager
+        self.prefix = prefix
+        self.synced = False
+        self.l2_networks = {} #node-id: l2_network_info(), prefixed nodes only
+        self.routers = {} #node-id: router_info()
+        self.tps = {} #host: {'name': host, 'id': tp-id}
+        self.stale = set()
+        #serializes refreshes, so that an older reply never overwrites a newer one.
+        self.lock = semaphore.Semaphore()
+        self.session = None
+        self.supported = True
+        self._running = False
+        self._thread = None
+        self._refresher = None
+
+    @classmethod
+    def attach(cls, vfabric, prefix):
+        """attaches the mirror of vfabric's vFabric and prefix to vfabric; it starts on its first lookup."""
+        key = (vfabric.session_manager, prefix)
+        mirror = cls._mirrors.get(key)
+        if mirror is None:
+            mirror = cls(vfabric.session_manager, prefix)
+            cls._mirrors[key] = mirror
+        vfabric.topology = mirror
+        return mirror
+
+    def start(self):
+        if self._running or not self.supported:
+            return
+        if self._thread is not None:
+            self.wait()
+        self._running = True
+        self._thread = greenthread.spawn(self._run)
+
+    def stop(self, graceful=True):
+        self._running = False
+        self.synced = False
+        if self.session is not None:
+            self.session.stop(graceful)
+        if not graceful and self._thread is not None:
+            self._thread.kill()
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.wait()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            try:
+                if not self._subscribe():
+                    LOG.error("vfabric: %s does not support netconf notifications, topology mirror disabled",
+                              self.session_manager.host)
+                    self.supported = False
+                    self._running = False
+                    return
+                with self.lock:
+                    self._load()
+            except Exception as e:
+                self.synced = False
+                if self.session is not None:
+                    #subscription can't be repeated on the session, a new one is opened.
+                    self.session.stop()
+                    self.session.wait()
+                if self._running:
+                    LOG.warning("vfabric topology mirror: %s, retrying in %d seconds", e, RESUBSCRIBE_SEC)
+                    greenthread.sleep(RESUBSCRIBE_SEC)
+                continue
+            #the receiver of the session updates the mirror, until the stream drops.
+            self.session.wait()
+            self.synced = False
+            if self._running:
+                LOG.warning("vfabric topology mirror: notification stream dropped, loading again")
+
+    def _subscribe(self):
+        """subscribes to the NETCONF stream on the dedicated session; False if vFabric does not support it."""
+        if self.session is None:
+            manager = self.session_manager
+            #always ssh: the kaloom netconf proxy does not forward notifications.
+            self.session = kaloom_netconf.KaloomNetconfSession(manager.host, manager.port, manager.username,
+                                                               manager.private_key_file, manager.password,
+                                                               manager.timeout_sec, manager.recv_size)
+            self.session.receiver.on_notification = self._notification
+        self.session.init()
+        if kaloom_netconf.CAP_NOTIFICATION not in self.session.capabilities:
+            return False
+        resp = self.session.rpc(TOPOLOGY_command_dict['CREATE_SUBSCRIPTION'].rpc())
+        if resp.find(kaloom_netconf.TAG_NC_OK) is None:
+            raise ValueError(kaloom_netconf.rpc_error_message(resp))
+        return True
+
+    def _get(self, template, **values):
+        return self.session_manager.rpc(template.rpc(**values))
+
+    def _load(self):
+        """loads the whole mirror; nodes made stale before the get are covered by it."""
+        self.stale.clear()
+        resp = self._get(TOPOLOGY_command_dict['GET_TOPOLOGY'])
+        nodes = list(network_nodes(resp))
+        l2_networks, routers = {}, {}
+        for network_id, node in nodes:
+            node_id = node.findtext(kaloom_netconf.TAG_NODE_ID)
+            if network_id == '2' and node_id and node_id.startswith(self.prefix):
+                info = kaloom_netconf.l2_network_info(node)
+                if info is not None:
+                    l2_networks[node_id] = info
+            elif network_id == '3' and node_id:
+                routers[node_id] = kaloom_netconf.router_info(node)
+        self.l2_networks, self.routers, self.tps = l2_networks, routers, host_tps(nodes)
+        self.synced = True
+        LOG.info("vfabric topology mirror loaded: %d l2 networks, %d routers, %d host termination points",
+                 len(l2_networks), len(routers), len(self.tps))
+
+    def _refresh(self, key):
+        """fetches the nodes of stale key again, with lock held."""
+        kind = key[0]
+        if key == ALL:
+            self._load()
+        elif key == TPS:
+            self.tps = host_tps(network_nodes(self._get(TOPOLOGY_command_dict['GET_TPS'])))
+        elif kind == 'l2':
+            resp = self._get(kaloom_netconf.L2_command_dict['GET_L2_NETWORK_BY_NAME'], nw_name=key[1])
+            nodes = kaloom_netconf.XPATH_NODE(resp)
+            info = kaloom_netconf.l2_network_info(nodes[0]) if nodes else None
+            if info is None:
+                self.l2_networks.pop(key[1], None)
+            else:
+                self.l2_networks[key[1]] = info
+        elif kind == 'router':
+            nodes = kaloom_netconf.XPATH_NODE(self._get(TOPOLOGY_command_dict['GET_ROUTER'], router_node_id=key[1]))
+            if nodes:
+                self.routers[key[1]] = kaloom_netconf.router_info(nodes[0])
+            else:
+                self.routers.pop(key[1], None)
+        elif kind == 'router_name':
+            resp = self._get(kaloom_netconf.L3_command_dict['GET_ROUTER_INTERFACE_INFO'], router_name=key[1])
+            for node_id in [node_id for node_id, info in self.routers.items() if info['name'] == key[1]]:
+                del self.routers[node_id]
+            for node in kaloom_netconf.XPATH_NODE(resp):
+                self.routers[node.findtext(kaloom_netconf.TAG_NODE_ID)] = kaloom_netconf.router_info(node)
+
+    def invalidate(self, key):
+        """marks key stale: fetched again by its next lookup, or in background."""
+        if key == ALL:
+            self.synced = False #lookups go to vFabric until loaded again
+        self.stale.add(key)
+        if self._running and self._refresher is None:
+            self._refresher = greenthread.spawn(self._refresh_stale)
+
+    def _refresh_stale(self):
+        try:
+            while self._running and self.stale:
+                with self.lock:
+                    if not self.stale:
+                        break
+                    key = ALL if ALL in self.stale else self.stale.pop()
+                    self.stale.discard(key)
+                    try:
+                        self._refresh(key)
+                    except Exception as e:
+                        #vFabric unreachable: the stream is restarted, then the mirror loaded again.
+                        LOG.warning("vfabric topology mirror: refresh of %s failed: %s, loading again", key, e)
+                        self.synced = False
+                        self.session.stop()
+                        return
+        finally:
+            self._refresher = None
+
+    def _fresh(self, *kinds):
+        """refreshes the stale keys of kinds, before a lookup."""
+        if not any(key[0] in kinds for key in self.stale):
+            return
+        with self.lock:
+            for key in [key for key in self.stale if key[0] in kinds]:
+                self.stale.discard(key)
+                try:
+                    self._refresh(key)
+                except Exception:
+                    self.stale.add(key)
+                    raise
+
+    def _notification(self, notification):
+        if notification.find(TAG_NCEV_CONFIG_CHANGE) is None:
+            LOG.debug("vfabric topology mirror: notification ignored %s", etree.tostring(notification))
+            return
+        keys = [self._target_key(target) for target in XPATH_CHANGE_TARGET(notification)] or [ALL]
+        for key in set(keys):
+            if key is not None:
+                self.invalidate(key)
+
+    def _target_key(self, target):
+        """stale key of a changed config path, None if the mirror does not have it."""
+        if 'networks' not in target:
+            return None
+        network = NETWORK_KEY.search(target)
+        if network is None:
+            return ALL
+        network_id = network.group(2)
+        if network_id == '1':
+            return TPS
+        if network_id not in ('2', '3'):
+            return None
+        node = NODE_KEY.search(target, network.end())
+        if node is None:
+            return ALL
+        node_id = node.group(2)
+        if network_id == '2':
+            return ('l2', node_id) if node_id.startswith(self.prefix) else None
+        return ('router', node_id)
+
+    #lookups, as the KaloomNetconf ones; results are copies.
+    def l2_network(self, nw_name):
+        self._fresh('l2')
+        info = self.l2_networks.get(nw_name)
+        return dict(info) if info is not None else None
+
+    def l2_network_names(self):
+        self._fresh('l2')
+        return list(self.l2_networks)
+
+    def tp(self, host):
+        self._fresh('tps')
+        tp = self.tps.get(host)
+        return dict(tp) if tp is not None else None
+
+    def router_name_ids(self):
+        self._fresh('router', 'router_name')
+        return [(info['name'], node_id) for node_id, info in self.routers.items()]
+
+    def router_id(self, router_name):
+        self._fresh('router', 'router_name')
+        for node_id, info in self.routers.items():
+            if info['name'] == router_name:
+                return node_id
+        return None
+
+    def router_interface_info(self, router_name, l2_node_id):
+        node_id = self.router_id(router_name)
+        if node_id is None:
+            return {'node_id': None, 'interface': None, 'cidrs': []}
+        return kaloom_netconf.router_interface_info(node_id, self.routers[node_id], l2_node_id)
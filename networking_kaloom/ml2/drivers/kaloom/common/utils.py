@@ -14,21 +14,16 @@
 from neutron_lib.plugins import directory
 from neutron_lib import context as nctx
 from networking_kaloom.ml2.drivers.kaloom.db import kaloom_db
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
 from oslo_db import exception as db_exc
 from eventlet import greenthread
+from oslo_config import cfg
 from oslo_log import log
-from xml.sax.saxutils import escape
+import functools
 import netaddr
 
 LOG = log.getLogger(__name__)
 
-def xmlescape(data):
-    #escapes &, <, > by default and also ', " as dict provided.
-    return escape(data, entities={
-        "'": "&apos;",
-        "\"": "&quot;"
-    })
-
 def _get_network_name(network_id):
     ctx = nctx.get_admin_context()
     return directory.get_plugin().get_network(ctx, network_id)['name'] 
@@ -47,10 +42,10 @@ def _kaloom_gui_nw_name(prefix, network_id, name):
 
     Use a unique name so that OpenStack created networks
     can be distinguishged from the user created networks
-    on Kaloom vFabric. xml control characters such as:
-    ", <, >, &, ' are escaped to result valid xml request later.
+    on Kaloom vFabric. xml control characters are escaped by
+    the netconf request builder (netconf_rpc), not here.
     """
-    return prefix + network_id + '.' + xmlescape(name)
+    return prefix + network_id + '.' + name
 
 def _kaloom_router_name(prefix, router_id, name):
     """Generate an kaloom specific name for this router.
@@ -143,3 +138,14 @@ class Invoker:
               command.undo()
            except:
               pass
+
+
+def vfabric_deadline(option):
+    """decorator: the vFabric calls of the method may take cfg.CONF.KALOOM.<option> seconds in total."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with netconf_scheduler.deadline(getattr(cfg.CONF.KALOOM, option)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
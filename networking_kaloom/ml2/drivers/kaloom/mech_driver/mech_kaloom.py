@@ -16,6 +16,7 @@ import os
 import signal
 import abc, six
 
+from eventlet import semaphore
 from oslo_log import log
 from oslo_config import cfg
 from neutron_lib import constants
@@ -27,6 +28,8 @@ from neutron.services.segments import plugin as segments_plugin
 from networking_kaloom.ml2.drivers.kaloom.mech_driver import pool
 from networking_kaloom.ml2.drivers.kaloom.db import kaloom_db
 from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconf
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconfBatchError
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
 from networking_kaloom.ml2.drivers.kaloom.common import config as kaloom_config
 from networking_kaloom.ml2.drivers.kaloom.common import constants as kconst
 from networking_kaloom.ml2.drivers.kaloom.common import utils
@@ -88,8 +91,12 @@ class KaloomL2CleanupWorker(worker.BaseWorker):
         self.vfabric = vfabric
         self.prefix = prefix
         self._loop = None
+        #vfabric whose reconnects resync, while started.
+        self._subscribed = None
         self.deleting_seconds = self.interval_seconds = 10
         self.creating_seconds = 60
+        #periodic and reconnect passes do not overlap.
+        self._lock = semaphore.Semaphore()
         super(KaloomL2CleanupWorker, self).__init__(worker_process_count=1)
 
     def start(self):
@@ -97,8 +104,10 @@ class KaloomL2CleanupWorker(worker.BaseWorker):
         if self._loop is None:
            self._loop = loopingcall.FixedIntervalLoopingCall(self.cleanup)
            self._loop.start(interval = self.interval_seconds, initial_delay=self.interval_seconds) #delayed start to complete service loading in init
+        self._subscribe()
 
     def stop(self):
+        self._unsubscribe()
         if self._loop is not None:
             self._loop.stop()
 
@@ -112,7 +121,66 @@ class KaloomL2CleanupWorker(worker.BaseWorker):
         self.wait()
         self.start()
 
+    def use(self, vfabric, prefix):
+        """the worker is a singleton: a driver initialized again hands over its new vfabric."""
+        self.vfabric = vfabric
+        self.prefix = prefix
+        if self._subscribed is not None:
+            self._subscribe()
+
+    def _subscribe(self):
+        self._unsubscribe()
+        self.vfabric.on_reconnect(self.resync)
+        self._subscribed = self.vfabric
+
+    def _unsubscribe(self):
+        if self._subscribed is not None:
+            self._subscribed.off_reconnect(self.resync)
+            self._subscribed = None
+
     def cleanup(self):
+        #periodic: its rpcs give way to the ones of neutron API calls.
+        with self._lock, self.vfabric.priority(netconf_scheduler.BACKGROUND), \
+                self.vfabric.deadline(cfg.CONF.KALOOM.netconf_background_timeout):
+            self._cleanup()
+
+    def resync(self):
+        """on a new vFabric session-id (restart, failover): l2 networks missing on vFabric are created
+        again, then stranded ones cleaned, at once and ahead of background work."""
+        LOG.info('vFabric reconnected with a new netconf session, resynchronizing l2 networks')
+        with self._lock, self.vfabric.priority(netconf_scheduler.INTERACTIVE), \
+                self.vfabric.deadline(cfg.CONF.KALOOM.netconf_background_timeout):
+            #lookups cached before the reconnect may not hold anymore.
+            self.vfabric.cache.clear()
+            self._recreate()
+            self._cleanup()
+
+    def _recreate(self):
+        #networks created on vFabric by the driver have a knid mapping.
+        try:
+           vfabric_nw_names = set(self.vfabric.get_l2_network_names(self.prefix))
+           networks = kaloom_db.get_networks()
+        except Exception as e:
+           LOG.warning("resync l2 networks: error caught err_msg:%s", e)
+           return
+        for network in networks:
+           nw_name = utils._kaloom_nw_name(self.prefix, network.id)
+           if nw_name in vfabric_nw_names:
+              continue
+           try:
+              knid_mapping = kaloom_db.get_knid_mapping(network_id=network.id)
+              if not knid_mapping:
+                 continue
+              gui_nw_name = utils._kaloom_gui_nw_name(self.prefix, network.id, network.name)
+              knid = self.vfabric.create_l2_network(nw_name, gui_nw_name, kconst.DEFAULT_VLAN_ID).get('kaloom_knid')
+              LOG.info("resync created missing l2_network:%s in vfabric, KNID %s", nw_name, knid)
+              if knid is not None and knid != knid_mapping.kaloom_knid:
+                 kaloom_db.delete_knid_mapping(network.id)
+                 kaloom_db.create_knid_mapping(kaloom_knid=knid, network_id=network.id)
+           except Exception as e:
+              LOG.warning("resync failed to create missing l2_network:%s in vfabric, err:%s", nw_name, e)
+
+    def _cleanup(self):
         LOG.debug('cleanup..')
         #clean stranded networks in vfabric, that does not exist in openstack: e.g. created after netconf timeout, manually created.
         try:
@@ -125,6 +193,8 @@ class KaloomL2CleanupWorker(worker.BaseWorker):
            stranded_nw_names = set(vfabric_nw_names) - set(openstack_nw_names)
            if len(stranded_nw_names) > 0:
                LOG.info("cleanup found stranded networks: %s, cleaning up..", stranded_nw_names)
+           #all stranded networks are removed by a single edit-config, each one succeeds or fails on its own.
+           batch = self.vfabric.batch(atomic=False)
            for stranded_nw_name in stranded_nw_names:
                try:
                   network_id = stranded_nw_name.split(self.prefix)[1].split('_')[0] #network_id is in between of prefix and _
@@ -133,9 +203,15 @@ class KaloomL2CleanupWorker(worker.BaseWorker):
                      kaloom_db.delete_knid_mapping(network_id)
                      clean_local_vlan_mappings(network_id)
 
-                  self.vfabric.delete_l2_network(stranded_nw_name)
+                  batch.delete_l2_network(stranded_nw_name)
                except Exception as e:
                   LOG.warning("cleanup failed to delete stranded l2_network:%s in vfabric, err:%s", stranded_nw_name, e)
+           try:
+              batch.send()
+           except KaloomNetconfBatchError as e:
+              for operation, err in e.errors:
+                 LOG.warning("cleanup failed to delete stranded l2_network:%s in vfabric, err:%s",
+                             operation[1] if operation else e.operations, err)
         except Exception as e:
            LOG.warning("cleanup stranded networks: error caught err_msg:%s", e)
 
@@ -148,12 +224,35 @@ class KaloomL2CleanupWorker(worker.BaseWorker):
 
         if all_stale_vlan_mappings:
            ctx = nctx.get_admin_context()
+           #tps are detached by a single edit-config; local mappings are removed for the detached ones only.
+           batch = self.vfabric.batch(atomic=False)
+           detached = []
            for m in all_stale_vlan_mappings:
               try:
                  LOG.info('Cleaning.. for host=%s network=%s vlan=%s state=%s timestamp:%s', m.host, m.network_id, m.vlan_id, m.state, m.timestamp)
                  tp = self.vfabric.get_tp_by_annotation(m.host)
+                 operation = None
                  if tp:
-                    self.vfabric.detach_tp_from_l2_network(m.network_name, tp.get('id'))
+                    operation = batch.detach_tp_from_l2_network(m.network_name, tp.get('id'))
+                 detached.append((m, operation))
+              except Exception as e:
+                 LOG.warning("cleanup: error caught for host=%s, network=%s err_msg:%s", m.host, m.network_id, e)
+
+           failed, errors = set(), []
+           try:
+              batch.send()
+           except KaloomNetconfBatchError as e:
+              failed, errors = e.failed, e.errors
+           except Exception as e:
+              LOG.warning("cleanup stranded tp-attachment: error caught err_msg:%s", e)
+              return
+
+           for m, operation in detached:
+              try:
+                 if operation in failed:
+                    LOG.warning("cleanup: error caught for host=%s, network=%s err_msg:%s", m.host, m.network_id,
+                                '; '.join(err for op, err in errors if op in (operation, None)))
+                    continue
                  remove_local_segment(ctx, m.segment_id)
                  remove_local_vlan_mapping(m)
               except Exception as e:
@@ -181,12 +280,9 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
 
     def initialize(self):
         self.vlan_pool = pool.KaloomVlanPool()
-        self.vfabric = KaloomNetconf(cfg.CONF.KALOOM.kaloom_host,
-                                    cfg.CONF.KALOOM.kaloom_port,
-                                    cfg.CONF.KALOOM.kaloom_username,
-                                    cfg.CONF.KALOOM.kaloom_private_key_file,
-                                    cfg.CONF.KALOOM.kaloom_password)
+        self.vfabric = KaloomNetconf.from_config(cfg.CONF.KALOOM, self.prefix)
         self.cleanup = KaloomL2CleanupWorker(self.vfabric, self.prefix)
+        self.cleanup.use(self.vfabric, self.prefix)
 
     def _handle_signal(self):
         signal_handler = service.SignalHandler()
@@ -196,8 +292,7 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
     def _handle_sigterm(self, signum, frame):
         LOG.info("%s caught SIGTERM, stopping l2-cleanup and netconf-receiver threads", self._plugin_name())
         self.cleanup.stop()
-        if self.vfabric.receiver.is_running():
-           self.vfabric.receiver.stop(graceful = False)
+        self.vfabric.stop(graceful = False)
 
     #'systemctl reload neutron-server' is not supported, still we want to be compatible with 'kill -SIGHUP'
     #'reset' is not called in ML2 plugin, when there is 'reset' in oslo_service (neutron-server).
@@ -207,16 +302,15 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
         #stopping
         self.cleanup.stop()
         self.cleanup.wait()
-        if self.vfabric.receiver.is_running():
-           self.vfabric.receiver.stop()
-           self.vfabric.receiver.wait()
+        self.vfabric.stop()
+        self.vfabric.wait()
         #reload configuration files
         cfg.CONF.reload_config_files()
         #re-initialize
         self.initialize()
         #start cleanup
         self.cleanup.start()
-        #don't start netconf-receiver here, start will be on add_callback_event, when first msg appears
+        #don't start netconf-receiver here, start will be on netconf session init, when first msg appears
 
     def get_kvs_vif_type(self, context, agent, segment):
         device_owner = context.current['device_owner']
@@ -263,6 +357,7 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
             return [kconst.TYPE_KNID]
 
     #all mech-drivers are called for bind_port
+    @utils.vfabric_deadline('netconf_precommit_timeout')
     def bind_port(self, context):
         ovs_present = self._is_ovs_agent_present(context)
         kvs_present = self._is_kvs_agent_present(context)
@@ -504,6 +599,7 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
     #"openstack network delete .." calls first delete_port* if any on the network, and then calls delete_network*
     #delete_port_postcommit: Runtime errors are not expected, and will not prevent the resource from being deleted.
     #so cleanup as much as possible.
+    @utils.vfabric_deadline('netconf_postcommit_timeout')
     def delete_port_postcommit(self, context):
         super(KaloomOVSMechanismDriver, self).delete_port_postcommit(context)
         #not allowed network_type
@@ -538,6 +634,7 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
 
 
     #create_network_postcommit "rollbacks" on exception, by calling delete_network*, so extra care needed.
+    @utils.vfabric_deadline('netconf_postcommit_timeout')
     def create_network_postcommit(self, context):
         super(KaloomOVSMechanismDriver, self).create_network_postcommit(context)
         #not allowed network_type
@@ -562,6 +659,7 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
         kaloom_db.create_knid_mapping(kaloom_knid=knid, network_id=network_id)
 
     #delete_network_postcommit called after db transaction: the caller ignores the error i.e won't undo the action by recreating the network.
+    @utils.vfabric_deadline('netconf_postcommit_timeout')
     def delete_network_postcommit(self, context):
         super(KaloomOVSMechanismDriver, self).delete_network_postcommit(context)
         # don't check allowed network_type, as network's segments are deleted before this, resulting network_type=None.
@@ -580,6 +678,7 @@ class KaloomOVSMechanismDriver(OpenvswitchMechanismDriver):
         return
 
     #to support vfabric nw rename upon: openstack network set --name <new_name> <network>
+    @utils.vfabric_deadline('netconf_postcommit_timeout')
     def update_network_postcommit(self, context):
         super(KaloomOVSMechanismDriver, self).update_network_postcommit(context)
         #not allowed network_type
@@ -17,6 +17,7 @@ import netaddr
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
 from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconf
 from networking_kaloom.ml2.drivers.kaloom.common import utils
 from networking_kaloom.services.l3 import exceptions as kaloom_exc
@@ -32,20 +33,15 @@ class KaloomL3Driver(object):
     All communications between Neutron and vFabric are over Netconf.
     """
     def __init__(self, prefix):
-        self.vfabric = KaloomNetconf(cfg.CONF.KALOOM.kaloom_host,
-                                    cfg.CONF.KALOOM.kaloom_port,
-                                    cfg.CONF.KALOOM.kaloom_username,
-                                    cfg.CONF.KALOOM.kaloom_private_key_file,
-                                    cfg.CONF.KALOOM.kaloom_password)
+        self.vfabric = KaloomNetconf.from_config(cfg.CONF.KALOOM, prefix)
         self.prefix = prefix
 
     def get_routers(self):
         """existing routers in Kaloom vFabric, related to OpenStack instance"""
-        all_routers =  self.vfabric.list_router_name_id() #raises Exception on error
+        #filtered by prefix on vfabric, when it supports xpath filters
         openstack_routers = {}
-        for (router_name, router_node_id) in all_routers:
-            if router_name.startswith(self.prefix):
-                openstack_routers[router_name] = router_node_id
+        for (router_name, router_node_id) in self.vfabric.list_router_name_id(self.prefix): #raises Exception on error
+            openstack_routers[router_name] = router_node_id
         return openstack_routers
 
     def create_router(self, context, router):
@@ -64,6 +60,27 @@ class KaloomL3Driver(object):
                 LOG.error(msg)
                 raise kaloom_exc.KaloomServicePluginRpcError(msg=msg)
 
+    def create_routers(self, context, routers):
+        """Creates routers on Kaloom vFabric, with all create_router rpcs in flight at once.
+
+        Returns {router name: error} of the routers that failed.
+        """
+        submitted, errors = [], {}
+        for router in routers:
+            router_name = utils._kaloom_router_name(self.prefix, router['id'], router['name'])
+            try:
+                LOG.info('Trying to create_router %s in vfabric', router_name)
+                submitted.append((router_name, self.vfabric.submit_create_router(router_name)))
+            except Exception as e:
+                errors[router_name] = e
+        results = kaloom_netconf.gather([future for router_name, future in submitted], return_exceptions=True)
+        for (router_name, future), result in zip(submitted, results):
+            if isinstance(result, Exception):
+                errors[router_name] = result
+        for router_name, e in errors.items():
+            LOG.error('Failed to create router %s on Kaloom vFabric, err:%s', router_name, e)
+        return errors
+
     def delete_router(self, context, router_id, router):
         """Deletes a router from Kaloom vFabric."""
         if router:
@@ -121,15 +138,21 @@ class KaloomL3Driver(object):
                 setup = new_set - original_set
                 delete = original_set - new_set
 
-                for (destination, nexthop) in setup:
-                    route_info={'router_node_id': vfabric_router_id, 'destination_prefix': destination, 'next_hop_address': nexthop}
-                    route_info['ip_version'] = netaddr.IPNetwork(destination.split('/')[0]).version
-                    self.vfabric.add_ip_static_route(route_info)
-
-                for (destination, nexthop) in delete:
-                    route_info = {'router_node_id': vfabric_router_id, 'destination_prefix': destination}
-                    route_info['ip_version'] = netaddr.IPNetwork(destination.split('/')[0]).version
-                    self.vfabric.delete_ip_static_route(route_info)
+                #one edit-config for the removed routes, then one for the new ones: a route whose nexthop
+                #changed is removed and created again, and both can't be in the same edit-config.
+                #both are applied by a single commit.
+                with self.vfabric.transaction():
+                    with self.vfabric.batch() as batch:
+                        for (destination, nexthop) in delete:
+                            route_info = {'router_node_id': vfabric_router_id, 'destination_prefix': destination}
+                            route_info['ip_version'] = netaddr.IPNetwork(destination.split('/')[0]).version
+                            batch.delete_ip_static_route(route_info)
+
+                    with self.vfabric.batch() as batch:
+                        for (destination, nexthop) in setup:
+                            route_info={'router_node_id': vfabric_router_id, 'destination_prefix': destination, 'next_hop_address': nexthop}
+                            route_info['ip_version'] = netaddr.IPNetwork(destination.split('/')[0]).version
+                            batch.add_ip_static_route(route_info)
 
             except Exception as e:
                 msg = (_('Failed to update routes %s on vfabric router %s, err:%s') % (new_routes_info, router_name, e))
@@ -199,22 +222,25 @@ class KaloomL3Driver(object):
                 interface_info['ip_version'] = router_info['ip_version']
                 prefix_length = router_info['cidr'].split('/')[1]
 
-                #plugin.remove_router_interface left stale data on vfabric? not cleaned yet? then delete (first) or reuse.
-                #otherwise multiple IPs of same subnet would complain "That ipv4 address already exist for that router"
-                given_ip_cidr = '%s/%s' % (router_info['ip_address'], prefix_length)
-                deleted = self._delete_stale_ipaddress_from_interface(interface_info, given_ip_cidr, router_inf_info['cidrs'])
-                if not deleted:
-                    #already exists exact ip/subnet in vfabric, which is not deleted to reuse.
-                    return
-
-                #add_ipaddress_to_interface
-                interface_info['ip_address'] = router_info['ip_address']
-                interface_info['prefix_length'] = prefix_length
-                try:
-                    self.vfabric.add_ipaddress_to_interface(interface_info)
-                except Exception as _e:
-                    msg = "add_ipaddress_to_interface failed: %s" % (_e)
-                    raise ValueError(msg)
+                #stale ip delete and ip add are committed together, or discarded together on failure.
+                #attach_router is an rpc (not an edit), it is undone by attachFabricOperation.
+                with self.vfabric.transaction():
+                    #plugin.remove_router_interface left stale data on vfabric? not cleaned yet? then delete (first) or reuse.
+                    #otherwise multiple IPs of same subnet would complain "That ipv4 address already exist for that router"
+                    given_ip_cidr = '%s/%s' % (router_info['ip_address'], prefix_length)
+                    deleted = self._delete_stale_ipaddress_from_interface(interface_info, given_ip_cidr, router_inf_info['cidrs'])
+                    if not deleted:
+                        #already exists exact ip/subnet in vfabric, which is not deleted to reuse.
+                        return
+
+                    #add_ipaddress_to_interface
+                    interface_info['ip_address'] = router_info['ip_address']
+                    interface_info['prefix_length'] = prefix_length
+                    try:
+                        self.vfabric.add_ipaddress_to_interface(interface_info)
+                    except Exception as _e:
+                        msg = "add_ipaddress_to_interface failed: %s" % (_e)
+                        raise ValueError(msg)
             except Exception as e:
                 msg = (_('Failed to add subnet %s (IP %s) to vfabric router '
                     '%s -- network %s, err:%s') % (router_info['subnet_id'], router_info['ip_address'], router_name, l2_node_id, e))
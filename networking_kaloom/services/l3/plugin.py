@@ -37,10 +37,12 @@ from neutron.plugins.ml2.driver_context import NetworkContext  # noqa
 
 from networking_kaloom.services.l3 import driver as kaloom_l3_driver
 from networking_kaloom.ml2.drivers.kaloom.common import constants as kconst
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
 from networking_kaloom.ml2.drivers.kaloom.common import utils
 from neutron_lib.db import api as db_api
 from networking_kaloom.ml2.drivers.kaloom.db import kaloom_db
 from eventlet import greenthread
+from eventlet import semaphore
 
 LOG = logging.getLogger(__name__)
 
@@ -50,6 +52,8 @@ class KaloomL3SyncWorker(worker.BaseWorker):
         self.driver = driver
         self.prefix = prefix
         self._loop = None
+        #periodic and reconnect passes do not overlap.
+        self._lock = semaphore.Semaphore()
         super(KaloomL3SyncWorker, self).__init__(worker_process_count=0)
 
     def start(self):
@@ -63,8 +67,10 @@ class KaloomL3SyncWorker(worker.BaseWorker):
                              self.synchronize
                              )
             self._loop.start(interval=interval_val)
+        self.driver.vfabric.on_reconnect(self.resync)
 
     def stop(self):
+        self.driver.vfabric.off_reconnect(self.resync)
         if self._loop is not None:
             self._loop.stop()
 
@@ -106,6 +112,22 @@ class KaloomL3SyncWorker(worker.BaseWorker):
         return grouped_router_interfaces
 
     def synchronize(self):
+        #a full resync sends many rpcs: they give way to the ones of neutron API calls.
+        with self._lock, self.driver.vfabric.priority(netconf_scheduler.BULK), \
+                self.driver.vfabric.deadline(cfg.CONF.KALOOM.netconf_background_timeout):
+            self._synchronize()
+
+    def resync(self):
+        """on a new vFabric session-id (restart, failover): synchronizes at once, rather than at the
+        next l3_sync_interval, and ahead of background work."""
+        LOG.info('vFabric reconnected with a new netconf session, synchronizing routers')
+        with self._lock, self.driver.vfabric.priority(netconf_scheduler.INTERACTIVE), \
+                self.driver.vfabric.deadline(cfg.CONF.KALOOM.netconf_background_timeout):
+            #lookups cached before the reconnect may not hold anymore.
+            self.driver.vfabric.cache.clear()
+            self._synchronize()
+
+    def _synchronize(self):
         """Synchronizes Router DB from Neturon DB with Kaloom Fabric.
 
         Walks through the Neturon Db and ensures that all the routers
@@ -134,16 +156,17 @@ class KaloomL3SyncWorker(worker.BaseWorker):
     def sync_routers(self, routers, vfabric_routers):
         try:
            #create routers if does not exist in vfabric
+           missing_routers = []
            for r in routers:
                vfabric_router = utils._kaloom_router_name(self.prefix, r['id'], r['name'])
                if vfabric_router in vfabric_routers.keys():
                    #mark as non-stranding router
                    vfabric_routers.pop(vfabric_router, None)
                else:
-                   try:
-                       self.driver.create_router(self, r)
-                   except Exception as e:
-                       LOG.error("sync_routers failed to create router=%s, msg:%s", vfabric_router, e)
+                   missing_routers.append(r)
+           #all at once, instead of a round trip per router
+           for vfabric_router, e in self.driver.create_routers(self, missing_routers).items():
+               LOG.error("sync_routers failed to create router=%s, msg:%s", vfabric_router, e)
            # remove stranded vfabric routers
            # possibility of stranded routers: router creation after netconf timeout; manually added routers in vFabric, failed deletion 
            for vfabric_router in vfabric_routers.keys():
@@ -236,6 +259,7 @@ class KaloomL3ServicePlugin(service_base.ServicePluginBase,
                 "based routing")
 
     @log_helpers.log_method_call
+    @utils.vfabric_deadline('netconf_precommit_timeout')
     def create_router(self, context, router):
         """Create a new router entry in DB, and create it in vFabric."""
         # create_router can't go in parallel with l3_sync (synchronize)
@@ -324,6 +348,7 @@ class KaloomL3ServicePlugin(service_base.ServicePluginBase,
         return new_router
 
     @log_helpers.log_method_call
+    @utils.vfabric_deadline('netconf_precommit_timeout')
     def update_router(self, context, router_id, router):
         """Update an existing router in DB, and update it in Kaloom vFabric."""
 
@@ -392,6 +417,7 @@ class KaloomL3ServicePlugin(service_base.ServicePluginBase,
                LOG.error(msg)
         
     @log_helpers.log_method_call
+    @utils.vfabric_deadline('netconf_precommit_timeout')
     def delete_router(self, context, router_id):
         """Delete an existing router from Kaloom vFabric as well as from the DB."""
         router = self.get_router(context, router_id)
@@ -437,6 +463,7 @@ class KaloomL3ServicePlugin(service_base.ServicePluginBase,
                 return fixed_ip['ip_address']
 
     @log_helpers.log_method_call
+    @utils.vfabric_deadline('netconf_precommit_timeout')
     def add_router_interface(self, context, router_id, interface_info):
         """Add a subnet of a network to an existing router."""
         router = self.get_router(context, router_id)
@@ -494,6 +521,7 @@ class KaloomL3ServicePlugin(service_base.ServicePluginBase,
                         interface_info)
 
     @log_helpers.log_method_call
+    @utils.vfabric_deadline('netconf_precommit_timeout')
     def remove_router_interface(self, context, router_id, interface_info):
         """Remove a subnet of a network from an existing router."""
         router = self.get_router(context, router_id)
@@ -0,0 +1,95 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Micro-benchmark of netconf reply framing throughput against reply size.
+
+Compares the string accumulate/split loop the receiver used to run with
+netconf_framing.EOMDecoder (netconf 1.0) and netconf_framing.ChunkedDecoder
+(netconf 1.1), feeding replies in recv-sized chunks.
+
+usage: python -m networking_kaloom.tests.benchmark.bench_netconf_framing [recv_size]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+
+TERMINATOR = netconf_framing.TERMINATOR
+NODE = b'<node><node-id>__OpenStack__%08d</node-id></node>'
+REPLY_SIZES = [16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+
+def make_reply(size):
+    nodes = []
+    total = 0
+    i = 0
+    while total < size:
+        node = NODE % i
+        nodes.append(node)
+        total += len(node)
+        i += 1
+    return b'<rpc-reply message-id="1"><data>' + b''.join(nodes) + b'</data></rpc-reply>'
+
+
+def chunks(stream, recv_size):
+    return [stream[i:i + recv_size] for i in range(0, len(stream), recv_size)]
+
+
+def split_loop(received):
+    frames = []
+    responses = b''
+    for response in received:
+        responses = responses + response
+        msgs = responses.split(TERMINATOR)
+        frames.extend(msgs[:-1])
+        responses = msgs[-1]
+    return frames
+
+
+def decoder_loop(received):
+    frames = []
+    decoder = netconf_framing.EOMDecoder()
+    for response in received:
+        frames.extend(decoder.feed(response))
+    return frames
+
+
+def chunked_loop(received):
+    frames = []
+    decoder = netconf_framing.ChunkedDecoder()
+    for response in received:
+        frames.extend(decoder.feed(response))
+    return frames
+
+
+def run(recv_size):
+    print('recv_size %d' % recv_size)
+    print('%12s %14s %14s %14s' % ('reply bytes', 'split MB/s', 'eom MB/s', 'chunked MB/s'))
+    for size in REPLY_SIZES:
+        reply = make_reply(size)
+        received = chunks(reply + TERMINATOR, recv_size)
+        received_chunked = chunks(netconf_framing.ChunkedDecoder().encode(reply), recv_size)
+        mbytes = len(reply) / (1024.0 * 1024.0)
+        number = max(1, int(8 * 1024 * 1024 / len(reply)))
+        result = []
+        for loop, stream in ((split_loop, received), (decoder_loop, received), (chunked_loop, received_chunked)):
+            elapsed = min(timeit.repeat(lambda: loop(stream), number=number, repeat=3))
+            result.append(mbytes * number / elapsed)
+        print('%12d %14.1f %14.1f %14.1f' % (len(reply), result[0], result[1], result[2]))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2048)
+    run(netconf_framing.DEFAULT_RECV_SIZE)
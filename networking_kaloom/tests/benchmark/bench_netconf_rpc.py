@@ -0,0 +1,112 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the netconf rpc rate of a session, under concurrent greenthreads.
+
+Compares KaloomNetconfSession (lock-free message-ids, init fast path) with the
+same session taking the interprocess file locks it used to take on every rpc
+(message-id and session init). vFabric is an in-memory chan replying <ok/>
+to each rpc, so the rate is the client side cost of an rpc.
+
+usage: python -m networking_kaloom.tests.benchmark.bench_netconf_rpc [rpcs]
+"""
+from __future__ import print_function
+
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import eventlet
+eventlet.monkey_patch()
+from eventlet import queue
+from mock import Mock, patch
+from oslo_concurrency import lockutils
+
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+
+CONCURRENCY = [1, 8, 64]
+MSGID = re.compile(br'message-id="(\d+)"')
+REPLY = b'<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="%s"><ok/></rpc-reply>'
+RPC = netconf_rpc.Rpc(b'<get/>')
+
+
+class EchoChan(object):
+    """chan of a vFabric replying <ok/> to every rpc."""
+    def __init__(self):
+        self.replies = queue.LightQueue()
+
+    def sendall(self, data):
+        #frames of several rpcs may come in a single send.
+        self.replies.put(b''.join(REPLY % msgid + netconf_framing.TERMINATOR for msgid in MSGID.findall(data)))
+
+    def recv(self, size):
+        return self.replies.get()
+
+    def close(self):
+        self.replies.put(b'')
+
+
+class FileLockedSession(kaloom_netconf.KaloomNetconfSession):
+    """the session as it was: a file lock around init, and around each message-id."""
+    @lockutils.synchronized('kaloom_netconf_session_init_lock', external=True)
+    def init(self):
+        super(FileLockedSession, self).init()
+
+    @lockutils.synchronized('kaloom_netconf_msgid_lock', external=True)
+    def _get_next_msgid(self):
+        return super(FileLockedSession, self)._get_next_msgid()
+
+
+def new_session(cls):
+    with patch.object(kaloom_netconf.paramiko, 'SSHClient'):
+        session = cls('127.0.0.1', 830, 'admin', '', 'admin')
+    session.is_healthy = lambda: session.receiver.is_running()
+    session._init = Mock()
+    session.chan = EchoChan()
+    session.receiver.update_chan(session.chan)
+    session.sender.update_chan(session.chan)
+    return session
+
+
+def rate(session, rpcs, concurrency):
+    pool = eventlet.GreenPool(concurrency)
+    start = time.time()
+    for i in range(rpcs):
+        pool.spawn_n(session.rpc, RPC)
+    pool.waitall()
+    return rpcs / (time.time() - start)
+
+
+def run(rpcs):
+    print('%12s %16s %16s' % ('greenthreads', 'file lock rpc/s', 'lock-free rpc/s'))
+    for concurrency in CONCURRENCY:
+        result = []
+        for cls in (FileLockedSession, kaloom_netconf.KaloomNetconfSession):
+            session = new_session(cls)
+            rate(session, 100, concurrency) #warm up
+            result.append(rate(session, rpcs, concurrency))
+            session.stop(graceful=False)
+        print('%12d %16.0f %16.0f' % (concurrency, result[0], result[1]))
+
+
+if __name__ == '__main__':
+    lock_path = tempfile.mkdtemp()
+    lockutils.set_defaults(lock_path)
+    try:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+    finally:
+        shutil.rmtree(lock_path)
@@ -0,0 +1,186 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the ssh backends of a netconf session (netconf_ssh_backend).
+
+A netconf server over ssh on 127.0.0.1 (paramiko, in a process of its own)
+replies <ok/> to <get/>, and REPLY_SIZE bytes to <get-config/>. A session of
+each backend connects to it, and measures:
+
+    rpc/s          small rpcs sent by CONCURRENCY greenthreads
+    cpu ms/rpc     cpu of this process (neutron-server) per small rpc; the
+                   ssh process of the openssh backend is not counted
+    MB/s           large replies, one rpc at a time
+
+The server is the same for both backends: only the client side differs. With
+a real vFabric or sshd, its own server bounds the rates instead of this one.
+
+usage: python -m networking_kaloom.tests.benchmark.bench_netconf_transport [rpcs] [large rpcs]
+"""
+from __future__ import print_function
+
+import itertools
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+CONCURRENCY = 8
+REPLY_SIZE = 4 * 1024 * 1024
+TERMINATOR = b']]>]]>'
+MSGID = re.compile(br'message-id="(\d+)"')
+SERVER_HELLO = b'''<hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><capabilities>
+<capability>urn:ietf:params:netconf:base:1.0</capability></capabilities><session-id>%d</session-id></hello>'''
+REPLY = b'<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="%s">%s</rpc-reply>'
+NODE = b'<node><node-id>__OpenStack__00000000-0000-0000-0000-000000000000</node-id></node>'
+DATA = (b'<data><networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network"><network>' +
+        NODE * (REPLY_SIZE // len(NODE)) + b'</network></networks></data>')
+
+
+class NetconfServer(paramiko.ServerInterface):
+    """accepts any key; the netconf subsystem of each channel is served by a thread."""
+    session_ids = itertools.count(1)
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_FAILED
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name != 'netconf':
+            return False
+        thread = threading.Thread(target=self.netconf, args=(channel,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def netconf(self, chan):
+        chan.sendall(SERVER_HELLO % next(self.session_ids) + TERMINATOR)
+        pending = b''
+        while True:
+            data = chan.recv(65536)
+            if not data:
+                break
+            frames = (pending + data).split(TERMINATOR)
+            pending = frames.pop()
+            replies = []
+            for frame in frames:
+                msgid = MSGID.search(frame)
+                if msgid is not None:
+                    body = DATA if b'<get-config' in frame else b'<ok/>'
+                    replies.append(REPLY % (msgid.group(1), body) + TERMINATOR)
+            if replies:
+                chan.sendall(b''.join(replies))
+        chan.close()
+
+
+def serve():
+    """listens on a free port of 127.0.0.1, printed on stdout once ready."""
+    #disconnects of the clients are logged by paramiko.transport
+    logging.getLogger('paramiko').addHandler(logging.NullHandler())
+    host_key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    print(sock.getsockname()[1])
+    sys.stdout.flush()
+    while True:
+        conn, _ = sock.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.start_server(server=NetconfServer())
+
+
+def new_session(backend, port, key_file, tmp):
+    from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+    from networking_kaloom.ml2.drivers.kaloom.common import netconf_openssh
+
+    class OpenSSHSession(kaloom_netconf.KaloomNetconfOpenSSHSession):
+        #the paramiko server does not send server-sig-algs, without which OpenSSH does not sign with rsa-sha2.
+        def _new_client(self):
+            return netconf_openssh.KaloomNetconfOpenSSHClient(control_path=os.path.join(tmp, 'cm-%C'),
+                                                              options=['PubkeyAcceptedAlgorithms=+ssh-rsa'])
+
+    session_class = OpenSSHSession if backend == kaloom_netconf.SSH_BACKEND_OPENSSH else kaloom_netconf.KaloomNetconfSession
+    session = session_class('127.0.0.1', port, 'bench', key_file, None, 60)
+    session.init()
+    return session
+
+
+def rpc_rate(session, rpcs, rpc):
+    import eventlet
+    pool = eventlet.GreenPool(CONCURRENCY)
+    cpu, start = sum(os.times()[:2]), time.time()
+    for i in range(rpcs):
+        pool.spawn_n(session.rpc, rpc)
+    pool.waitall()
+    return rpcs / (time.time() - start), (sum(os.times()[:2]) - cpu) * 1000.0 / rpcs
+
+
+def throughput(session, rpcs, rpc):
+    start = time.time()
+    for i in range(rpcs):
+        session.rpc(rpc)
+    return rpcs * len(DATA) / (time.time() - start) / (1024 * 1024)
+
+
+def run(rpcs, large_rpcs):
+    from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+    from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+    small, large = netconf_rpc.Rpc(b'<get/>'), netconf_rpc.Rpc(b'<get-config/>')
+    tmp = tempfile.mkdtemp()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve'], stdout=subprocess.PIPE)
+    try:
+        port = int(server.stdout.readline())
+        key_file = os.path.join(tmp, 'id_rsa')
+        paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+        os.chmod(key_file, 0o600)
+        print('%10s %10s %12s %10s' % ('backend', 'rpc/s', 'cpu ms/rpc', 'MB/s'))
+        for backend in kaloom_netconf.SSH_BACKENDS:
+            session = new_session(backend, port, key_file, tmp)
+            rpc_rate(session, 100, small) #warm up
+            rate, cpu = rpc_rate(session, rpcs, small)
+            mbs = throughput(session, large_rpcs, large)
+            session.stop(graceful=False)
+            session.wait()
+            print('%10s %10.0f %12.3f %10.1f' % (backend, rate, cpu, mbs))
+    finally:
+        subprocess.call(['ssh', '-q', '-o', 'ControlPath=%s' % os.path.join(tmp, 'cm-%C'), '-p', str(port),
+                         '-O', 'exit', '127.0.0.1'], stderr=open(os.devnull, 'wb'))
+        server.kill()
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['serve']:
+        serve()
+    else:
+        #before paramiko starts its threads, as neutron-server does.
+        import eventlet
+        eventlet.monkey_patch()
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,793 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+
+from eventlet import event
+from eventlet import greenthread
+from eventlet import queue
+from mock import Mock, patch
+from neutron.tests import base
+from oslo_config import cfg
+from networking_kaloom.ml2.drivers.kaloom.common import config
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_breaker
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_topology
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconf
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconfRecv
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconfSession
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconfSessionManager
+
+SERVER_HELLO = b'''<?xml version="1.0" encoding="UTF-8"?>
+<hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+  <capabilities>
+    <capability>urn:ietf:params:netconf:base:1.0</capability>
+    %s
+    <capability>urn:ietf:params:netconf:capability:candidate:1.0</capability>
+  </capabilities>
+  <session-id>42</session-id>
+</hello>'''
+
+REPLY_OK = b'''
+<?xml version="1.0" encoding="UTF-8"?>
+<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1"><ok/></rpc-reply>'''
+
+REPLY_ERROR = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="2">
+  <rpc-error>
+    <error-type>application</error-type>
+    <error-tag>data-exists</error-tag>
+    <error-message>unique duplicate constraint</error-message>
+  </rpc-error>
+</rpc-reply>'''
+
+REPLY_L2_NETWORK_NAMES = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="3">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>2</network-id>
+    <node><node-id>__OpenStack__net1</node-id></node>
+    <node><node-id>user_net</node-id></node>
+    <node><node-id>__OpenStack__net2</node-id></node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_L2_NETWORK = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="4">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>2</network-id>
+    <node>
+     <node-id>__OpenStack__net1</node-id>
+     <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+      <KNID xmlns="urn:kaloom:faas:vfabric-l2-topology">1234</KNID>
+     </l2-node-attributes>
+    </node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_TP = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="5">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>1</network-id>
+    <node>
+     <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology">
+      <tp-id>tp-7</tp-id>
+      <annotations xmlns="urn:kaloom:faas:virtual-fabric">
+       <the-key>OpenStack_OVS_Host</the-key>
+       <value>compute-1</value>
+      </annotations>
+     </termination-point>
+    </node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_ROUTER_INTERFACE_INFO = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="6">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>3</network-id>
+    <node>
+     <node-id>r-1</node-id>
+     <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology">
+      <tp-id>1</tp-id>
+      <supporting-termination-point>
+       <network-ref>2</network-ref>
+       <node-ref>__OpenStack__net1</node-ref>
+       <tp-ref>1</tp-ref>
+      </supporting-termination-point>
+      <l3-termination-point-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology">
+       <interface-name xmlns="urn:kaloom:faas:vfabric-l3-unicast-topology">net1</interface-name>
+      </l3-termination-point-attributes>
+     </termination-point>
+     <interfaces xmlns="urn:kaloom:faas:vfabric-interfaces">
+      <interface>
+       <name>net1</name>
+       <ipv4 xmlns="urn:kaloom:faas:vfabric-ip">
+        <address><ip>192.168.1.1</ip><prefix-length>24</prefix-length></address>
+       </ipv4>
+      </interface>
+     </interfaces>
+    </node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_ROUTERS = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="8">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>3</network-id>
+    <node>
+     <node-id>r-1</node-id>
+     <l3-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology"><name>__OpenStack__router1</name></l3-node-attributes>
+    </node>
+    <node>
+     <node-id>r-2</node-id>
+     <l3-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology"><name>user_router</name></l3-node-attributes>
+    </node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_BATCH_ERRORS = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"
+ xmlns:nw="urn:ietf:params:xml:ns:yang:ietf-network" xmlns:nt="urn:ietf:params:xml:ns:yang:ietf-network-topology" message-id="7">
+  <rpc-error>
+    <error-type>application</error-type>
+    <error-tag>data-missing</error-tag>
+    <error-path>/nw:networks/nw:network[nw:network-id='2']/nw:node[nw:node-id='__OpenStack__net2']</error-path>
+    <error-message>node not found</error-message>
+  </rpc-error>
+  <rpc-error>
+    <error-type>application</error-type>
+    <error-tag>in-use</error-tag>
+    <error-path>/nw:networks/nw:network[nw:network-id="2"]/nw:node[nw:node-id="__OpenStack__net3"]/nt:termination-point[nt:tp-id="tp-7"]/nt:tp-id</error-path>
+    <error-message>tp in use</error-message>
+  </rpc-error>
+</rpc-reply>'''
+
+
+def stream_reply(msg):
+    """_stream_netconf_cmd replying msg: extract() of its tag elements, as the receiver streams them."""
+    def stream(req, tag, extract):
+        values = (extract(elem) for elem in kaloom_netconf.parse_xml(msg).iter(tag))
+        return [value for value in values if value is not None]
+    return Mock(side_effect=stream)
+
+
+class KaloomNetconfTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfTestCase, self).setUp()
+        self.vfabric = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin')
+        patcher = patch.object(KaloomNetconfSessionManager, 'capabilities', return_value=frozenset())
+        self.capabilities = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _reply(self, msg):
+        self.vfabric._exec_netconf_cmd = Mock(return_value=kaloom_netconf.parse_xml(msg))
+        self.vfabric._stream_netconf_cmd = stream_reply(msg)
+
+    def test_from_config(self):
+        conf = cfg.ConfigOpts()
+        conf.register_opts(config.kaloom_cfg_opts, 'KALOOM')
+        conf([])
+        conf.set_override('kaloom_host', '127.0.0.1', 'KALOOM')
+        conf.set_override('netconf_cache_ttl', 5, 'KALOOM')
+        conf.set_override('netconf_topology_mirror', True, 'KALOOM')
+        with patch.object(netconf_topology.KaloomTopologyMirror, 'attach') as attach, \
+                patch.object(kaloom_netconf.METRICS, 'configure'), \
+                patch.object(kaloom_netconf.RECORDER, 'configure') as configure_recorder:
+            vfabric = KaloomNetconf.from_config(conf.KALOOM, '__OpenStack__')
+        self.assertEqual(('127.0.0.1', 31831, 5), (vfabric.host, vfabric.port, vfabric.cache.ttl))
+        attach.assert_called_once_with(vfabric, '__OpenStack__')
+        configure_recorder.assert_called_once_with(256, 'SIGWINCH')
+
+    def test_validate_response(self):
+        self.vfabric._validate_response(kaloom_netconf.parse_xml(REPLY_OK))
+        with patch.object(kaloom_netconf.LOG, 'warning'):
+            self.assertRaisesRegexp(ValueError, 'unique duplicate constraint',
+                                    self.vfabric._validate_response,
+                                    kaloom_netconf.parse_xml(REPLY_ERROR))
+
+    def test_get_l2_network_names(self):
+        self._reply(REPLY_L2_NETWORK_NAMES)
+        self.assertEqual(['__OpenStack__net1', '__OpenStack__net2'],
+                         list(self.vfabric.get_l2_network_names('__OpenStack__')))
+
+    def test_get_l2_network_names_xpath(self):
+        self._reply(REPLY_L2_NETWORK_NAMES)
+        list(self.vfabric.get_l2_network_names('__OpenStack__'))
+        self.assertIn(b'type="subtree"', self.vfabric._stream_netconf_cmd.call_args[0][0].operation)
+
+        #prefix filtered by vFabric
+        self.capabilities.return_value = frozenset([kaloom_netconf.CAP_XPATH])
+        list(self.vfabric.get_l2_network_names('__OpenStack__'))
+        get = kaloom_netconf.parse_xml(self.vfabric._stream_netconf_cmd.call_args[0][0].to_bytes(1))[0]
+        self.assertEqual("/nw:networks/nw:network[nw:network-id='2']/nw:node[starts-with(nw:node-id, '__OpenStack__')]/nw:node-id",
+                         get.find('{%s}filter' % kaloom_netconf.NC_NS).get('select'))
+
+    def test_config_queries(self):
+        self._reply(REPLY_TP)
+        self.vfabric.get_tp_by_annotation('compute-1')
+        self.assertTrue(self.vfabric._stream_netconf_cmd.call_args[0][0].operation.startswith(b'<get>'))
+
+        vfabric = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin', config_queries=['get_tp_by_annotation'])
+        vfabric._stream_netconf_cmd = stream_reply(REPLY_TP)
+        self.assertEqual({'name': 'compute-1', 'id': 'tp-7'}, vfabric.get_tp_by_annotation('compute-1'))
+        get_config = kaloom_netconf.parse_xml(vfabric._stream_netconf_cmd.call_args[0][0].to_bytes(1))[0]
+        self.assertEqual('{%s}get-config' % kaloom_netconf.NC_NS, get_config.tag)
+        self.assertEqual('{%s}running' % kaloom_netconf.NC_NS, get_config[0][0].tag)
+        self.assertRaises(ValueError, KaloomNetconf, '127.0.0.1', 830, 'admin', '', 'admin',
+                          config_queries=['get_schemas'])
+
+    def test_list_router_name_id_prefix(self):
+        self._reply(REPLY_ROUTERS)
+        self.assertEqual([('__OpenStack__router1', 'r-1'), ('user_router', 'r-2')],
+                         list(self.vfabric.list_router_name_id()))
+        self.assertEqual([('__OpenStack__router1', 'r-1')], list(self.vfabric.list_router_name_id('__OpenStack__')))
+
+    def test_get_l2_network_by_name(self):
+        self._reply(REPLY_L2_NETWORK)
+        self.assertEqual({'kaloom_knid': 1234},
+                         self.vfabric.get_l2_network_by_name('__OpenStack__net1'))
+
+    def _create_l2_network(self, session_class):
+        calls = []
+        session = Mock(spec=session_class)
+        def submit(req):
+            calls.append('submit')
+            reply = REPLY_OK if len(calls) == 1 else REPLY_L2_NETWORK
+            return Mock(result=Mock(side_effect=lambda: calls.append('result') or kaloom_netconf.parse_xml(reply)))
+        session.submit.side_effect = submit
+        with patch.object(self.vfabric.session_manager, 'connected', return_value=session):
+            self.assertEqual({'kaloom_knid': 1234},
+                             self.vfabric.create_l2_network('__OpenStack__net1', 'net1', 1))
+        return calls
+
+    def test_create_l2_network(self):
+        #pipelined on a session to vFabric
+        self.assertEqual(['submit', 'submit', 'result', 'result'], self._create_l2_network(KaloomNetconfSession))
+        #through the proxy, the get is sent once the edit is replied
+        self.assertEqual(['submit', 'result', 'submit', 'result'],
+                         self._create_l2_network(kaloom_netconf.KaloomNetconfProxySession))
+
+    def test_get_tp_by_annotation(self):
+        self._reply(REPLY_TP)
+        self.assertEqual({'name': 'compute-1', 'id': 'tp-7'},
+                         self.vfabric.get_tp_by_annotation('compute-1'))
+        self.assertIsNone(self.vfabric.get_tp_by_annotation('compute-2'))
+
+    def test_get_router_interface_info(self):
+        self._reply(REPLY_ROUTER_INTERFACE_INFO)
+        info = self.vfabric.get_router_interface_info('router1', '__OpenStack__net1')
+        self.assertEqual({'node_id': 'r-1', 'interface': 'net1', 'cidrs': ['192.168.1.1/24']}, info)
+
+        info = self.vfabric.get_router_interface_info('router1', '__OpenStack__net2')
+        self.assertEqual({'node_id': 'r-1', 'interface': None, 'cidrs': []}, info)
+
+    def test_create_router_error(self):
+        self._reply(REPLY_ERROR)
+        self.assertRaisesRegexp(ValueError, 'unique duplicate constraint',
+                                self.vfabric.create_router, 'router1')
+
+    def test_read_cache(self):
+        self._reply(REPLY_L2_NETWORK)
+        for i in range(3):
+            self.vfabric.get_l2_network_by_name('__OpenStack__net1')
+        self.assertEqual(1, self.vfabric._exec_netconf_cmd.call_count)
+        self.assertEqual({'entries': 1, 'hits': 2, 'misses': 1, 'evictions': 0}, self.vfabric.cache_stats())
+
+        #a write of the same network invalidates it, others stay cached.
+        self.vfabric.get_l2_network_by_name('__OpenStack__net2')
+        self._reply(REPLY_OK)
+        self.vfabric.delete_l2_network('__OpenStack__net1')
+        self.assertEqual(1, self.vfabric.cache_stats()['entries'])
+        self.assertEqual((True, {'kaloom_knid': 1234}),
+                         self.vfabric.cache.get(('l2_network_by_name', '__OpenStack__net2')))
+
+    def test_read_cache_not_found(self):
+        self._reply(REPLY_OK) #no router
+        self.assertIsNone(self.vfabric.get_router_id_by_name('router1'))
+        self.assertIsNone(self.vfabric.get_router_id_by_name('router1'))
+        self.assertEqual(2, self.vfabric._exec_netconf_cmd.call_count)
+
+    def test_concurrent_reads_single_flight(self):
+        self.vfabric.cache.ttl = 0
+        reply = event.Event()
+        self.vfabric._exec_netconf_cmd = Mock(side_effect=lambda req: reply.wait())
+        threads = [greenthread.spawn(self.vfabric.get_router_interface_info, 'router1', nw_name)
+                   for nw_name in ('__OpenStack__net1', '__OpenStack__net2', '__OpenStack__net1')]
+        greenthread.sleep(0)
+        reply.send(kaloom_netconf.parse_xml(REPLY_ROUTER_INTERFACE_INFO))
+        self.assertEqual(['net1', None, 'net1'], [thread.wait()['interface'] for thread in threads])
+        self.assertEqual(1, self.vfabric._exec_netconf_cmd.call_count)
+        self.assertEqual(2, self.vfabric.flight_stats()['shared'])
+
+    def test_batch_merges_edits(self):
+        self._reply(REPLY_OK)
+        with self.vfabric.batch(atomic=False) as batch:
+            batch.delete_l2_network('__OpenStack__net1')
+            batch.detach_tp_from_l2_network('__OpenStack__net3', 'tp-7')
+            batch.detach_tp_from_l2_network('__OpenStack__net3', 'tp-8')
+        self.assertEqual(1, self.vfabric._exec_netconf_cmd.call_count)
+        req = kaloom_netconf.parse_xml(self.vfabric._exec_netconf_cmd.call_args[0][0].to_bytes(1))
+        edit_config = req[0]
+        self.assertEqual('continue-on-error',
+                         edit_config.findtext('{%s}error-option' % kaloom_netconf.NC_NS))
+        #one network, holding the removed node, and the node with both removed tps.
+        networks = edit_config.findall('{%s}config/{%s}networks' % (kaloom_netconf.NC_NS, kaloom_netconf.NW_NS))
+        self.assertEqual(1, len(networks))
+        self.assertEqual(1, len(networks[0].findall(kaloom_netconf.TAG_NETWORK)))
+        self.assertEqual(['__OpenStack__net1', '__OpenStack__net3'], kaloom_netconf.XPATH_NODE_ID(req))
+        self.assertEqual(2, len(kaloom_netconf.XPATH_TP(req)))
+        self.assertEqual(0, len(batch))
+
+    def test_batch_error_attribution(self):
+        self._reply(REPLY_BATCH_ERRORS)
+        batch = self.vfabric.batch(atomic=False)
+        batch.delete_l2_network('__OpenStack__net1')
+        batch.delete_l2_network('__OpenStack__net2')
+        batch.detach_tp_from_l2_network('__OpenStack__net3', 'tp-7')
+        with patch.object(kaloom_netconf.LOG, 'warning'):
+            e = self.assertRaises(kaloom_netconf.KaloomNetconfBatchError, batch.send)
+        self.assertEqual([(('delete_l2_network', '__OpenStack__net2'), 'node not found'),
+                          (('detach_tp_from_l2_network', '__OpenStack__net3', 'tp-7'), 'tp in use')],
+                         e.errors)
+        self.assertEqual(set([('delete_l2_network', '__OpenStack__net2'),
+                              ('detach_tp_from_l2_network', '__OpenStack__net3', 'tp-7')]), e.failed)
+
+    def test_batch_unattributed_error(self):
+        self._reply(REPLY_ERROR)
+        self.vfabric.session_manager = Mock()
+        self.vfabric.session_manager.capabilities.return_value = frozenset([kaloom_netconf.CAP_ROLLBACK_ON_ERROR])
+        batch = self.vfabric.batch()
+        route = batch.add_ip_static_route({'ip_version': 4, 'router_node_id': 'r-1',
+                                           'destination_prefix': '10.0.0.0/24', 'next_hop_address': '10.0.1.1'})
+        with patch.object(kaloom_netconf.LOG, 'warning'):
+            e = self.assertRaises(kaloom_netconf.KaloomNetconfBatchError, batch.send)
+        self.assertIn(b'<error-option>rollback-on-error</error-option>', self.vfabric._exec_netconf_cmd.call_args[0][0].operation)
+        self.assertEqual([(None, 'unique duplicate constraint')], e.errors)
+        self.assertEqual(set([route]), e.failed)
+
+
+class KaloomNetconfTransactionTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfTransactionTestCase, self).setUp()
+        self.vfabric = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin')
+        self.vfabric.session_manager = Mock(proxy_socket=None)
+        self.session = self.vfabric.session_manager.connected.return_value
+        self.session.rpc.return_value = kaloom_netconf.parse_xml(REPLY_OK)
+        self.vfabric._exec_netconf_cmd = Mock(return_value=kaloom_netconf.parse_xml(REPLY_OK))
+
+    def _capabilities(self, *capabilities):
+        self.vfabric.session_manager.capabilities.return_value = frozenset(capabilities)
+
+    def _sent(self):
+        """first element of each rpc sent on the pinned session, e.g. lock, edit-config."""
+        ops = []
+        for call in self.session.rpc.call_args_list:
+            op = kaloom_netconf.parse_xml(call[0][0].to_bytes(1))[0]
+            target = op.find('{%s}target' % kaloom_netconf.NC_NS)
+            name = op.tag.split('}')[1]
+            ops.append(name if target is None else '%s %s' % (name, target[0].tag.split('}')[1]))
+        return ops
+
+    def test_per_greenthread(self):
+        self._capabilities(kaloom_netconf.CAP_CANDIDATE)
+        with self.vfabric.transaction():
+            #an edit of another greenthread is not part of the transaction
+            greenthread.spawn(self.vfabric.delete_l2_network, '__OpenStack__net2').wait()
+            self.assertIsNotNone(self.vfabric.current_transaction())
+        self.assertEqual(1, self.vfabric._exec_netconf_cmd.call_count)
+        #nothing staged
+        self.assertEqual(['lock running', 'lock candidate', 'discard-changes', 'unlock candidate', 'unlock running'],
+                         self._sent())
+
+    def test_commit(self):
+        self._capabilities(kaloom_netconf.CAP_CANDIDATE)
+        with self.vfabric.transaction():
+            self.vfabric.delete_l2_network('__OpenStack__net1')
+            self.vfabric.detach_tp_from_l2_network('__OpenStack__net2', 'tp-7')
+        self.assertEqual(['lock running', 'lock candidate', 'discard-changes', 'edit-config candidate',
+                          'edit-config candidate', 'commit', 'unlock candidate', 'unlock running'], self._sent())
+        self.vfabric._exec_netconf_cmd.assert_not_called()
+        self.assertIsNone(self.vfabric.current_transaction())
+
+    def test_discard_on_error(self):
+        self._capabilities(kaloom_netconf.CAP_CANDIDATE)
+        def fail():
+            with self.vfabric.transaction():
+                self.vfabric.delete_l2_network('__OpenStack__net1')
+                raise ValueError('Boom!')
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(['lock running', 'lock candidate', 'discard-changes', 'edit-config candidate',
+                          'discard-changes', 'unlock candidate', 'unlock running'], self._sent())
+
+    def test_lock_denied_retried(self):
+        self._capabilities(kaloom_netconf.CAP_CANDIDATE)
+        denied = kaloom_netconf.parse_xml(REPLY_ERROR.replace(b'data-exists', b'lock-denied'))
+        ok = kaloom_netconf.parse_xml(REPLY_OK)
+        self.session.rpc.side_effect = [denied, ok, ok, ok, ok, ok]
+        with patch.object(kaloom_netconf.greenthread, 'sleep') as sleep:
+            with self.vfabric.transaction():
+                pass
+        sleep.assert_called_once_with(kaloom_netconf.LOCK_RETRY_SEC)
+        #nothing staged, nothing to commit.
+        self.assertEqual(['lock running', 'lock running', 'lock candidate', 'discard-changes',
+                          'unlock candidate', 'unlock running'], self._sent())
+
+    def test_running_without_candidate(self):
+        self._capabilities()
+        with self.vfabric.transaction():
+            self.vfabric.delete_l2_network('__OpenStack__net1')
+        self.session.rpc.assert_not_called()
+        self.assertIn(b'<target><running/></target>', self.vfabric._exec_netconf_cmd.call_args[0][0].operation)
+
+
+class KaloomNetconfSessionTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfSessionTestCase, self).setUp()
+        with patch.object(kaloom_netconf.paramiko, 'SSHClient'):
+            self.session = KaloomNetconfSession('127.0.0.1', 830, 'admin', '', 'admin')
+        transport = self.session.client.get_transport.return_value
+        transport.is_active.return_value = False
+        self.chan = transport.open_session.return_value
+        self.addCleanup(self.session.stop)
+
+    def _init_session(self, server_hello):
+        self.chan.recv.side_effect = [server_hello + netconf_framing.TERMINATOR]
+        self.session.init()
+        self.assertEqual('42', self.session.netconf_session_id)
+        sent = self.chan.sendall.call_args[0][0]
+        self.assertTrue(sent.endswith(netconf_framing.TERMINATOR), "client hello must use end-of-message framing")
+        self.assertIn(netconf_framing.BASE_1_1, sent.decode('utf-8'))
+
+    def test_negotiate_chunked_framing(self):
+        self._init_session(SERVER_HELLO % b'<capability>urn:ietf:params:netconf:base:1.1</capability>')
+        self.assertIsInstance(self.session.framing, netconf_framing.ChunkedDecoder)
+        self.assertIs(self.session.framing, self.session.receiver.decoder)
+
+    def test_fallback_to_eom_framing(self):
+        self._init_session(SERVER_HELLO % b'')
+        self.assertIsInstance(self.session.framing, netconf_framing.EOMDecoder)
+        self.assertIs(self.session.framing, self.session.receiver.decoder)
+
+    def test_reconnect_with_new_session_id(self):
+        self.session.on_reconnect = Mock()
+        self._init_session(SERVER_HELLO % b'')
+        #first connect
+        self.assertFalse(self.session.on_reconnect.called)
+        self._init_session(SERVER_HELLO % b'')
+        #same vFabric session-id
+        self.assertFalse(self.session.on_reconnect.called)
+        self.chan.recv.side_effect = [SERVER_HELLO.replace(b'>42<', b'>43<') % b'' + netconf_framing.TERMINATOR]
+        self.session.init()
+        self.session.on_reconnect.assert_called_once_with(self.session)
+
+    def test_concurrent_init_connects_once(self):
+        connected = []
+        def connect():
+            greenthread.sleep(0) #others call init meanwhile
+            connected.append(True)
+        self.session._init = Mock(side_effect=connect)
+        self.session.is_healthy = lambda: bool(connected)
+        threads = [greenthread.spawn(self.session.init) for i in range(3)]
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(1, self.session._init.call_count)
+
+    def test_private_key_loaded_once(self):
+        with patch.dict(kaloom_netconf._private_keys, clear=True), \
+                patch.object(kaloom_netconf.os.path, 'getmtime', return_value=1.0) as getmtime, \
+                patch.object(kaloom_netconf.paramiko.RSAKey, 'from_private_key_file') as from_file:
+            for reconnect in range(2):
+                kaloom_netconf.load_private_key('/etc/neutron/kaloom_key')
+            self.assertEqual(1, from_file.call_count)
+            #replaced key file
+            getmtime.return_value = 2.0
+            kaloom_netconf.load_private_key('/etc/neutron/kaloom_key')
+            self.assertEqual(2, from_file.call_count)
+
+    def test_failed_probe_closes_session(self):
+        self.session.submit = Mock()
+        self.session.submit.return_value.result.side_effect = ValueError('timeout')
+        self.session.receiver.stop = Mock()
+        self.assertFalse(self.session.probe())
+        self.session.receiver.stop.assert_called_once_with(True)
+
+
+class KaloomNetconfSessionManagerTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfSessionManagerTestCase, self).setUp()
+        managers = patch.dict(KaloomNetconfSessionManager._managers, clear=True)
+        managers.start()
+        self.addCleanup(managers.stop)
+
+    def _session(self, healthy, active):
+        session = Mock(active=active)
+        session.is_healthy.return_value = healthy
+        session.sender.queued.return_value = 0
+        return session
+
+    def test_manager_shared_per_vfabric(self):
+        vfabric1 = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin', pool_size=2)
+        vfabric2 = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin', pool_size=3)
+        vfabric3 = KaloomNetconf('127.0.0.2', 830, 'admin', '', 'admin', pool_size=2)
+        self.assertIs(vfabric1.session_manager, vfabric2.session_manager)
+        self.assertIsNot(vfabric1.session_manager, vfabric3.session_manager)
+        self.assertEqual(3, len(vfabric1.session_manager.sessions))
+
+    def test_select(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=3)
+        busy, idle, unconnected = self._session(True, 2), self._session(True, 0), self._session(False, 0)
+        manager.sessions = [busy, unconnected, idle]
+        self.assertIs(idle, manager.select())
+
+        idle.active = 3
+        self.assertIs(unconnected, manager.select())
+
+        manager.sessions = [idle, busy]
+        self.assertIs(busy, manager.select())
+
+    def test_rpc_falls_back_to_open_session(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=2)
+        busy, unconnected = self._session(True, 1), self._session(False, 0)
+        unconnected.init.side_effect = ValueError('connect failed')
+        manager.sessions = [busy, unconnected]
+        manager.rpc('<rpc/>')
+        busy.rpc.assert_called_once_with('<rpc/>')
+        self.assertEqual(0, unconnected.active)
+
+        manager.sessions = [unconnected]
+        self.assertRaises(ValueError, manager.rpc, '<rpc/>')
+
+    def test_circuit_breaker(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=1,
+                                                  breaker_threshold=2, breaker_reset_timeout=60)
+        unconnected = self._session(False, 0)
+        unconnected.init.side_effect = ValueError('connect failed')
+        manager.sessions = [unconnected]
+        with patch.object(netconf_breaker.LOG, 'warning'):
+            for i in range(2):
+                self.assertRaisesRegexp(ValueError, 'connect failed', manager.rpc, '<rpc/>')
+        #fails at once, without connecting.
+        self.assertRaises(netconf_breaker.KaloomNetconfCircuitOpen, manager.rpc, '<rpc/>')
+        self.assertEqual(2, unconnected.init.call_count)
+        manager.breaker._prober.kill()
+
+    def test_ssh_backend(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '/etc/kaloom/id_rsa', None,
+                                                  ssh_backend=kaloom_netconf.SSH_BACKEND_OPENSSH)
+        self.assertIsInstance(manager._new_session(), kaloom_netconf.KaloomNetconfOpenSSHSession)
+        self.assertRaisesRegexp(ValueError, 'unknown netconf ssh backend', manager.configure,
+                                '/etc/kaloom/id_rsa', None, 90, 1024, 1, ssh_backend='libssh2')
+
+    def test_reconnect_callbacks(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=2)
+        self.assertEqual(manager._on_reconnect, manager._new_session().on_reconnect)
+        callback, failing = Mock(), Mock(side_effect=ValueError('vFabric unavailable'))
+        manager.subscribe(failing)
+        manager.subscribe(callback)
+        manager.subscribe(callback)
+        with patch.object(kaloom_netconf, 'RECONNECT_DELAY_SEC', 0.01), patch.object(kaloom_netconf.LOG, 'error'):
+            #sessions of the pool reconnecting together: callbacks run once.
+            manager._on_reconnect(manager.sessions)
+            manager._on_reconnect(manager.sessions)
+            greenthread.sleep(0.05)
+            self.assertEqual(1, callback.call_count)
+            self.assertEqual(1, failing.call_count)
+            manager.unsubscribe(callback)
+            manager._on_reconnect(manager.sessions)
+            greenthread.sleep(0.05)
+        self.assertEqual(1, callback.call_count)
+        self.assertEqual(2, failing.call_count)
+
+    def test_standby_promoted(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=1,
+                                                  standby=1, health_check_interval=10)
+        dropped, standby = self._session(False, 0), self._session(True, 0)
+        manager.sessions, manager.standby = [dropped], [standby]
+        self.assertIs(standby, manager.select())
+        self.assertEqual([standby], manager.sessions)
+        #reconnected by the health checker, as the next standby session.
+        self.assertEqual([dropped], manager.standby)
+
+    def test_health_check(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=2,
+                                                  standby=1, health_check_interval=10)
+        idle, busy, unconnected = self._session(True, 0), self._session(True, 1), self._session(False, 0)
+        unconnected.init.side_effect = ValueError('connect failed')
+        manager.sessions, manager.standby = [idle, busy], [unconnected]
+        manager.check()
+        idle.probe.assert_called_once_with()
+        busy.probe.assert_not_called()
+        unconnected.init.assert_called_once_with()
+
+    def test_no_connect_latency_with_health_checker(self):
+        manager = KaloomNetconfSessionManager.get('127.0.0.1', 830, 'admin', '', 'admin', pool_size=2,
+                                                  health_check_interval=10)
+        busy, unconnected = self._session(True, 1), self._session(False, 0)
+        manager.sessions = [unconnected, busy]
+        manager._checker = Mock()
+        self.assertIs(busy, manager.select())
+        self.assertEqual([], manager.standby)
+
+
+class FakeChan(object):
+    def __init__(self):
+        self.received = queue.LightQueue()
+
+    def recv(self, size):
+        return self.received.get()
+
+    def close(self):
+        self.received.put(b'')
+
+
+class KaloomNetconfRecvTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfRecvTestCase, self).setUp()
+        self.client = Mock()
+        self.chan = FakeChan()
+        self.receiver = KaloomNetconfRecv(self.client, None)
+        self.receiver.update_chan(self.chan)
+        self.addCleanup(self.receiver.stop, graceful=False)
+
+    def test_receiver_persists_across_requests(self):
+        thread = self.receiver._thread
+        for msgid in ('1', '2'):
+            evt = event.Event()
+            self.receiver.add_callback_event(msgid, evt)
+            self.assertEqual({'running': True, 'parked': False, 'in_flight': 1}, self.receiver.stats())
+            self.chan.received.put(REPLY_OK.replace(b'message-id="1"', b'message-id="%s"' % msgid.encode()) +
+                                   netconf_framing.TERMINATOR)
+            self.assertEqual(msgid, evt.wait().get('message-id'))
+            self.assertEqual({'running': True, 'parked': True, 'in_flight': 0}, self.receiver.stats())
+        self.assertIs(thread, self.receiver._thread)
+
+    def test_channel_closed(self):
+        evt = event.Event()
+        self.receiver.add_callback_event('1', evt)
+        self.chan.received.put(b'')
+        self.assertRaises(ValueError, evt.wait)
+        self.receiver.wait()
+        self.assertEqual({'running': False, 'parked': False, 'in_flight': 0}, self.receiver.stats())
+        self.client.close.assert_called_once_with()
+        self.assertRaises(ValueError, self.receiver.add_callback_event, '2', event.Event())
+
+
+class KaloomNetconfFutureTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfFutureTestCase, self).setUp()
+        with patch.object(kaloom_netconf.paramiko, 'SSHClient'):
+            self.session = KaloomNetconfSession('127.0.0.1', 830, 'admin', '', 'admin')
+        self.session.init = Mock()
+        self.session.chan = Mock()
+        self.fake_chan = FakeChan()
+        self.session.receiver.update_chan(self.fake_chan)
+        self.session.sender.update_chan(self.session.chan)
+        self.addCleanup(self.session.stop, graceful=False)
+
+    def _reply(self, msgid):
+        self.fake_chan.received.put(REPLY_OK.replace(b'message-id="1"', b'message-id="%d"' % msgid) +
+                                    netconf_framing.TERMINATOR)
+
+    def test_pipelined_rpcs(self):
+        futures = [self.session.submit(netconf_rpc.Rpc(b'<get/>')) for i in range(3)]
+        greenthread.sleep(0)
+        #frames queued back-to-back go in a single send, in msgid order.
+        self.assertEqual(1, self.session.chan.sendall.call_count)
+        sent = self.session.chan.sendall.call_args[0][0].split(netconf_framing.TERMINATOR)
+        self.assertEqual(['1', '2', '3', None], [kaloom_netconf.parse_xml(frame).get('message-id') if frame else None
+                                                 for frame in sent])
+        self.assertEqual({'queued': 0, 'sends': 1, 'frames_sent': 3},
+                         dict((key, value) for key, value in self.session.stats().items()
+                              if key in ('queued', 'sends', 'frames_sent')))
+        self.assertEqual(3, self.session.active)
+        for msgid in (3, 1, 2):
+            self._reply(msgid)
+        replies = kaloom_netconf.gather(futures, timeout=5)
+        self.assertEqual(['1', '2', '3'], [reply.get('message-id') for reply in replies])
+        self.assertEqual(0, self.session.active)
+
+    def test_send_failure(self):
+        self.session.chan.sendall.side_effect = socket.error('broken pipe')
+        future = self.session.submit(netconf_rpc.Rpc(b'<get/>'))
+        with patch.object(kaloom_netconf.LOG, 'error'):
+            self.assertRaisesRegexp(ValueError, 'netconf send failed: broken pipe', future.result, 5)
+        self.assertEqual(0, self.session.active)
+        self.assertFalse(self.session.receiver.is_running())
+
+    def test_window(self):
+        self.session.scheduler.resize(1)
+        first = self.session.submit(netconf_rpc.Rpc(b'<get/>'))
+        def submit(name):
+            with netconf_scheduler.priority(name):
+                return self.session.submit(netconf_rpc.Rpc(b'<get/>'))
+        background = greenthread.spawn(submit, netconf_scheduler.BACKGROUND)
+        interactive = greenthread.spawn(submit, netconf_scheduler.INTERACTIVE)
+        greenthread.sleep(0)
+        self.assertEqual(3, self.session.active)
+        self._reply(1)
+        first.result(5)
+        #sent ahead of the background rpc waiting before it.
+        self.assertEqual(2, interactive.wait().msgid)
+        self._reply(2)
+        self.assertEqual(3, background.wait().msgid)
+        self._reply(3)
+        background.wait().result(5)
+        self.assertEqual(0, self.session.scheduler.in_flight)
+
+    def test_caller_deadline(self):
+        with netconf_scheduler.deadline(0.01):
+            future = self.session.submit(netconf_rpc.Rpc(b'<get/>'))
+            #not a failure of vFabric, for the circuit breaker
+            with patch.object(kaloom_netconf.LOG, 'error'), \
+                    patch.object(self.session.breaker, 'failure') as failure:
+                self.assertRaisesRegexp(ValueError, 'timeout on netconf reply', future.result)
+            failure.assert_not_called()
+            #not sent past the deadline.
+            self.assertRaisesRegexp(ValueError, 'deadline exceeded', self.session.submit, netconf_rpc.Rpc(b'<get/>'))
+        self.assertEqual(0, self.session.active)
+        self.assertEqual({}, self.session.receiver.msg_events)
+
+    def test_gather_deadline(self):
+        futures = [self.session.submit(netconf_rpc.Rpc(b'<get/>')) for i in range(2)]
+        self._reply(1)
+        self.assertRaisesRegexp(ValueError, 'timeout on 1 of 2', kaloom_netconf.gather, futures, timeout=0.01)
+        self.assertEqual({}, self.session.receiver.msg_events)
+        self.assertEqual(0, self.session.active)
+
+    def test_gather_exceptions(self):
+        futures = [self.session.submit(netconf_rpc.Rpc(b'<get/>')).then(self._fail),
+                   self.session.submit(netconf_rpc.Rpc(b'<get/>'))]
+        self._reply(1)
+        self._reply(2)
+        results = kaloom_netconf.gather(futures, return_exceptions=True)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual('2', results[1].get('message-id'))
+        self.assertRaisesRegexp(ValueError, 'rejected', kaloom_netconf.gather, futures)
+
+    def _fail(self, reply):
+        raise ValueError('rejected')
+
+    def test_stream(self):
+        siblings = []
+        def node_id(node):
+            #earlier nodes were dropped from the tree already.
+            siblings.append(len(node.getparent()))
+            return node.findtext(kaloom_netconf.TAG_NODE_ID)
+        stream = self.session.stream(netconf_rpc.Rpc(b'<get/>'), kaloom_netconf.TAG_NODE, node_id)
+        reply = REPLY_L2_NETWORK_NAMES.replace(b'message-id="3"', b'message-id="1"') + netconf_framing.TERMINATOR
+        for i in range(0, len(reply), 16): #as received from the chan
+            self.fake_chan.received.put(reply[i:i + 16])
+        self.assertEqual(['__OpenStack__net1', 'user_net', '__OpenStack__net2'], list(stream))
+        #the node, the previous one (or network-id), and the next one if already parsed.
+        self.assertLessEqual(max(siblings), 3)
+        self.assertEqual(0, self.session.active)
+
+    def test_stream_rpc_error(self):
+        stream = self.session.stream(netconf_rpc.Rpc(b'<get/>'), kaloom_netconf.TAG_NODE, Mock())
+        self.fake_chan.received.put(REPLY_ERROR.replace(b'message-id="2"', b'message-id="1"') + netconf_framing.TERMINATOR)
+        self.assertRaisesRegexp(ValueError, 'unique duplicate constraint', list, stream)
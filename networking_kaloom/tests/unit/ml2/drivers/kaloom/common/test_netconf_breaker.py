@@ -0,0 +1,76 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from eventlet import event
+from eventlet import greenthread
+from mock import Mock, patch
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_breaker
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_breaker import KaloomNetconfBreaker
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_breaker import KaloomNetconfCircuitOpen
+
+
+class KaloomNetconfBreakerTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfBreakerTestCase, self).setUp()
+        self.probe = Mock(return_value=False)
+        self.breaker = KaloomNetconfBreaker(threshold=2, reset_timeout=0.01, probe=self.probe, name='vfabric')
+        for method in ('info', 'warning'):
+            patcher = patch.object(netconf_breaker.LOG, method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _future(self, exc=None):
+        future = event.Event()
+        future.send(None if exc else '<rpc-reply/>', exc)
+        return future
+
+    def test_opens_on_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.record(self._future())
+        error = ValueError('receiver thread terminated')
+        self.breaker.record(self._future(error), error)
+        self.breaker.check()
+        #cancelled by their callers: neither a success nor a failure
+        for reason in ('cancelled', netconf_breaker.DEADLINE_EXCEEDED):
+            self.breaker.record(event.Event(), reason)
+        self.breaker.check()
+        self.breaker.record(event.Event(), netconf_breaker.TIMEOUT)
+        self.assertEqual({'circuit': netconf_breaker.OPEN, 'failures': 2}, self.breaker.stats())
+        self.assertRaisesRegexp(KaloomNetconfCircuitOpen, 'vFabric vfabric unavailable', self.breaker.check)
+        #replies of rpcs in flight do not close it.
+        self.breaker.success()
+        self.assertRaises(KaloomNetconfCircuitOpen, self.breaker.check)
+
+    def test_probed_in_background(self):
+        patcher = patch.object(netconf_breaker.METRICS, 'incr')
+        incr = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker.failure()
+        self.breaker.failure()
+        greenthread.sleep(0.05)
+        #failed probes keep it open, without callers as a trial.
+        self.assertGreater(self.probe.call_count, 1)
+        incr.assert_called_once_with('circuit_opens')
+        self.assertRaises(KaloomNetconfCircuitOpen, self.breaker.check)
+        self.probe.return_value = True
+        greenthread.sleep(0.05)
+        self.breaker.check()
+        self.assertEqual({'circuit': netconf_breaker.CLOSED, 'failures': 0}, self.breaker.stats())
+        self.assertIsNone(self.breaker._prober)
+
+    def test_disabled(self):
+        breaker = KaloomNetconfBreaker(threshold=0)
+        for i in range(10):
+            breaker.failure()
+        breaker.check()
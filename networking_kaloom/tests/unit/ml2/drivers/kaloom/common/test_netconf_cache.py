@@ -0,0 +1,119 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from eventlet import event
+from eventlet import greenthread
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_cache import KaloomNetconfCache
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_cache import KaloomNetconfFlights
+
+
+class KaloomNetconfCacheTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfCacheTestCase, self).setUp()
+        self.now = 1000.0
+        self.cache = KaloomNetconfCache(ttl=30, size=2, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.cache.put(('router_id_by_name', 'r1'), 'id-1', self.cache.generation)
+        self.assertEqual((True, 'id-1'), self.cache.get(('router_id_by_name', 'r1')))
+        self.now += 31
+        self.assertEqual((False, None), self.cache.get(('router_id_by_name', 'r1')))
+        self.assertEqual({'entries': 0, 'hits': 1, 'misses': 1, 'evictions': 0}, self.cache.stats())
+
+    def test_lru_eviction(self):
+        for name in ('r1', 'r2'):
+            self.cache.put(('router_id_by_name', name), name, self.cache.generation)
+        self.cache.get(('router_id_by_name', 'r1')) #r2 becomes least recently used
+        self.cache.put(('router_id_by_name', 'r3'), 'r3', self.cache.generation)
+        self.assertEqual((False, None), self.cache.get(('router_id_by_name', 'r2')))
+        self.assertEqual((True, 'r1'), self.cache.get(('router_id_by_name', 'r1')))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_invalidation_drops_concurrent_read(self):
+        generation = self.cache.generation #lookup starts
+        self.cache.invalidate(('l2_network_by_name', 'net1')) #write completes meanwhile
+        self.cache.put(('l2_network_by_name', 'net1'), {'kaloom_knid': 1}, generation)
+        self.assertEqual((False, None), self.cache.get(('l2_network_by_name', 'net1')))
+
+    def test_invalidate_value(self):
+        self.cache.put(('router_id_by_name', 'r1'), 'id-1', self.cache.generation)
+        self.cache.put(('router_id_by_name', 'r2'), 'id-2', self.cache.generation)
+        self.cache.invalidate_value('router_id_by_name', 'id-1')
+        self.assertEqual((False, None), self.cache.get(('router_id_by_name', 'r1')))
+        self.assertEqual((True, 'id-2'), self.cache.get(('router_id_by_name', 'r2')))
+
+    def test_disabled(self):
+        cache = KaloomNetconfCache(ttl=0)
+        cache.put(('router_id_by_name', 'r1'), 'id-1', cache.generation)
+        self.assertEqual((False, None), cache.get(('router_id_by_name', 'r1')))
+
+
+class KaloomNetconfFlightsTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfFlightsTestCase, self).setUp()
+        self.flights = KaloomNetconfFlights()
+        self.reply = event.Event()
+        self.lookups = 0
+
+    def lookup(self):
+        self.lookups += 1
+        return self.reply.wait()
+
+    def test_concurrent_lookups_share_flight(self):
+        threads = [greenthread.spawn(self.flights.do, ('tp_by_annotation', 'compute-1'), self.lookup)
+                   for i in range(5)]
+        greenthread.sleep(0)
+        self.reply.send({'name': 'compute-1', 'id': 'tp-7'})
+        self.assertEqual([{'name': 'compute-1', 'id': 'tp-7'}] * 5, [thread.wait() for thread in threads])
+        self.assertEqual(1, self.lookups)
+        self.assertEqual({'in_flight': 0, 'shared': 4}, self.flights.stats())
+
+    def test_error_shared(self):
+        def do():
+            try:
+                return self.flights.do(('router_node', 'r1'), self.lookup)
+            except ValueError as e:
+                return e
+        threads = [greenthread.spawn(do) for i in range(2)]
+        greenthread.sleep(0)
+        self.reply.send_exception(ValueError('timeout'))
+        self.assertEqual(['timeout', 'timeout'], [str(thread.wait()) for thread in threads])
+        self.assertEqual(1, self.lookups)
+
+    def test_lookup_after_write_not_shared(self):
+        first = greenthread.spawn(self.flights.do, ('router_node', 'r1'), self.lookup)
+        greenthread.sleep(0)
+        self.flights.invalidate() #write completes while the lookup is in flight
+        second = greenthread.spawn(self.flights.do, ('router_node', 'r1'), self.lookup)
+        greenthread.sleep(0)
+        self.reply.send('r-1')
+        self.assertEqual(('r-1', 'r-1'), (first.wait(), second.wait()))
+        self.assertEqual(2, self.lookups)
+
+    def test_joiner_deadline(self):
+        first = greenthread.spawn(self.flights.do, ('router_node', 'r1'), self.lookup)
+        greenthread.sleep(0)
+        def join():
+            with netconf_scheduler.deadline(0.01):
+                try:
+                    return self.flights.do(('router_node', 'r1'), self.lookup)
+                except ValueError as e:
+                    return e
+        #the flight outlasts the deadline of the joiner, which gives up on its own.
+        self.assertIn('deadline exceeded', str(greenthread.spawn(join).wait()))
+        self.reply.send('r-1')
+        self.assertEqual('r-1', first.wait())
+        self.assertEqual(1, self.lookups)
+        self.assertEqual({'in_flight': 0, 'shared': 1}, self.flights.stats())
@@ -0,0 +1,110 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+
+MSG1 = b'<rpc-reply message-id="1"><ok/></rpc-reply>'
+MSG2 = b'<rpc-reply message-id="2"><data/></rpc-reply>'
+
+
+def stream_frames(decoder, data, chunk_size):
+    """frames put together from the pieces of decoder.feed_stream, and the largest piece."""
+    frames, frame, largest = [], b'', 0
+    for i in range(0, len(data), chunk_size):
+        for piece, end in decoder.feed_stream(data[i:i + chunk_size]):
+            largest = max(largest, len(piece))
+            frame += piece
+            if end:
+                frames.append(frame)
+                frame = b''
+    return frames, largest
+
+
+class EOMDecoderTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(EOMDecoderTestCase, self).setUp()
+        self.decoder = netconf_framing.EOMDecoder()
+
+    def _feed(self, data, chunk_size):
+        frames = []
+        for i in range(0, len(data), chunk_size):
+            frames.extend(f.tobytes() for f in self.decoder.feed(data[i:i + chunk_size]))
+        return frames
+
+    def test_multiple_frames_in_one_chunk(self):
+        stream = MSG1 + netconf_framing.TERMINATOR + MSG2 + netconf_framing.TERMINATOR + b'<rpc'
+        self.assertEqual([MSG1, MSG2], self._feed(stream, len(stream)))
+        self.assertEqual(4, self.decoder.pending())
+
+    def test_terminator_split_across_chunks(self):
+        stream = MSG1 + netconf_framing.TERMINATOR + MSG2 + netconf_framing.TERMINATOR
+        for chunk_size in range(1, len(netconf_framing.TERMINATOR) + 2):
+            self.decoder.reset()
+            self.assertEqual([MSG1, MSG2], self._feed(stream, chunk_size),
+                             "failed with chunk size %d" % chunk_size)
+            self.assertEqual(0, self.decoder.pending())
+
+    def test_frames_survive_next_feed(self):
+        frames = self.decoder.feed(MSG1 + netconf_framing.TERMINATOR + b'<rp')
+        self.decoder.feed(b'c-reply/>' + netconf_framing.TERMINATOR)
+        self.assertEqual(MSG1, frames[0].tobytes())
+
+    def test_feed_stream(self):
+        stream = MSG1 + netconf_framing.TERMINATOR + MSG2 + netconf_framing.TERMINATOR
+        for chunk_size in range(1, len(netconf_framing.TERMINATOR) + 2):
+            self.decoder.reset()
+            frames, largest = stream_frames(self.decoder, stream, chunk_size)
+            self.assertEqual([MSG1, MSG2], frames, "failed with chunk size %d" % chunk_size)
+            #a frame is handed out as it is received, never buffered whole.
+            self.assertLessEqual(largest, chunk_size + len(netconf_framing.TERMINATOR) - 1)
+            self.assertEqual(0, self.decoder.pending())
+
+
+class ChunkedDecoderTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(ChunkedDecoderTestCase, self).setUp()
+        self.decoder = netconf_framing.ChunkedDecoder()
+
+    def _feed(self, data, chunk_size):
+        frames = []
+        for i in range(0, len(data), chunk_size):
+            frames.extend(netconf_framing.frame_bytes(f) for f in self.decoder.feed(data[i:i + chunk_size]))
+        return frames
+
+    def test_encode_decode(self):
+        stream = self.decoder.encode(MSG1) + self.decoder.encode(MSG2)
+        self.assertEqual(b'\n#%d\n' % len(MSG1) + MSG1 + b'\n##\n', self.decoder.encode(MSG1))
+        self.assertEqual(self.decoder.encode(MSG1), b''.join(self.decoder.encode_parts([MSG1[:5], MSG1[5:]])))
+        for chunk_size in (1, 3, 7, len(stream)):
+            self.decoder.reset()
+            self.assertEqual([MSG1, MSG2], self._feed(stream, chunk_size),
+                             "failed with chunk size %d" % chunk_size)
+            self.assertEqual(0, self.decoder.pending())
+
+    def test_multiple_chunks_in_a_frame(self):
+        stream = b'\n#4\n<rpc\n#17\n message-id="1"/>\n##\n'
+        self.assertEqual([b'<rpc message-id="1"/>'], self._feed(stream, 5))
+
+    def test_feed_stream(self):
+        stream = self.decoder.encode(MSG1) + b'\n#4\n<rpc\n#17\n message-id="1"/>\n##\n'
+        for chunk_size in (1, 3, 7, len(stream)):
+            self.decoder.reset()
+            frames, largest = stream_frames(self.decoder, stream, chunk_size)
+            self.assertEqual([MSG1, b'<rpc message-id="1"/>'], frames, "failed with chunk size %d" % chunk_size)
+            self.assertLessEqual(largest, chunk_size)
+
+    def test_invalid_chunk_header(self):
+        self.assertRaises(ValueError, self.decoder.feed, b'<rpc-reply/>]]>]]>')
+        self.decoder.reset()
+        self.assertRaises(ValueError, self.decoder.feed, b'\n#0\n\n##\n')
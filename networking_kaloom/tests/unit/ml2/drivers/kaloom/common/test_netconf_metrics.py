@@ -0,0 +1,109 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_metrics
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconf
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_metrics import KaloomNetconfMetrics
+
+REPLY_OK = b'<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1"><ok/></rpc-reply>'
+
+
+class KaloomNetconfMetricsTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfMetricsTestCase, self).setUp()
+        self.metrics = KaloomNetconfMetrics()
+
+    def test_histogram_buckets(self):
+        self.metrics.observe('attach_tp_to_l2_network', 0.004)
+        self.metrics.observe('attach_tp_to_l2_network', 0.2)
+        self.metrics.observe('attach_tp_to_l2_network', 100, error=True)
+        text = self.metrics.prometheus_text()
+        self.assertIn('kaloom_netconf_op_latency_seconds_bucket{op="attach_tp_to_l2_network",le="0.005"} 1', text)
+        self.assertIn('kaloom_netconf_op_latency_seconds_bucket{op="attach_tp_to_l2_network",le="0.25"} 2', text)
+        self.assertIn('kaloom_netconf_op_latency_seconds_bucket{op="attach_tp_to_l2_network",le="+Inf"} 3', text)
+        self.assertIn('kaloom_netconf_op_latency_seconds_count{op="attach_tp_to_l2_network"} 3', text)
+        self.assertIn('kaloom_netconf_op_errors_total{op="attach_tp_to_l2_network"} 1', text)
+
+    def test_timed(self):
+        @self.metrics.timed('delete_router')
+        def delete_router(fail):
+            if fail:
+                raise ValueError('rpc-error')
+
+        delete_router(False)
+        self.assertRaises(ValueError, delete_router, True)
+        self.assertEqual({'count': 2, 'errors': 1}, dict((key, value) for key, value in
+                         self.metrics.snapshot()['ops']['delete_router'].items() if key != 'sum'))
+
+    def test_timed_generator(self):
+        @self.metrics.timed('get_l2_network_names')
+        def get_l2_network_names(fail):
+            yield '__OpenStack__net1'
+            if fail:
+                raise ValueError('timeout on netconf reply recv')
+            yield '__OpenStack__net2'
+
+        self.assertEqual(2, len(list(get_l2_network_names(False))))
+        self.assertRaises(ValueError, list, get_l2_network_names(True))
+        #closed by a consumer stopping early
+        names = get_l2_network_names(False)
+        next(names)
+        names.close()
+        self.assertEqual({'count': 3, 'errors': 1}, dict((key, value) for key, value in
+                         self.metrics.snapshot()['ops']['get_l2_network_names'].items() if key != 'sum'))
+
+    def test_statsd_sink(self):
+        self.metrics.sinks = [netconf_metrics.StatsdSink('127.0.0.1', 8125)]
+        self.metrics.sinks[0].sock = Mock()
+        self.metrics.in_flight_sources.append(lambda: 3)
+        self.metrics.send_queue_sources.append(lambda: 2)
+        self.metrics.observe('create_router', 0.25, error=True)
+        self.metrics.observe_send(0.002)
+        self.metrics.incr('reconnects')
+        self.metrics.sinks[0].flush(self.metrics)
+        self.assertEqual([b'kaloom.netconf.op.create_router:250|ms', b'kaloom.netconf.op.create_router.errors:1|c',
+                          b'kaloom.netconf.send:2|ms', b'kaloom.netconf.reconnects:1|c',
+                          b'kaloom.netconf.in_flight:3|g', b'kaloom.netconf.send_queue:2|g'],
+                         [call[0][0] for call in self.metrics.sinks[0].sock.sendto.call_args_list])
+
+    def test_unknown_sink(self):
+        self.assertRaises(ValueError, netconf_metrics.make_sink, 'http://127.0.0.1:9100')
+
+
+class KaloomNetconfClientMetricsTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfClientMetricsTestCase, self).setUp()
+        #metrics of the process, as recorded by the decorated KaloomNetconf ops.
+        self.metrics = netconf_metrics.METRICS
+        self.metrics.reset()
+        self.addCleanup(self.metrics.reset)
+        self.vfabric = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin')
+        self.vfabric._exec_netconf_cmd = Mock(return_value=kaloom_netconf.parse_xml(REPLY_OK))
+
+    def test_ops_observed(self):
+        self.vfabric.detach_tp_from_l2_network('__OpenStack__net1', 'tp-7')
+        self.vfabric._exec_netconf_cmd.side_effect = ValueError('timeout')
+        self.assertRaises(ValueError, self.vfabric.delete_l2_network, '__OpenStack__net1')
+        ops = self.metrics.snapshot()['ops']
+        self.assertEqual((1, 0), (ops['detach_tp_from_l2_network']['count'], ops['detach_tp_from_l2_network']['errors']))
+        self.assertEqual((1, 1), (ops['delete_l2_network']['count'], ops['delete_l2_network']['errors']))
+
+    def test_reply_size(self):
+        receiver = kaloom_netconf.KaloomNetconfRecv(Mock(), Mock())
+        #a frame in two pieces, as received
+        receiver.parser.feed(REPLY_OK[:10], False)
+        receiver.parser.feed(REPLY_OK[10:], True)
+        self.assertEqual({'count': 1, 'sum': len(REPLY_OK)}, self.metrics.snapshot()['reply_bytes'])
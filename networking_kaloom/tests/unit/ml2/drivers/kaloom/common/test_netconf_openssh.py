@@ -0,0 +1,80 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+
+from eventlet import greenthread
+from eventlet.green import subprocess
+from mock import patch
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_openssh
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_openssh import KaloomNetconfOpenSSHChannel
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_openssh import KaloomNetconfOpenSSHClient
+
+
+class KaloomNetconfOpenSSHClientTestCase(base.BaseTestCase):
+    def test_command(self):
+        client = KaloomNetconfOpenSSHClient(control_path='/run/kaloom/%C', options=['ProxyJump=bastion'])
+        command = client.command('vfabric', 830, 'admin', '/etc/kaloom/id_rsa', 20, 72)
+        self.assertEqual(['ssh', '-s', '-p', '830', '-l', 'admin', '-i', '/etc/kaloom/id_rsa'], command[:8])
+        self.assertEqual(['vfabric', 'netconf'], command[-2:])
+        options = command[9:-2:2]
+        self.assertEqual(['-o'] * len(options), command[8:-2:2])
+        for option in ('BatchMode=yes', 'ConnectTimeout=20', 'ServerAliveInterval=72', 'ControlMaster=auto',
+                       'ControlPath=/run/kaloom/%C', 'LogLevel=ERROR', 'StrictHostKeyChecking=no',
+                       'UserKnownHostsFile=/dev/null', 'ProxyJump=bastion'):
+            self.assertIn(option, options)
+        #accept-new is not known to OpenSSH before 7.6
+        self.assertFalse([option for option in options if 'accept-new' in option])
+        #without keepalive nor shared connection.
+        options = KaloomNetconfOpenSSHClient(control_path=None).command('vfabric', 830, 'admin', 'key', 20, 0)
+        self.assertFalse([option for option in options if option.startswith(('ServerAlive', 'Control'))])
+
+    def test_no_private_key(self):
+        self.assertRaisesRegexp(ValueError, 'needs a private key file',
+                                KaloomNetconfOpenSSHClient().connect, 'vfabric', 830, 'admin', '', 20)
+
+    def test_channel(self):
+        #cat echoes the chan, as ssh would relay it to the netconf subsystem.
+        client = KaloomNetconfOpenSSHClient(ssh='cat')
+        client.command = lambda *args: ['cat']
+        chan = client.connect('vfabric', 830, 'admin', '/etc/kaloom/id_rsa', 20)
+        self.assertTrue(client.is_active())
+        self.assertIs(client, client.get_transport())
+        #more than a pipe holds: written while read.
+        data = b'<rpc/>' * netconf_openssh.WRITE_SIZE
+        sender = greenthread.spawn(chan.sendall, data)
+        received = []
+        while sum(len(part) for part in received) < len(data):
+            received.append(chan.recv(65536))
+        sender.wait()
+        self.assertEqual(data, b''.join(received))
+        chan.settimeout(0.01)
+        self.assertRaises(socket.timeout, chan.recv, 65536)
+        client.close()
+        self.assertFalse(client.is_active())
+        self.assertIsNone(client.get_transport())
+        chan.close()
+
+    def test_process_exited(self):
+        process = subprocess.Popen(['sh', '-c', 'echo "Permission denied (publickey)." >&2'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process.wait()
+        chan = KaloomNetconfOpenSSHChannel(process)
+        with patch.object(netconf_openssh.LOG, 'warning') as warning:
+            self.assertEqual(b'', chan.recv(65536))
+            self.assertRaises(socket.error, chan.sendall, b'<rpc/>')
+            chan.close()
+        #logged once
+        warning.assert_called_once_with("vfabric netconf ssh process %s: %s", process.pid,
+                                        b'Permission denied (publickey).')
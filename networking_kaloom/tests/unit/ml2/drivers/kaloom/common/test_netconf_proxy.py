@@ -0,0 +1,100 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_framing
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_proxy
+
+RPC = b'''<?xml version="1.0" encoding="UTF-8"?>
+<rpc message-id="7" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><get/></rpc>'''
+
+EDIT_CONFIG = b'''<rpc message-id="6" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><edit-config/></rpc>'''
+
+CLOSE_SESSION = b'''<rpc message-id="8" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><close-session/></rpc>'''
+
+UPSTREAM_REPLY = b'''<rpc-reply message-id="1234" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><data/></rpc-reply>'''
+
+
+class KaloomNetconfProxyTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfProxyTestCase, self).setUp()
+        self.session_manager = Mock()
+        self.upstream = self.session_manager.connected.return_value
+        self.proxy = netconf_proxy.KaloomNetconfProxy(self.session_manager, '/tmp/kaloom_netconf_proxy.sock')
+        self.sock = Mock()
+        self.connection = netconf_proxy.KaloomNetconfProxyConnection(self.proxy, self.sock, 1)
+
+    def _sent(self):
+        frame = self.sock.sendall.call_args[0][0]
+        self.assertTrue(frame.endswith(netconf_framing.TERMINATOR))
+        return kaloom_netconf.parse_xml(frame[:-len(netconf_framing.TERMINATOR)])
+
+    def test_message_id_rewritten(self):
+        self.upstream.submit.return_value.result.return_value = kaloom_netconf.parse_xml(UPSTREAM_REPLY)
+        self.connection.handle_rpc(RPC)
+        self.proxy.pool.waitall()
+
+        #upstream message-id is written by the upstream session, when sent.
+        upstream_rpc = kaloom_netconf.parse_xml(self.upstream.submit.call_args[0][0].to_bytes(12))
+        self.assertEqual('12', upstream_rpc.get('message-id'))
+        self.assertEqual('7', self._sent().get('message-id'))
+
+    def test_upstream_error(self):
+        self.upstream.submit.return_value.result.side_effect = ValueError('timeout on netconf reply recv')
+        self.connection.handle_rpc(RPC)
+        self.proxy.pool.waitall()
+
+        reply = self._sent()
+        self.assertEqual('7', reply.get('message-id'))
+        self.assertEqual('timeout on netconf reply recv', kaloom_netconf.rpc_error_message(reply))
+
+    def test_close_session_is_local(self):
+        self.connection.handle_rpc(CLOSE_SESSION)
+
+        self.session_manager.connected.assert_not_called()
+        reply = self._sent()
+        self.assertEqual('8', reply.get('message-id'))
+        self.assertIsNotNone(reply.find(kaloom_netconf.TAG_NC_OK))
+        self.sock.shutdown.assert_called_once()
+
+    def test_rpcs_in_order_on_one_session(self):
+        self.session_manager.capabilities.return_value = [netconf_framing.BASE_1_0]
+        self.upstream.is_healthy.return_value = True
+        self.upstream.submit.return_value.result.return_value = kaloom_netconf.parse_xml(UPSTREAM_REPLY)
+        framing = netconf_framing.ChunkedDecoder()
+        self.sock.recv.side_effect = [kaloom_netconf.MESG_HELLO.strip() + netconf_framing.TERMINATOR,
+                                      framing.encode(EDIT_CONFIG) + framing.encode(RPC), b'']
+        self.connection.serve()
+        self.proxy.pool.waitall()
+
+        self.session_manager.connected.assert_called_once_with()
+        sent = [kaloom_netconf.parse_xml(call[0][0].to_bytes(1))[0].tag for call in self.upstream.submit.call_args_list]
+        self.assertEqual(['{%s}edit-config' % kaloom_netconf.NC_NS, '{%s}get' % kaloom_netconf.NC_NS], sent)
+
+        #another session once the session is lost
+        self.upstream.is_healthy.return_value = False
+        self.connection.handle_rpc(RPC)
+        self.assertEqual(2, self.session_manager.connected.call_count)
+
+    def test_hello_negotiates_chunked_framing(self):
+        client_hello = kaloom_netconf.MESG_HELLO.strip() + netconf_framing.TERMINATOR
+        first_rpc = netconf_framing.ChunkedDecoder().encode(RPC)
+        self.sock.recv.side_effect = [client_hello + first_rpc]
+
+        frames = self.connection._hello(set([netconf_framing.BASE_1_0, netconf_framing.BASE_1_1]))
+        self.assertIsInstance(self.connection.framing, netconf_framing.ChunkedDecoder)
+        self.assertEqual([RPC], [netconf_framing.frame_bytes(frame) for frame in frames])
+        server_hello = kaloom_netconf.parse_xml(self.sock.sendall.call_args[0][0][:-len(netconf_framing.TERMINATOR)])
+        self.assertIn(netconf_framing.BASE_1_1, kaloom_netconf.XPATH_CAPABILITY(server_hello))
@@ -0,0 +1,113 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import signal
+
+from mock import Mock, patch
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_recorder
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_recorder import KaloomNetconfFlightRecorder
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_recorder import PREVIEW_SIZE
+
+
+class KaloomNetconfFlightRecorderTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfFlightRecorderTestCase, self).setUp()
+        self.recorder = KaloomNetconfFlightRecorder(size=2)
+
+    def _record(self, msgid, error=None):
+        self.recorder.record('create_router', '42', msgid, 'interactive', 100.0, b'<edit-config/>',
+                             b'<rpc-reply/>' if error is None else None, error)
+
+    def test_dump(self):
+        self._record(1)
+        self._record(2, ValueError('timeout on netconf reply recv'))
+        records = self.recorder.dump()
+        self.assertEqual([1, 2], [record['msgid'] for record in records])
+        self.assertEqual({'operation': 'create_router', 'session_id': '42', 'msgid': 1,
+                          'request_class': 'interactive', 'submitted': 100.0, 'request': b'<edit-config/>',
+                          'reply': b'<rpc-reply/>', 'error': None},
+                         dict((k, v) for k, v in records[0].items() if k != 'completed'))
+        self.assertGreater(records[0]['completed'], records[0]['submitted'])
+        self.assertEqual('timeout on netconf reply recv', records[1]['error'])
+        text = self.recorder.format()
+        self.assertIn('last 2 rpcs', text)
+        self.assertIn('create_router', text)
+        self.assertIn("msgid 2: timeout on netconf reply recv\n  request: '<edit-config/>'\n  reply: None", text)
+
+    def test_oldest_dropped(self):
+        for msgid in range(1, 4):
+            self._record(msgid)
+        self.assertEqual([2, 3], [record['msgid'] for record in self.recorder.dump()])
+        with patch.object(netconf_recorder.registry, 'subscribe'):
+            self.recorder.configure(size=1, signame='')
+        self.assertEqual([3], [record['msgid'] for record in self.recorder.dump()])
+        with patch.object(netconf_recorder.registry, 'subscribe'):
+            self.recorder.configure(size=0, signame='')
+        self._record(4)
+        self.assertEqual([], self.recorder.dump())
+
+    def test_preview_cut(self):
+        self.recorder.record(None, '42', 1, 'bulk', 100.0, b'a' * (PREVIEW_SIZE + 1), b'b' * (PREVIEW_SIZE * 2), None)
+        record = self.recorder.dump()[0]
+        self.assertEqual(b'a' * PREVIEW_SIZE, record['request'])
+        self.assertEqual(b'b' * PREVIEW_SIZE, record['reply'])
+        self.assertIn(' rpc ', self.recorder.format())
+
+    def test_signal(self):
+        self.assertRaisesRegexp(ValueError, 'used by neutron-server', self.recorder.configure, 2, 'SIGUSR2')
+        self.assertRaisesRegexp(ValueError, 'unknown', self.recorder.configure, 2, 'SIG_IGN')
+        self.assertRaisesRegexp(ValueError, 'unknown', self.recorder.configure, 2, 'WINCH')
+        previous = Mock()
+        with patch.object(netconf_recorder.signal, 'signal', return_value=previous) as set_signal, \
+                patch.object(netconf_recorder.registry, 'subscribe') as subscribe:
+            self.recorder.configure(2, 'SIGWINCH')
+            set_signal.assert_called_once_with(signal.SIGWINCH, self.recorder._handle_signal)
+            #same signal: not installed again
+            self.recorder.configure(2, 'SIGWINCH')
+            self.assertEqual(1, set_signal.call_count)
+            self.recorder.configure(2, 'SIGURG')
+            set_signal.assert_any_call(signal.SIGWINCH, previous)
+            set_signal.assert_called_with(signal.SIGURG, self.recorder._handle_signal)
+            self.assertEqual(1, subscribe.call_count)
+            #reset by oslo_service in a forked worker
+            set_signal.reset_mock()
+            self.recorder._after_init('process', 'after_init', None)
+            set_signal.assert_called_once_with(signal.SIGURG, self.recorder._handle_signal)
+        with patch.object(netconf_recorder.greenthread, 'spawn_n') as spawn_n:
+            self.recorder._handle_signal(signal.SIGURG, None)
+            spawn_n.assert_called_once_with(self.recorder.log)
+
+    def test_future_recorded(self):
+        session = Mock(timeout_sec=90, netconf_session_id='42', active=3)
+        with patch.object(kaloom_netconf, 'RECORDER', self.recorder):
+            for msgid in (1, 2, 3):
+                future = kaloom_netconf.KaloomNetconfFuture(session, msgid)
+                future.priority, future.operation = 'interactive', 'delete_l2_network'
+                future.request = netconf_rpc.Rpc(b'<edit-config/>')
+                if msgid == 1:
+                    future.reply_preview = b'<rpc-reply message-id="1"><ok/></rpc-reply>'
+                    future.send(Mock())
+                    self.assertEqual(future.reply_preview, self.recorder.dump()[0]['reply'])
+                elif msgid == 2:
+                    future.send_exception(ValueError('receiver thread terminated'))
+                else:
+                    future.cancel('timeout')
+        records = self.recorder.dump()
+        self.assertEqual([2, 3], [record['msgid'] for record in records])
+        self.assertEqual(['receiver thread terminated', 'timeout'], [record['error'] for record in records])
+        self.assertEqual([None, None], [record['reply'] for record in records])
+        self.assertEqual([b'<edit-config/>'] * 2, [record['request'] for record in records])
+        self.assertEqual(['delete_l2_network'] * 2, [record['operation'] for record in records])
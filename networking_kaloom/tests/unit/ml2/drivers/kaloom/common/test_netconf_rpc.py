@@ -0,0 +1,61 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_rpc
+
+
+class NetconfRpcTestCase(base.BaseTestCase):
+    def test_template_minified(self):
+        template = netconf_rpc.Template("""
+            <node xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+              <node-id>%(name)s</node-id>
+            </node>
+        """)
+        self.assertEqual(b'<node xmlns="urn:ietf:params:xml:ns:yang:ietf-network"><node-id>net1</node-id></node>',
+                         template.fill(name='net1'))
+
+    def test_values_escaped(self):
+        template = netconf_rpc.Template('<name a="%(attr)s">%(name)s</name>')
+        xml = template.fill(attr='"x\'', name=u'<net & caf\xe9>')
+        self.assertEqual(b'<name a="&quot;x&apos;">&lt;net &amp; caf\xc3\xa9&gt;</name>', xml)
+        self.assertEqual(u'<net & caf\xe9>', kaloom_netconf.parse_xml(xml).text)
+
+    def test_message_id_attribute(self):
+        rpc = netconf_rpc.Template('<delete-router><node-id>%(id)s</node-id></delete-router>').rpc(id='message_id')
+        root = kaloom_netconf.parse_xml(rpc.to_bytes(42))
+        self.assertEqual('42', root.get('message-id'))
+        #a value that looks like the old placeholder is left alone.
+        self.assertEqual('message_id', root[0][0].text)
+
+    def test_get_config(self):
+        template = netconf_rpc.Template('<get><filter type="subtree"><node-id>%(name)s</node-id></filter></get>')
+        self.assertEqual(b'<get-config><source><running/></source><filter type="subtree"><node-id>net1</node-id></filter></get-config>',
+                         template.get_config().fill(name='net1'))
+        self.assertRaises(ValueError, netconf_rpc.Template('<commit/>').get_config)
+
+    def test_xpath_literal(self):
+        self.assertEqual("'__OpenStack__'", netconf_rpc.xpath_literal('__OpenStack__'))
+        self.assertEqual('"it\'s"', netconf_rpc.xpath_literal("it's"))
+        self.assertEqual('concat(\'a\', "\'", \'b"c\')', netconf_rpc.xpath_literal('a\'b"c'))
+
+    def test_edit_config(self):
+        rpc = netconf_rpc.edit_config(b'<networks xmlns="%s"/>' % kaloom_netconf.NW_NS.encode('ascii'),
+                                      'candidate', 'rollback-on-error')
+        edit_config = kaloom_netconf.parse_xml(rpc.to_bytes(1))[0]
+        nc = '{%s}' % netconf_rpc.NC_NS
+        self.assertEqual(nc + 'candidate', edit_config.find(nc + 'target')[0].tag)
+        self.assertEqual('none', edit_config.findtext(nc + 'default-operation'))
+        self.assertEqual('rollback-on-error', edit_config.findtext(nc + 'error-option'))
+        self.assertEqual('{%s}networks' % kaloom_netconf.NW_NS, edit_config.find(nc + 'config')[0].tag)
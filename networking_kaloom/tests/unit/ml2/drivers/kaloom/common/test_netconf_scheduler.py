@@ -0,0 +1,157 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from eventlet import greenthread
+from eventlet import Timeout
+from mock import Mock, patch
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import netconf_scheduler
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_metrics import METRICS
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_scheduler import BACKGROUND
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_scheduler import BULK
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_scheduler import INTERACTIVE
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_scheduler import KaloomNetconfRateLimiter
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_scheduler import KaloomNetconfScheduler
+
+
+class KaloomNetconfSchedulerTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfSchedulerTestCase, self).setUp()
+        self.scheduler = KaloomNetconfScheduler(window=2)
+        self.admitted = []
+
+    def _acquire(self, name):
+        def acquire():
+            self.scheduler.acquire(name)
+            self.admitted.append(name)
+        thread = greenthread.spawn(acquire)
+        greenthread.sleep(0)
+        return thread
+
+    def test_priority(self):
+        self.assertEqual(INTERACTIVE, netconf_scheduler.current_priority())
+        with netconf_scheduler.priority(BULK):
+            with netconf_scheduler.priority(BACKGROUND):
+                self.assertEqual(BACKGROUND, netconf_scheduler.current_priority())
+            self.assertEqual(BULK, netconf_scheduler.current_priority())
+        self.assertEqual(INTERACTIVE, netconf_scheduler.current_priority())
+        self.assertRaises(ValueError, netconf_scheduler.priority('urgent').__enter__)
+
+    def test_interactive_served_first(self):
+        self.scheduler.acquire(INTERACTIVE)
+        self.scheduler.acquire(INTERACTIVE)
+        bulk, background, interactive = self._acquire(BULK), self._acquire(BACKGROUND), self._acquire(INTERACTIVE)
+        self.assertEqual([], self.admitted)
+        self.assertEqual({'window': 2, 'waiting': {INTERACTIVE: 1, BACKGROUND: 1, BULK: 1}}, self.scheduler.stats())
+        self.scheduler.release(INTERACTIVE)
+        self.scheduler.release(INTERACTIVE)
+        interactive.wait()
+        background.wait()
+        #background and bulk share half of the window.
+        self.assertEqual([INTERACTIVE, BACKGROUND], self.admitted)
+        self.scheduler.release(BACKGROUND)
+        bulk.wait()
+        self.assertEqual([INTERACTIVE, BACKGROUND, BULK], self.admitted)
+
+    def test_background_leaves_room(self):
+        self.scheduler.acquire(BACKGROUND)
+        thread = self._acquire(BACKGROUND)
+        self.assertEqual([], self.admitted)
+        #not behind the background one.
+        self.scheduler.acquire(INTERACTIVE)
+        self.assertEqual(2, self.scheduler.in_flight)
+        self.scheduler.release(BACKGROUND)
+        thread.wait()
+        self.assertEqual([BACKGROUND], self.admitted)
+
+    def test_cancelled_waiter(self):
+        self.scheduler.acquire(INTERACTIVE)
+        self.scheduler.acquire(INTERACTIVE)
+        with Timeout(0.01, False):
+            self.scheduler.acquire(INTERACTIVE)
+        self.assertEqual(0, self.scheduler.stats()['waiting'][INTERACTIVE])
+        self.scheduler.release(INTERACTIVE)
+        self.assertEqual(1, self.scheduler.in_flight)
+
+    def test_deadline(self):
+        self.assertIsNone(netconf_scheduler.current_deadline())
+        with netconf_scheduler.deadline(10):
+            with netconf_scheduler.priority(BULK), netconf_scheduler.deadline(60):
+                self.assertLessEqual(netconf_scheduler.remaining(netconf_scheduler.current_deadline()), 10)
+                self.assertEqual(BULK, netconf_scheduler.current_priority())
+            with netconf_scheduler.deadline(0):
+                self.assertLessEqual(netconf_scheduler.remaining(netconf_scheduler.current_deadline()), 10)
+            with netconf_scheduler.deadline(0.01):
+                until = netconf_scheduler.current_deadline()
+                self.scheduler.acquire(INTERACTIVE, until)
+                self.scheduler.acquire(INTERACTIVE, until)
+                self.assertRaisesRegexp(ValueError, 'deadline exceeded waiting for a slot',
+                                        self.scheduler.acquire, INTERACTIVE, until)
+                self.assertEqual(0, self.scheduler.stats()['waiting'][INTERACTIVE])
+                self.assertRaisesRegexp(ValueError, 'deadline exceeded', self.scheduler.acquire, BULK, until)
+        self.assertEqual((INTERACTIVE, None, None), netconf_scheduler.current())
+
+    def test_operation(self):
+        with netconf_scheduler.deadline(10), netconf_scheduler.operation('create_router'):
+            with netconf_scheduler.priority(BULK):
+                priority, until, name = netconf_scheduler.current()
+                self.assertEqual((BULK, 'create_router'), (priority, name))
+                self.assertIsNotNone(until)
+        self.assertEqual((INTERACTIVE, None, None), netconf_scheduler.current())
+
+    def test_per_greenthread(self):
+        #green without monkey patching: contexts of interleaved greenthreads do not mix.
+        def run(delay):
+            with netconf_scheduler.priority(BULK), netconf_scheduler.deadline(10):
+                greenthread.sleep(delay)
+                inside = netconf_scheduler.current_priority()
+            return inside, netconf_scheduler.current()
+        threads = [greenthread.spawn(run, delay) for delay in (0.03, 0.01, 0.02)]
+        self.assertEqual([(BULK, (INTERACTIVE, None, None))] * 3, [thread.wait() for thread in threads])
+        self.assertEqual((INTERACTIVE, None, None), netconf_scheduler.current())
+
+    def test_queue_wait_metrics(self):
+        METRICS.reset()
+        self.addCleanup(METRICS.reset)
+        self.scheduler.acquire(INTERACTIVE)
+        self.scheduler.acquire(INTERACTIVE)
+        thread = self._acquire(BACKGROUND)
+        greenthread.sleep(0.01)
+        self.scheduler.release(INTERACTIVE)
+        thread.wait()
+        queue_wait = METRICS.snapshot()['queue_wait']
+        self.assertEqual(2, queue_wait[INTERACTIVE]['count'])
+        self.assertEqual(1, queue_wait[BACKGROUND]['count'])
+        self.assertGreater(queue_wait[BACKGROUND]['sum'], queue_wait[INTERACTIVE]['sum'])
+        self.assertIn('kaloom_netconf_queue_wait_seconds_count{class="background"} 1', METRICS.prometheus_text())
+
+
+class KaloomNetconfRateLimiterTestCase(base.BaseTestCase):
+    def test_rate(self):
+        clock = Mock(return_value=100.0)
+        limiter = KaloomNetconfRateLimiter(rate=2, clock=clock)
+        with patch.object(netconf_scheduler.greenthread, 'sleep') as sleep:
+            limiter.wait()
+            limiter.wait()
+            self.assertFalse(sleep.called)
+            #over the burst: waits its turn.
+            limiter.wait()
+            sleep.assert_called_once_with(0.5)
+            clock.return_value = 102.0
+            sleep.reset_mock()
+            limiter.wait()
+            self.assertFalse(sleep.called)
+            limiter.rate = 0
+            for i in range(10):
+                limiter.wait()
+            self.assertFalse(sleep.called)
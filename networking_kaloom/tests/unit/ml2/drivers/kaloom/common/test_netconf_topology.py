@@ -0,0 +1,209 @@
+# Copyright 2019 Kaloom, Inc.  All rights reserved.
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock, patch
+from neutron.tests import base
+from networking_kaloom.ml2.drivers.kaloom.common import kaloom_netconf
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconf
+from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconfSessionManager
+from networking_kaloom.ml2.drivers.kaloom.common.netconf_topology import KaloomTopologyMirror
+
+PREFIX = '__OpenStack__'
+
+REPLY_TOPOLOGY = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>1</network-id>
+    <node>
+     <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology">
+      <tp-id>tp-7</tp-id>
+      <annotations xmlns="urn:kaloom:faas:virtual-fabric">
+       <the-key>OpenStack_OVS_Host</the-key>
+       <value>compute-1</value>
+      </annotations>
+     </termination-point>
+    </node>
+   </network>
+   <network>
+    <network-id>2</network-id>
+    <node>
+     <node-id>__OpenStack__net1</node-id>
+     <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+      <KNID xmlns="urn:kaloom:faas:vfabric-l2-topology">1234</KNID>
+     </l2-node-attributes>
+    </node>
+    <node>
+     <node-id>user_net</node-id>
+     <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+      <KNID xmlns="urn:kaloom:faas:vfabric-l2-topology">99</KNID>
+     </l2-node-attributes>
+    </node>
+   </network>
+   <network>
+    <network-id>3</network-id>
+    <node>
+     <node-id>r-1</node-id>
+     <l3-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology">
+      <name>__OpenStack__router1</name>
+     </l3-node-attributes>
+     <termination-point xmlns="urn:ietf:params:xml:ns:yang:ietf-network-topology">
+      <tp-id>1</tp-id>
+      <supporting-termination-point>
+       <network-ref>2</network-ref>
+       <node-ref>__OpenStack__net1</node-ref>
+       <tp-ref>1</tp-ref>
+      </supporting-termination-point>
+      <l3-termination-point-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l3-unicast-topology">
+       <interface-name xmlns="urn:kaloom:faas:vfabric-l3-unicast-topology">net1</interface-name>
+      </l3-termination-point-attributes>
+     </termination-point>
+     <interfaces xmlns="urn:kaloom:faas:vfabric-interfaces">
+      <interface>
+       <name>net1</name>
+       <ipv4 xmlns="urn:kaloom:faas:vfabric-ip">
+        <address><ip>192.168.1.1</ip><prefix-length>24</prefix-length></address>
+       </ipv4>
+      </interface>
+     </interfaces>
+    </node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_L2_NETWORK2 = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="2">
+ <data>
+  <networks xmlns="urn:ietf:params:xml:ns:yang:ietf-network">
+   <network>
+    <network-id>2</network-id>
+    <node>
+     <node-id>__OpenStack__net2</node-id>
+     <l2-node-attributes xmlns="urn:ietf:params:xml:ns:yang:ietf-l2-topology">
+      <KNID xmlns="urn:kaloom:faas:vfabric-l2-topology">5678</KNID>
+     </l2-node-attributes>
+    </node>
+   </network>
+  </networks>
+ </data>
+</rpc-reply>'''
+
+REPLY_EMPTY = b'''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="3"><data/></rpc-reply>'''
+
+NOTIFICATION = b'''<notification xmlns="urn:ietf:params:xml:ns:netconf:notification:1.0">
+ <eventTime>2019-05-01T10:00:00Z</eventTime>
+ <netconf-config-change xmlns="urn:ietf:params:xml:ns:yang:ietf-netconf-notifications">
+  <datastore>running</datastore>
+  %s
+ </netconf-config-change>
+</notification>'''
+
+EDIT = b'''<edit><target xmlns:nw="urn:ietf:params:xml:ns:yang:ietf-network">%s</target><operation>%s</operation></edit>'''
+
+
+def notification(*edits):
+    return kaloom_netconf.parse_xml(NOTIFICATION % b''.join(EDIT % edit for edit in edits))
+
+
+class KaloomTopologyMirrorTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomTopologyMirrorTestCase, self).setUp()
+        self.mirror = KaloomTopologyMirror(Mock(), PREFIX)
+        self._reply(REPLY_TOPOLOGY)
+        self.mirror._load()
+
+    def _reply(self, msg):
+        self.mirror.session_manager.rpc = Mock(return_value=kaloom_netconf.parse_xml(msg))
+
+    def test_load(self):
+        self.assertTrue(self.mirror.synced)
+        self.assertEqual(['__OpenStack__net1'], self.mirror.l2_network_names())
+        self.assertEqual({'kaloom_knid': 1234}, self.mirror.l2_network('__OpenStack__net1'))
+        self.assertEqual({'name': 'compute-1', 'id': 'tp-7'}, self.mirror.tp('compute-1'))
+        self.assertEqual([('__OpenStack__router1', 'r-1')], self.mirror.router_name_ids())
+        self.assertEqual({'node_id': 'r-1', 'interface': 'net1', 'cidrs': ['192.168.1.1/24']},
+                         self.mirror.router_interface_info('__OpenStack__router1', '__OpenStack__net1'))
+
+    def test_notification_refreshes_node(self):
+        self.mirror._notification(notification(
+            (b"/nw:networks/nw:network[nw:network-id='2']/nw:node[nw:node-id='__OpenStack__net2']", b'create'),
+            (b"/nw:networks/nw:network[nw:network-id='2']/nw:node[nw:node-id='user_net2']", b'create')))
+        self.assertEqual(set([('l2', '__OpenStack__net2')]), self.mirror.stale)
+
+        self._reply(REPLY_L2_NETWORK2)
+        self.assertEqual({'kaloom_knid': 5678}, self.mirror.l2_network('__OpenStack__net2'))
+        self.assertEqual(set(), self.mirror.stale)
+        #fresh nodes are not fetched again.
+        self.assertEqual({'kaloom_knid': 5678}, self.mirror.l2_network('__OpenStack__net2'))
+        self.assertEqual(1, self.mirror.session_manager.rpc.call_count)
+
+    def test_notification_deleted_router(self):
+        self.mirror._notification(notification(
+            (b'/nw:networks/nw:network[nw:network-id="3"]/nw:node[nw:node-id="r-1"]', b'delete')))
+        self._reply(REPLY_EMPTY)
+        self.assertIsNone(self.mirror.router_id('__OpenStack__router1'))
+
+    def test_notification_without_node_loads_again(self):
+        self.mirror._notification(notification((b"/nw:networks/nw:network[nw:network-id='3']", b'replace')))
+        self.assertFalse(self.mirror.synced)
+        self.assertIn(('all',), self.mirror.stale)
+
+    def test_failed_refresh_stays_stale(self):
+        self.mirror.invalidate(('router', 'r-1'))
+        self.mirror.session_manager.rpc = Mock(side_effect=ValueError('timeout'))
+        self.assertRaises(ValueError, self.mirror.router_id, '__OpenStack__router1')
+        self.assertEqual(set([('router', 'r-1')]), self.mirror.stale)
+
+
+class KaloomNetconfMirrorTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(KaloomNetconfMirrorTestCase, self).setUp()
+        self.vfabric = KaloomNetconf('127.0.0.1', 830, 'admin', '', 'admin')
+        self.vfabric._exec_netconf_cmd = Mock(return_value=kaloom_netconf.parse_xml(REPLY_EMPTY))
+        self.vfabric._stream_netconf_cmd = Mock(return_value=[])
+        patcher = patch.object(KaloomNetconfSessionManager, 'capabilities', return_value=frozenset())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.dict(KaloomTopologyMirror._mirrors)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mirror = KaloomTopologyMirror.attach(self.vfabric, PREFIX)
+        self.mirror.start = Mock()
+        self.mirror.session_manager = Mock()
+        self.mirror.session_manager.rpc = Mock(return_value=kaloom_netconf.parse_xml(REPLY_TOPOLOGY))
+
+    def test_lookups_before_load(self):
+        list(self.vfabric.get_l2_network_names(PREFIX))
+        self.mirror.start.assert_called_once_with()
+        self.assertEqual(1, self.vfabric._stream_netconf_cmd.call_count)
+
+    def test_lookups_from_mirror(self):
+        self.mirror._load()
+        self.assertEqual(['__OpenStack__net1'], list(self.vfabric.get_l2_network_names(PREFIX)))
+        self.assertEqual({'kaloom_knid': 1234}, self.vfabric.get_l2_network_by_name('__OpenStack__net1'))
+        self.assertEqual({'name': 'compute-1', 'id': 'tp-7'}, self.vfabric.get_tp_by_annotation('compute-1'))
+        self.assertEqual('r-1', self.vfabric.get_router_id_by_name('__OpenStack__router1'))
+        self.assertFalse(self.vfabric._exec_netconf_cmd.called)
+        self.assertFalse(self.vfabric._stream_netconf_cmd.called)
+        #not mirrored: queried
+        self.vfabric.get_l2_network_by_name('user_net')
+        self.assertEqual(1, self.vfabric._exec_netconf_cmd.call_count)
+
+    def test_write_marks_stale(self):
+        self.mirror._load()
+        self.vfabric._exec_netconf_cmd.return_value = kaloom_netconf.parse_xml(
+            b'<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1"><ok/></rpc-reply>')
+        self.vfabric.delete_router('r-1')
+        self.assertEqual(set([('router', 'r-1')]), self.mirror.stale)
+        self.mirror.session_manager.rpc.return_value = kaloom_netconf.parse_xml(REPLY_EMPTY)
+        self.assertEqual([], list(self.vfabric.list_router_name_id()))
@@ -13,11 +13,12 @@
 
 from neutron.tests import base
 from neutron.db import api as db_api
-from mock import patch, call
+from mock import MagicMock, Mock, patch, call
 
 from neutron_lib import constants as nconst
 from neutron_lib.plugins.ml2 import api
 
+from networking_kaloom.ml2.drivers.kaloom.mech_driver import mech_kaloom
 from networking_kaloom.ml2.drivers.kaloom.mech_driver.mech_kaloom import KaloomOVSMechanismDriver,KaloomKVSMechanismDriver, LOG
 from networking_kaloom.ml2.drivers.kaloom.mech_driver.pool import KaloomVlanPool
 from networking_kaloom.ml2.drivers.kaloom.common.kaloom_netconf import KaloomNetconf
@@ -107,3 +108,68 @@ class KaloomMechanismDriverTestCase(base.AgentMechanismBaseTestCase):
             self.driver_kvs.bind_port(context)
             log_info_call.assert_has_calls(log_calls)
         # assert False
+
+
+class KaloomL2CleanupWorkerTestCase(base.AgentMechanismBaseTestCase):
+    def setUp(self):
+        super(KaloomL2CleanupWorkerTestCase, self).setUp()
+        #a new worker per test, not the singleton of a previous one.
+        instances = mech_kaloom.Singleton._instances
+        saved = dict(instances)
+        instances.clear()
+        self.addCleanup(instances.update, saved)
+        self.addCleanup(instances.clear)
+
+    def test_resync_recreates_missing_networks(self):
+        prefix = '__OpenStack__'
+        vfabric = MagicMock()
+        vfabric.get_l2_network_names.return_value = ['__OpenStack__net1']
+        vfabric.create_l2_network.return_value = {'kaloom_knid': 8}
+        worker = mech_kaloom.KaloomL2CleanupWorker(vfabric, prefix)
+        networks = [Mock(id='net1'), Mock(id='net2'), Mock(id='net3')]
+        for network in networks:
+            network.name = 'name'
+        #net3 is not a kaloom_knid network: not created by the driver.
+        mappings = {'net2': Mock(kaloom_knid=7)}
+        with patch.object(mech_kaloom.kaloom_db, 'get_networks', return_value=networks), \
+                patch.object(mech_kaloom.kaloom_db, 'get_knid_mapping',
+                             side_effect=lambda network_id: mappings.get(network_id)), \
+                patch.object(mech_kaloom.kaloom_db, 'delete_knid_mapping') as delete_mapping, \
+                patch.object(mech_kaloom.kaloom_db, 'create_knid_mapping') as create_mapping, \
+                patch.object(worker, '_cleanup') as cleanup, patch.object(LOG, 'info'):
+            worker.resync()
+        vfabric.cache.clear.assert_called_once_with()
+        self.assertEqual(1, vfabric.create_l2_network.call_count)
+        self.assertEqual('__OpenStack__net2', vfabric.create_l2_network.call_args[0][0])
+        #recreated with a new KNID
+        delete_mapping.assert_called_once_with('net2')
+        create_mapping.assert_called_once_with(kaloom_knid=8, network_id='net2')
+        cleanup.assert_called_once_with()
+
+    def test_subscribed_while_started(self):
+        vfabric = MagicMock()
+        worker = mech_kaloom.KaloomL2CleanupWorker(vfabric, '__OpenStack__')
+        with patch.object(mech_kaloom.loopingcall, 'FixedIntervalLoopingCall'):
+            worker.start()
+            vfabric.on_reconnect.assert_called_once_with(worker.resync)
+            worker.stop()
+            vfabric.off_reconnect.assert_called_once_with(worker.resync)
+
+    def test_new_vfabric_subscribed(self):
+        old_vfabric, new_vfabric = MagicMock(), MagicMock()
+        worker = mech_kaloom.KaloomL2CleanupWorker(old_vfabric, '__OpenStack__')
+        with patch.object(mech_kaloom.loopingcall, 'FixedIntervalLoopingCall'):
+            worker.start()
+            #driver initialized again: same worker, new vfabric
+            self.assertIs(worker, mech_kaloom.KaloomL2CleanupWorker(new_vfabric, '__OpenStack__'))
+            worker.use(new_vfabric, '__OpenStack__')
+            self.assertIs(new_vfabric, worker.vfabric)
+            old_vfabric.off_reconnect.assert_called_once_with(worker.resync)
+            new_vfabric.on_reconnect.assert_called_once_with(worker.resync)
+            worker.stop()
+            new_vfabric.off_reconnect.assert_called_once_with(worker.resync)
+            self.assertEqual(1, old_vfabric.off_reconnect.call_count)
+        #not started: subscribed on start only
+        stopped = MagicMock()
+        worker.use(stopped, '__OpenStack__')
+        self.assertFalse(stopped.on_reconnect.called)
@@ -42,13 +42,27 @@ class KaloomL3DriverTestCase(base.BaseTestCase):
     def setUp(self, mock_KaloomNetconf):
         super(KaloomL3DriverTestCase, self).setUp()
         self.driver = kaloom_l3_driver.KaloomL3Driver(self.PREFIX)
-        self.mock_KaloomNetconf_instance = mock_KaloomNetconf.return_value
+        self.mock_KaloomNetconf_instance = mock_KaloomNetconf.from_config.return_value
 
     def tearDown(self):
         super(KaloomL3DriverTestCase, self).tearDown()
         self.mock_KaloomNetconf_instance.reset_mock()
         LOG.error.reset_mock()
     
+    def test_create_routers(self):
+        created, failed = Mock(), Mock()
+        failed.result.side_effect = ValueError('unique duplicate constraint')
+        self.mock_KaloomNetconf_instance.submit_create_router = Mock(side_effect = [created, failed])
+        routers = [{'id': uuidutils.generate_uuid(), 'name': 'router1'},
+                   {'id': uuidutils.generate_uuid(), 'name': 'router2'}]
+        errors = self.driver.create_routers(self.DB_CONTEXT, routers)
+
+        #both rpcs are sent before any reply is waited for
+        self.assertEqual(2, self.mock_KaloomNetconf_instance.submit_create_router.call_count)
+        failed_router_name = utils._kaloom_router_name(self.PREFIX, routers[1]['id'], routers[1]['name'])
+        self.assertEqual([failed_router_name], list(errors))
+        LOG.error.assert_called_once()
+
     def test_add_router_interface_first_time(self):
         self.mock_KaloomNetconf_instance.get_router_interface_info = Mock(return_value = self.ROUTER_INTERFACE_INFO_FIRST_TIME)
         self.driver.add_router_interface(self.DB_CONTEXT, self.ROUTER_INFO)
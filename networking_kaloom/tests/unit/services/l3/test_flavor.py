@@ -55,7 +55,7 @@ class KaloomL3ServiceProviderTestCase(base.BaseTestCase):
         router = self._get_mock_router_kwargs('create')
         router['router_id'] = router['router']['id']
         
-        mock_KaloomNetconf_instance = self.mock_KaloomNetconf.return_value
+        mock_KaloomNetconf_instance = self.mock_KaloomNetconf.from_config.return_value
         with mock.patch.object(self.flavor_driver,
                                '_validate_l3_flavor',
                                return_value=True):
@@ -67,7 +67,7 @@ class KaloomL3ServiceProviderTestCase(base.BaseTestCase):
         router = self._get_mock_router_kwargs('delete')
         router['router_id'] = router['original']['id']
 
-        mock_KaloomNetconf_instance = self.mock_KaloomNetconf.return_value
+        mock_KaloomNetconf_instance = self.mock_KaloomNetconf.from_config.return_value
         vfabric_router_id = uuidutils.generate_uuid()
         mock_KaloomNetconf_instance.get_router_id_by_name.return_value = vfabric_router_id
 
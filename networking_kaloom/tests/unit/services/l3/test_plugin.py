@@ -228,7 +228,7 @@ class KaloomL3ServicePluginTestCase(base.BaseTestCase):
         with patcher:
             patcher.is_local = True #avoids delattr error
             l3_plugin = plugin.KaloomL3ServicePlugin()
-            mock_KaloomNetconf_instance = mock_KaloomNetconf.return_value
+            mock_KaloomNetconf_instance = mock_KaloomNetconf.from_config.return_value
 
             router = test_helper.get_mock_router_kwargs()
             # creates a router
@@ -405,3 +405,19 @@ class KaloomL3ServicePluginTestCase(base.BaseTestCase):
             # unset_external_gateway completes.
             assert mock_KaloomL3Driver_instance.method_calls[0] == call.remove_router_interface(ANY, ANY)
             assert mock_KaloomL3Driver_instance.method_calls[1] == call.add_router_interface(ANY, ANY)
+
+
+class KaloomL3SyncWorkerTestCase(base.BaseTestCase):
+    def test_resync_on_reconnect(self):
+        driver = MagicMock()
+        l3_sync_worker = plugin.KaloomL3SyncWorker(driver, '__OpenStack__')
+        with patch.object(plugin.loopingcall, 'FixedIntervalLoopingCall'):
+            l3_sync_worker.start()
+        driver.vfabric.on_reconnect.assert_called_once_with(l3_sync_worker.resync)
+        with patch.object(l3_sync_worker, '_synchronize') as synchronize:
+            l3_sync_worker.resync()
+        synchronize.assert_called_once_with()
+        driver.vfabric.cache.clear.assert_called_once_with()
+        driver.vfabric.priority.assert_called_once_with(plugin.netconf_scheduler.INTERACTIVE)
+        l3_sync_worker.stop()
+        driver.vfabric.off_reconnect.assert_called_once_with(l3_sync_worker.resync)